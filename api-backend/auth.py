@@ -2,13 +2,16 @@
 # PASTE THIS ENTIRE BLOCK
 
 import os
+import hashlib
+import threading
 import firebase_admin
 from firebase_admin import credentials, auth
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from db import get_db
-from models import User, Workspace
+from cache import ExpiringLRUCache
+from identity import CurrentUser, CurrentWorkspace, Identity, resolve_identity
 
 # Initialize Firebase Admin
 # This happens automatically on Google Cloud Run
@@ -20,14 +23,84 @@ except ValueError:
 # This dependency will look for a Bearer token in the Authorization header
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Verified ID tokens are cached until their own 'exp', keyed by a digest of the
+# token so the raw bearer token is never kept in memory as a dict key.
+TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
+PUBLIC_KEY_REFRESH_SECONDS = int(os.environ.get("AUTH_PUBLIC_KEY_REFRESH_SECONDS", "300"))
+
+token_cache = ExpiringLRUCache(max_size=TOKEN_CACHE_SIZE)
+
+_key_refresher_stop = threading.Event()
+_key_refresher_thread = None
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def refresh_public_keys() -> bool:
+    """
+    Fetch Firebase's token signing certificates through the same cached HTTP
+    request object that verify_id_token uses, so the certificate cache is
+    always warm and a key rotation is picked up here instead of on a request.
+
+    That object is a firebase_admin internal (stable across the versions
+    pinned in requirements.txt). If it isn't where we expect, returns False:
+    verify_id_token then simply fetches the certificates itself when needed.
+    """
+    try:
+        client = auth._get_client(firebase_admin.get_app())
+        verifier = client._token_verifier
+        request, cert_url = verifier.request, verifier.id_token_verifier.cert_url
+    except AttributeError as e:
+        print(f"Cannot prefetch Firebase public keys with this firebase_admin version: {e}")
+        return False
+    request(url=cert_url, method="GET")
+    return True
+
+
+def _public_key_refresh_loop():
+    while not _key_refresher_stop.is_set():
+        try:
+            if not refresh_public_keys():
+                return
+        except Exception as e:
+            print(f"Failed to refresh Firebase public keys: {e}")
+        _key_refresher_stop.wait(PUBLIC_KEY_REFRESH_SECONDS)
+
+
+def start_public_key_refresher():
+    """Prefetch the public keys and keep refreshing them in a daemon thread."""
+    global _key_refresher_thread
+    if _key_refresher_thread is not None:
+        return
+    _key_refresher_stop.clear()
+    _key_refresher_thread = threading.Thread(
+        target=_public_key_refresh_loop, name="firebase-key-refresher", daemon=True
+    )
+    _key_refresher_thread.start()
+
+
+def stop_public_key_refresher():
+    global _key_refresher_thread
+    _key_refresher_stop.set()
+    _key_refresher_thread = None
+
+
 def get_firebase_user(token: str = Depends(oauth2_scheme)):
     """
     Verifies the Firebase ID Token.
     Returns the decoded token (a dict with user info).
     """
+    digest = _token_digest(token)
+    cached_token = token_cache.get(digest)
+    if cached_token is not None:
+        return dict(cached_token)
+
     try:
         decoded_token = auth.verify_id_token(token)
-        return decoded_token
+        token_cache.set(digest, decoded_token, expires_at=decoded_token["exp"])
+        return dict(decoded_token)
     except auth.ExpiredIdTokenError:
         # ---- THIS IS THE FIX ----
         # The 'raise' line MUST be indented
@@ -48,45 +121,23 @@ def get_firebase_user(token: str = Depends(oauth2_scheme)):
             detail="Invalid authentication credentials",
         )
 
-def get_or_create_user(
+def get_current_identity(
     db: Session = Depends(get_db),
     firebase_user: dict = Depends(get_firebase_user)
-) -> User:
+) -> Identity:
     """
     This is the core dependency for all protected routes.
-    It verifies the Firebase token AND gets/creates our internal user in Postgres.
+    It verifies the Firebase token AND resolves (or creates) our internal
+    user and their workspace in Postgres.
     """
-    firebase_uid = firebase_user["uid"]
-    user_email = firebase_user.get("email")
-
-    # Check if user already exists in our Postgres DB
-    db_user = db.query(User).filter(User.firebase_uid == firebase_uid).first()
+    return resolve_identity(db, firebase_user["uid"], firebase_user.get("email"))
 
-    if db_user:
-        return db_user
 
-    # User does not exist in Postgres, so let's create them
-    if not user_email:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Firebase user has no email. Cannot create Arcanext account.",
-        )
+def get_or_create_user(identity: Identity = Depends(get_current_identity)) -> CurrentUser:
+    """The current user, for routes that don't care about the workspace"""
+    return identity.user
 
-    # Create the new user
-    new_user = User(
-        firebase_uid=firebase_uid,
-        email=user_email
-    )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-
-    # Also create their default workspace
-    new_workspace = Workspace(
-        owner_id=new_user.id,
-        plan_level='free'  # Default plan
-    )
-    db.add(new_workspace)
-    db.commit()
 
-    return new_user
\ No newline at end of file
+def get_current_workspace(identity: Identity = Depends(get_current_identity)) -> CurrentWorkspace:
+    """The current user's workspace (users have one workspace for now)"""
+    return identity.workspace
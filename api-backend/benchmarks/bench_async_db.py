@@ -0,0 +1,106 @@
+"""
+Event-loop blocking benchmark: sync vs async database sessions in async routes.
+
+Runs a throwaway FastAPI app in-process (over httpx's ASGI transport, so the
+app and the load generator share one event loop, exactly like uvicorn) with:
+  - /slow-sync   an async handler doing a slow query on a sync Session (before)
+  - /slow-async  the same query on an AsyncSession (after)
+  - /fast        an async handler that does no I/O at all
+
+For each mode it fires a mixed load of slow and fast requests concurrently and
+reports p50/p99 latency. With sync sessions the fast requests queue behind
+every slow query; with async sessions they stay flat.
+
+Usage (needs a reachable Postgres):
+    DATABASE_URL=postgresql://... python benchmarks/bench_async_db.py
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from db import get_db
+from async_db import async_engine, get_async_db
+
+QUERY_SECONDS = float(os.environ.get("BENCH_QUERY_SECONDS", "0.05"))
+SLOW_REQUESTS = int(os.environ.get("BENCH_SLOW_REQUESTS", "50"))
+FAST_REQUESTS = int(os.environ.get("BENCH_FAST_REQUESTS", "500"))
+
+app = FastAPI()
+
+
+@app.get("/slow-sync")
+async def slow_sync(db: Session = Depends(get_db)):
+    db.execute(text("SELECT pg_sleep(:s)"), {"s": QUERY_SECONDS})
+    return {"ok": True}
+
+
+@app.get("/slow-async")
+async def slow_async(db: AsyncSession = Depends(get_async_db)):
+    await db.execute(text("SELECT pg_sleep(:s)"), {"s": QUERY_SECONDS})
+    return {"ok": True}
+
+
+@app.get("/fast")
+async def fast():
+    return {"ok": True}
+
+
+async def timed_get(client: httpx.AsyncClient, path: str) -> float:
+    start = time.perf_counter()
+    response = await client.get(path)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_mode(client: httpx.AsyncClient, slow_path: str) -> dict:
+    slow = [timed_get(client, slow_path) for _ in range(SLOW_REQUESTS)]
+    fast = [timed_get(client, "/fast") for _ in range(FAST_REQUESTS)]
+    results = await asyncio.gather(*slow, *fast)
+    slow_times, fast_times = results[:SLOW_REQUESTS], results[SLOW_REQUESTS:]
+    return {
+        "slow_p50": statistics.median(slow_times),
+        "slow_p99": percentile(slow_times, 99),
+        "fast_p50": statistics.median(fast_times),
+        "fast_p99": percentile(fast_times, 99),
+    }
+
+
+async def main():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm both connection pools before measuring
+        await client.get("/slow-sync")
+        await client.get("/slow-async")
+
+        print(f"{SLOW_REQUESTS} slow ({QUERY_SECONDS * 1000:.0f}ms query) + {FAST_REQUESTS} fast requests, concurrently")
+        print(f"{'mode':<12}{'slow p50':>12}{'slow p99':>12}{'fast p50':>12}{'fast p99':>12}")
+        for label, path in (("sync", "/slow-sync"), ("async", "/slow-async")):
+            stats = await run_mode(client, path)
+            print(
+                f"{label:<12}"
+                f"{stats['slow_p50'] * 1000:>10.1f}ms"
+                f"{stats['slow_p99'] * 1000:>10.1f}ms"
+                f"{stats['fast_p50'] * 1000:>10.1f}ms"
+                f"{stats['fast_p99'] * 1000:>10.1f}ms"
+            )
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
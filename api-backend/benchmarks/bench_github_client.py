@@ -0,0 +1,78 @@
+"""
+GitHub call latency: a fresh httpx.AsyncClient per call (what the handlers
+used to do) vs the shared, pooled client from github_client.py.
+
+Start the fake GitHub first, then point GITHUB_API_URL at it:
+    uvicorn benchmarks.fake_github:app --port 9443 --ssl-keyfile key.pem --ssl-certfile cert.pem
+    SSL_CERT_FILE=cert.pem GITHUB_API_URL=https://localhost:9443 python benchmarks/bench_github_client.py
+
+Plain http:// works too, but then only TCP setup (no TLS handshake) is saved.
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from github_client import DEFAULT_HEADERS, GITHUB_API_URL, close_github_client, get_github_client
+
+REQUESTS = int(os.environ.get("BENCH_REQUESTS", "200"))
+CONCURRENCY = int(os.environ.get("BENCH_CONCURRENCY", "10"))
+PATH = os.environ.get("BENCH_PATH", "/repos/fake-org/repo-1")
+
+
+async def fresh_client_call() -> float:
+    start = time.perf_counter()
+    async with httpx.AsyncClient(base_url=GITHUB_API_URL, headers=DEFAULT_HEADERS) as client:
+        response = await client.get(PATH, headers={"Authorization": "token bench"})
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def pooled_client_call() -> float:
+    start = time.perf_counter()
+    response = await get_github_client().get(PATH, headers={"Authorization": "token bench"})
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def run(call) -> list:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def bounded():
+        async with semaphore:
+            return await call()
+
+    return await asyncio.gather(*(bounded() for _ in range(REQUESTS)))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def main():
+    # Warm up DNS and the pool so the pooled run measures steady state
+    await pooled_client_call()
+
+    print(f"{REQUESTS} x GET {GITHUB_API_URL}{PATH}, concurrency {CONCURRENCY}")
+    print(f"{'client':<10}{'p50':>10}{'p99':>10}{'total':>10}")
+    for label, call in (("fresh", fresh_client_call), ("pooled", pooled_client_call)):
+        start = time.perf_counter()
+        samples = await run(call)
+        total = time.perf_counter() - start
+        print(
+            f"{label:<10}"
+            f"{statistics.median(samples) * 1000:>8.1f}ms"
+            f"{percentile(samples, 99) * 1000:>8.1f}ms"
+            f"{total:>9.2f}s"
+        )
+
+    await close_github_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+"""
+Listing a large org: following rel="next" one page at a time vs the
+concurrent fan-out in github_pages.py.
+
+    FAKE_GITHUB_REPO_COUNT=2000 uvicorn benchmarks.fake_github:app --port 9000
+    GITHUB_API_URL=http://localhost:9000 python benchmarks/bench_github_pagination.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from github_client import close_github_client, get_github_client
+from github_pages import GITHUB_PAGE_CONCURRENCY, GITHUB_PAGE_SIZE, fetch_all_github_pages, parse_link_header
+
+RUNS = int(os.environ.get("BENCH_RUNS", "5"))
+AUTH = "token bench"
+
+
+async def sequential() -> int:
+    client = get_github_client()
+    url = f"/user/repos?per_page={GITHUB_PAGE_SIZE}"
+    repos = 0
+    while url:
+        response = await client.get(url, headers={"Authorization": AUTH})
+        response.raise_for_status()
+        repos += len(response.json())
+        url = parse_link_header(response.headers.get("Link", "")).get("next")
+    return repos
+
+
+async def concurrent() -> int:
+    # A fresh principal per run so the conditional cache doesn't turn pages into 304s
+    return len(await fetch_all_github_pages("/user/repos", AUTH, principal=f"bench-{time.perf_counter()}"))
+
+
+async def main():
+    await sequential()  # warm the connection pool
+    print(f"page size {GITHUB_PAGE_SIZE}, fan-out {GITHUB_PAGE_CONCURRENCY}, {RUNS} runs each")
+    for label, listing in (("sequential", sequential), ("concurrent", concurrent)):
+        timings = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            repos = await listing()
+            timings.append(time.perf_counter() - start)
+        print(f"{label:<12}{repos:>6} repos  best {min(timings) * 1000:>8.1f}ms  worst {max(timings) * 1000:>8.1f}ms")
+    await close_github_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
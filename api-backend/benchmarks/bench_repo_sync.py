@@ -0,0 +1,104 @@
+"""
+Installation sync cost: the old per-repository SELECT + INSERT loop vs
+bulk_sync_repositories, at 10 / 100 / 1,000 / 10,000 repositories.
+
+Each size runs against a fresh throwaway workspace, first as an initial sync
+(everything new) and then as a re-sync (nothing new), which is what most
+dashboard-triggered syncs look like.
+
+Usage (needs a reachable Postgres with the schema created):
+    DATABASE_URL=postgresql://... python benchmarks/bench_repo_sync.py
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, select
+from async_db import AsyncSessionLocal, async_engine
+from models import Repository, User, Workspace
+from repository_service import bulk_sync_repositories
+
+SIZES = [int(n) for n in os.environ.get("BENCH_SIZES", "10,100,1000,10000").split(",")]
+
+
+def fake_repos(count: int) -> list:
+    return [{"id": 500000 + i, "full_name": f"bench-org/repo-{i}"} for i in range(count)]
+
+
+async def per_repo_sync(db, workspace_id, repos):
+    """What sync_github_app_installation used to do"""
+    for repo in repos:
+        existing = (await db.execute(
+            select(Repository).where(
+                Repository.workspace_id == workspace_id,
+                Repository.repo_name == repo["full_name"]
+            ).limit(1)
+        )).scalar_one_or_none()
+        if not existing:
+            db.add(Repository(
+                workspace_id=workspace_id,
+                repo_name=repo["full_name"],
+                provider="github",
+                external_id=str(repo["id"])
+            ))
+    await db.commit()
+
+
+async def bulk_sync(db, workspace_id, repos):
+    await bulk_sync_repositories(db, workspace_id, repos)
+    await db.commit()
+
+
+async def create_workspace(db):
+    user = User(firebase_uid=f"bench-{uuid.uuid4()}", email=f"bench-{uuid.uuid4()}@example.com")
+    db.add(user)
+    await db.flush()
+    workspace = Workspace(owner_id=user.id)
+    db.add(workspace)
+    await db.commit()
+    return user.id, workspace.id
+
+
+async def drop_workspace(db, user_id, workspace_id):
+    await db.execute(delete(Repository).where(Repository.workspace_id == workspace_id))
+    await db.execute(delete(Workspace).where(Workspace.id == workspace_id))
+    await db.execute(delete(User).where(User.id == user_id))
+    await db.commit()
+
+
+async def timed(sync, repos) -> tuple:
+    async with AsyncSessionLocal() as db:
+        user_id, workspace_id = await create_workspace(db)
+        try:
+            start = time.perf_counter()
+            await sync(db, workspace_id, repos)
+            initial = time.perf_counter() - start
+
+            start = time.perf_counter()
+            await sync(db, workspace_id, repos)
+            resync = time.perf_counter() - start
+        finally:
+            await drop_workspace(db, user_id, workspace_id)
+    return initial, resync
+
+
+async def main():
+    print(f"{'repos':>7}{'loop initial':>15}{'loop resync':>14}{'bulk initial':>15}{'bulk resync':>14}")
+    for size in SIZES:
+        repos = fake_repos(size)
+        loop_initial, loop_resync = await timed(per_repo_sync, repos)
+        bulk_initial, bulk_resync = await timed(bulk_sync, repos)
+        print(
+            f"{size:>7}"
+            f"{loop_initial * 1000:>13.0f}ms{loop_resync * 1000:>12.0f}ms"
+            f"{bulk_initial * 1000:>13.0f}ms{bulk_resync * 1000:>12.0f}ms"
+        )
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""
+A minimal fake of the GitHub REST endpoints the API calls, for local runs and
+benchmarks. Point the API (or a benchmark) at it with GITHUB_API_URL.
+
+Usage:
+    uvicorn benchmarks.fake_github:app --port 9000
+    # with TLS, to include handshake cost in measurements:
+    uvicorn benchmarks.fake_github:app --port 9443 --ssl-keyfile key.pem --ssl-certfile cert.pem
+
+Settings:
+    FAKE_GITHUB_LATENCY_MS   added server-side latency per request (default 20)
+    FAKE_GITHUB_REPO_COUNT   repositories reported for the user / installation (default 250)
+
+GET responses carry an ETag and answer If-None-Match with 304, like GitHub.
+"""
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta
+from fastapi import FastAPI, Request, Response
+
+LATENCY_SECONDS = float(os.environ.get("FAKE_GITHUB_LATENCY_MS", "20")) / 1000
+REPO_COUNT = int(os.environ.get("FAKE_GITHUB_REPO_COUNT", "250"))
+
+app = FastAPI()
+
+
+@app.middleware("http")
+async def etag_middleware(request: Request, call_next):
+    response = await call_next(request)
+    if request.method != "GET" or response.status_code != 200:
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    headers["ETag"] = etag
+    headers["Cache-Control"] = "private, max-age=60, s-maxage=60"
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, status_code=200, headers=headers, media_type=response.media_type)
+
+
+def _repo(i: int) -> dict:
+    return {
+        "id": 100000 + i,
+        "name": f"repo-{i}",
+        "full_name": f"fake-org/repo-{i}",
+        "private": i % 3 == 0,
+        "description": f"Fake repository number {i}",
+        "html_url": f"https://github.com/fake-org/repo-{i}",
+        "default_branch": "main",
+        "updated_at": "2024-01-01T00:00:00Z",
+    }
+
+
+def _page(request: Request, response: Response, items: list) -> list:
+    """Slice items like GitHub does and set the Link header for the other pages"""
+    per_page = int(request.query_params.get("per_page", 30))
+    page = int(request.query_params.get("page", 1))
+    last_page = max(1, -(-len(items) // per_page))
+
+    links = []
+    base = str(request.url.remove_query_params("page"))
+    separator = "&" if "?" in base else "?"
+    if page < last_page:
+        links.append(f'<{base}{separator}page={page + 1}>; rel="next"')
+        links.append(f'<{base}{separator}page={last_page}>; rel="last"')
+    if page > 1:
+        links.append(f'<{base}{separator}page=1>; rel="first"')
+        links.append(f'<{base}{separator}page={page - 1}>; rel="prev"')
+    if links:
+        response.headers["Link"] = ", ".join(links)
+
+    response.headers["X-RateLimit-Limit"] = "5000"
+    response.headers["X-RateLimit-Remaining"] = "4999"
+    response.headers["X-RateLimit-Reset"] = str(int((datetime.utcnow() + timedelta(hours=1)).timestamp()))
+    return items[(page - 1) * per_page:page * per_page]
+
+
+@app.get("/user/repos")
+async def user_repos(request: Request, response: Response):
+    await asyncio.sleep(LATENCY_SECONDS)
+    return _page(request, response, [_repo(i) for i in range(REPO_COUNT)])
+
+
+@app.get("/repos/{owner}/{name}")
+async def get_repo(owner: str, name: str):
+    await asyncio.sleep(LATENCY_SECONDS)
+    return {**_repo(0), "name": name, "full_name": f"{owner}/{name}"}
+
+
+@app.get("/app/installations")
+async def app_installations():
+    await asyncio.sleep(LATENCY_SECONDS)
+    return [
+        {
+            "id": 1,
+            "account": {"login": "fake-org", "type": "Organization"},
+            "repository_selection": "all",
+        }
+    ]
+
+
+@app.post("/app/installations/{installation_id}/access_tokens", status_code=201)
+async def installation_token(installation_id: int):
+    await asyncio.sleep(LATENCY_SECONDS)
+    expires_at = (datetime.utcnow() + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {"token": f"ghs_fake_{installation_id}", "expires_at": expires_at}
+
+
+@app.get("/installation/repositories")
+async def installation_repositories(request: Request, response: Response):
+    await asyncio.sleep(LATENCY_SECONDS)
+    repos = _page(request, response, [_repo(i) for i in range(REPO_COUNT)])
+    return {"total_count": REPO_COUNT, "repositories": repos}
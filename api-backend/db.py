@@ -3,11 +3,38 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+
+# Connection pool settings, shared by the sync and async engines.
+# Recycle connections before Cloud SQL / proxies drop idle ones, and
+# pre-ping so a dead connection is replaced instead of failing a request.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+engine = create_engine(
+	DATABASE_URL,
+	pool_size=DB_POOL_SIZE,
+	max_overflow=DB_MAX_OVERFLOW,
+	pool_timeout=DB_POOL_TIMEOUT,
+	pool_recycle=DB_POOL_RECYCLE,
+	pool_pre_ping=True,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Changes to existing tables, which create_all doesn't make (see the file)
+SCHEMA_UPGRADE_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema_upgrade.sql")
+
+
+def upgrade_schema():
+	"""Apply schema_upgrade.sql in one transaction; safe to run on every start"""
+	with open(SCHEMA_UPGRADE_SQL) as f:
+		sql = f.read()
+	with engine.begin() as connection:
+		connection.exec_driver_sql(sql)
+
 # Dependency function for database session
 def get_db():
 	db = SessionLocal()
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from typing import Optional
+import httpx
+from cache import ExpiringLRUCache
+from github_client import get_github_client
+from github_ratelimit import send_github_request
+
+# Conditional-request cache for GitHub REST reads. Entries are revalidated with
+# If-None-Match / If-Modified-Since; a 304 doesn't count against the rate limit.
+GITHUB_CACHE_SIZE = int(os.environ.get("GITHUB_CACHE_SIZE", "1000"))
+# Entries not requested for this long are dropped
+GITHUB_CACHE_IDLE_SECONDS = int(os.environ.get("GITHUB_CACHE_IDLE_SECONDS", str(24 * 60 * 60)))
+# Serve entries without revalidating while GitHub's Cache-Control max-age holds
+GITHUB_CACHE_HONOR_MAX_AGE = os.environ.get("GITHUB_CACHE_HONOR_MAX_AGE", "false").lower() == "true"
+
+
+class GitHubResponse:
+    """
+    The parts of a GitHub response the handlers use. The body is parsed once;
+    responses served from the cache share the parsed data, so treat it as
+    read-only.
+    """
+
+    def __init__(self, status_code: int, headers: httpx.Headers, content: bytes, data=None, from_cache: bool = False):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self._data = data
+        self.from_cache = from_cache
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        if self._data is None:
+            self._data = json.loads(self.content)
+        return self._data
+
+
+class _CacheEntry:
+    __slots__ = ("response", "etag", "last_modified", "fresh_until")
+
+    def __init__(self, response: GitHubResponse, fresh_until: float):
+        self.response = response
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        self.fresh_until = fresh_until
+
+
+def _max_age(headers: httpx.Headers) -> int:
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name == "max-age" and value.isdigit():
+            return int(value)
+    return 0
+
+
+def principal_for(authorization: str) -> str:
+    """Cache principal for a raw Authorization header (never store the token itself)"""
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+class ConditionalResponseCache:
+    """Size-bounded LRU of GitHub responses keyed by (principal, URL)"""
+
+    def __init__(self, max_size: int):
+        self._entries = ExpiringLRUCache(max_size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._in_flight = {}  # key -> asyncio.Task
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    async def get(
+        self,
+        path: str,
+        authorization: str,
+        params: Optional[dict] = None,
+        principal: Optional[str] = None,
+    ) -> GitHubResponse:
+        """
+        GET a GitHub path, revalidating any cached copy for this principal.
+        Pass a stable principal (e.g. "app", "installation:<id>") when the
+        credential itself rotates; by default it's a digest of the header.
+        The principal is also the rate-limit budget the call is charged to.
+        """
+        client = get_github_client()
+        request = client.build_request("GET", path, params=params)
+        key = (principal or principal_for(authorization), str(request.url))
+
+        entry = self._entries.get(key)
+        if entry is not None and entry.fresh_until > time.time():
+            self._count("hits")
+            return entry.response
+
+        # Identical concurrent reads (ten tabs refreshing the same list) share one upstream call
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._count("coalesced")
+        else:
+            task = asyncio.create_task(self._fetch(key, request, authorization, entry))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._fetch_done(key, done))
+        return await asyncio.shield(task)
+
+    def _fetch_done(self, key, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter went away
+
+    async def _fetch(self, key, request: httpx.Request, authorization: str, entry) -> GitHubResponse:
+        request.headers["Authorization"] = authorization
+        if entry is not None:
+            if entry.etag:
+                request.headers["If-None-Match"] = entry.etag
+            elif entry.last_modified:
+                request.headers["If-Modified-Since"] = entry.last_modified
+
+        response = await send_github_request(get_github_client(), request, key[0])
+        now = time.time()
+
+        if response.status_code == 304 and entry is not None:
+            self._count("not_modified")
+            entry.fresh_until = now + _max_age(response.headers) if GITHUB_CACHE_HONOR_MAX_AGE else 0
+            self._entries.set(key, entry, now + GITHUB_CACHE_IDLE_SECONDS)
+            return entry.response
+
+        self._count("misses")
+        result = GitHubResponse(response.status_code, response.headers, response.content)
+        if response.status_code == 200 and (
+            "ETag" in response.headers or "Last-Modified" in response.headers
+        ):
+            result.json()  # parse once, before it is shared
+            fresh_until = now + _max_age(response.headers) if GITHUB_CACHE_HONOR_MAX_AGE else 0
+            self._entries.set(key, _CacheEntry(result, fresh_until), now + GITHUB_CACHE_IDLE_SECONDS)
+        elif entry is not None:
+            self._entries.invalidate(key)
+        return result
+
+    def stats(self) -> dict:
+        size = self._entries.stats()
+        with self._lock:
+            return {
+                "size": size["size"],
+                "max_size": size["max_size"],
+                "hits": self.hits,
+                "not_modified": self.not_modified,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+github_response_cache = ConditionalResponseCache(GITHUB_CACHE_SIZE)
+
+
+async def github_get(
+    path: str,
+    authorization: str,
+    params: Optional[dict] = None,
+    principal: Optional[str] = None,
+) -> GitHubResponse:
+    """Cached, conditional GET against the GitHub REST API"""
+    return await github_response_cache.get(path, authorization, params=params, principal=principal)
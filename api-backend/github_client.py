@@ -0,0 +1,64 @@
+import os
+from typing import Optional
+import httpx
+
+# Base URL of the GitHub REST API (point it at benchmarks/fake_github.py locally)
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+
+# Connection pool and timeout settings for the shared client
+GITHUB_HTTP2 = os.environ.get("GITHUB_HTTP2", "true").lower() == "true"
+GITHUB_TIMEOUT_SECONDS = float(os.environ.get("GITHUB_TIMEOUT_SECONDS", "15"))
+GITHUB_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("GITHUB_CONNECT_TIMEOUT_SECONDS", "5"))
+GITHUB_MAX_CONNECTIONS = int(os.environ.get("GITHUB_MAX_CONNECTIONS", "100"))
+GITHUB_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("GITHUB_MAX_KEEPALIVE_CONNECTIONS", "20"))
+GITHUB_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("GITHUB_KEEPALIVE_EXPIRY_SECONDS", "60"))
+
+DEFAULT_HEADERS = {
+    "Accept": "application/vnd.github.v3+json",
+}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _build_client() -> httpx.AsyncClient:
+    http2 = GITHUB_HTTP2 and _http2_available()
+    if GITHUB_HTTP2 and not http2:
+        print("GITHUB_HTTP2 is set but the 'h2' package is missing; using HTTP/1.1")
+
+    return httpx.AsyncClient(
+        base_url=GITHUB_API_URL,
+        headers=DEFAULT_HEADERS,
+        http2=http2,
+        timeout=httpx.Timeout(GITHUB_TIMEOUT_SECONDS, connect=GITHUB_CONNECT_TIMEOUT_SECONDS),
+        limits=httpx.Limits(
+            max_connections=GITHUB_MAX_CONNECTIONS,
+            max_keepalive_connections=GITHUB_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=GITHUB_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    )
+
+
+def get_github_client() -> httpx.AsyncClient:
+    """
+    The application-lifetime client for api.github.com. Connections are
+    pooled and kept alive, so handlers don't pay a TCP + TLS handshake per call.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def close_github_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
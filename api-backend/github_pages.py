@@ -0,0 +1,139 @@
+import os
+import asyncio
+from typing import AsyncIterator, Optional
+from urllib.parse import parse_qs, urlparse
+from github_cache import GitHubResponse, github_get
+
+# Page size for GitHub list endpoints (100 is GitHub's maximum)
+GITHUB_PAGE_SIZE = int(os.environ.get("GITHUB_PAGE_SIZE", "100"))
+# Pages fetched at once after the first one
+GITHUB_PAGE_CONCURRENCY = int(os.environ.get("GITHUB_PAGE_CONCURRENCY", "8"))
+# Hard stop for runaway listings (100 pages = 10,000 repos at the default
+# size); longer ones end in GitHubListingTruncated
+GITHUB_MAX_PAGES = int(os.environ.get("GITHUB_MAX_PAGES", "100"))
+
+
+class GitHubAPIError(Exception):
+    """A GitHub list page came back with something other than 200"""
+
+    def __init__(self, response: GitHubResponse):
+        super().__init__(f"GitHub returned {response.status_code}")
+        self.status_code = response.status_code
+        self.response = response
+
+
+class GitHubListingTruncated(Exception):
+    """
+    A listing had more than GITHUB_MAX_PAGES pages; raised after the pages
+    that were read. fetch_all_github_pages sets `items` to what it read.
+    """
+
+    def __init__(self, path: str, pages_read: int):
+        super().__init__(f"GitHub listing {path} has more than {pages_read} pages")
+        self.path = path
+        self.pages_read = pages_read
+        self.items = []
+
+
+def parse_link_header(value: str) -> dict:
+    """{rel: url} from a GitHub Link header"""
+    links = {}
+    for part in value.split(","):
+        url, _, params = part.partition(";")
+        rel = params.strip()
+        if rel.startswith('rel="'):
+            links[rel[5:-1]] = url.strip()[1:-1]
+    return links
+
+
+def _page_number(url: str) -> Optional[int]:
+    page = parse_qs(urlparse(url).query).get("page")
+    return int(page[0]) if page and page[0].isdigit() else None
+
+
+def _items(response: GitHubResponse, items_key: Optional[str]) -> list:
+    data = response.json()
+    return data.get(items_key, []) if items_key else data
+
+
+async def iter_github_pages(
+    path: str,
+    authorization: str,
+    params: Optional[dict] = None,
+    principal: Optional[str] = None,
+    items_key: Optional[str] = None,
+) -> AsyncIterator[list]:
+    """
+    Yield the items of every page of a GitHub list endpoint, in page order.
+    The first page's Link header tells us the last page; the rest are then
+    fetched concurrently (at most GITHUB_PAGE_CONCURRENCY at a time), so a
+    20-page listing costs about two round trips instead of twenty.
+    items_key is for endpoints that wrap the list, e.g. "repositories".
+    Raises GitHubAPIError if a page fails, and GitHubListingTruncated after
+    GITHUB_MAX_PAGES pages if there are more.
+    """
+    params = {**(params or {}), "per_page": GITHUB_PAGE_SIZE}
+
+    async def fetch(page: int) -> GitHubResponse:
+        response = await github_get(path, authorization, params={**params, "page": page}, principal=principal)
+        if response.status_code != 200:
+            raise GitHubAPIError(response)
+        return response
+
+    first = await fetch(1)
+    yield _items(first, items_key)
+
+    links = parse_link_header(first.headers.get("Link", ""))
+    last_page = _page_number(links["last"]) if "last" in links else None
+
+    if last_page is None:
+        # No rel="last" (cursor-style listing): follow rel="next" one by one
+        pages_read = 1
+        while "next" in links:
+            if pages_read >= GITHUB_MAX_PAGES:
+                raise GitHubListingTruncated(path, pages_read)
+            response = await fetch(_page_number(links["next"]) or pages_read + 1)
+            pages_read += 1
+            yield _items(response, items_key)
+            links = parse_link_header(response.headers.get("Link", ""))
+        return
+
+    truncated = last_page > GITHUB_MAX_PAGES
+    if truncated:
+        last_page = GITHUB_MAX_PAGES
+
+    semaphore = asyncio.Semaphore(GITHUB_PAGE_CONCURRENCY)
+
+    async def bounded_fetch(page: int) -> GitHubResponse:
+        async with semaphore:
+            return await fetch(page)
+
+    tasks = [asyncio.create_task(bounded_fetch(page)) for page in range(2, last_page + 1)]
+    try:
+        for task in tasks:
+            yield _items(await task, items_key)
+        if truncated:
+            raise GitHubListingTruncated(path, last_page)
+    finally:
+        # The consumer stopped early or a page failed: don't leave fetches running
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def fetch_all_github_pages(
+    path: str,
+    authorization: str,
+    params: Optional[dict] = None,
+    principal: Optional[str] = None,
+    items_key: Optional[str] = None,
+) -> list:
+    """All items of a GitHub list endpoint, see iter_github_pages"""
+    items = []
+    try:
+        async for page in iter_github_pages(path, authorization, params, principal, items_key):
+            items.extend(page)
+    except GitHubListingTruncated as e:
+        e.items = items
+        raise
+    return items
@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+import threading
+import httpx
+from fastapi import HTTPException
+from cache import ExpiringLRUCache
+
+# Start pacing requests once a principal has less than this fraction of its budget left
+GITHUB_THROTTLE_FRACTION = float(os.environ.get("GITHUB_THROTTLE_FRACTION", "0.1"))
+# Never hold a request longer than this to pace it; answer 429 instead
+GITHUB_MAX_THROTTLE_SECONDS = float(os.environ.get("GITHUB_MAX_THROTTLE_SECONDS", "5"))
+# How long to back off after a secondary rate limit that came without Retry-After
+GITHUB_SECONDARY_LIMIT_BACKOFF_SECONDS = int(os.environ.get("GITHUB_SECONDARY_LIMIT_BACKOFF_SECONDS", "60"))
+GITHUB_RATE_LIMIT_TRACKED = int(os.environ.get("GITHUB_RATE_LIMIT_TRACKED", "10000"))
+
+
+class GitHubRateLimited(HTTPException):
+    """GitHub's budget for this principal is spent; tell the client when to retry"""
+
+    def __init__(self, retry_after: float):
+        retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(
+            status_code=429,
+            detail=f"GitHub rate limit reached, retry in {retry_after}s",
+            headers={"Retry-After": str(retry_after)},
+        )
+        self.retry_after = retry_after
+
+
+class _Budget:
+    __slots__ = ("limit", "remaining", "reset_at", "blocked_until", "next_slot")
+
+    def __init__(self):
+        self.limit = 0
+        self.remaining = 0
+        self.reset_at = 0.0
+        self.blocked_until = 0.0
+        self.next_slot = 0.0
+
+
+class GitHubRateLimiter:
+    """
+    Tracks X-RateLimit-* per principal (user token digest, "app",
+    "installation:<id>"). Once a budget runs low the remaining calls are
+    spread over what is left of the window; once it is spent, or GitHub
+    asks us to back off, callers get a 429 with Retry-After instead of a
+    raw 403 from upstream.
+    """
+
+    def __init__(self, max_tracked: int):
+        self._budgets = ExpiringLRUCache(max_tracked)
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.rejected = 0
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    async def acquire(self, principal: str):
+        """Wait for (or refuse) permission to call GitHub as principal"""
+        budget = self._budgets.get(principal)
+        if budget is None:
+            return
+
+        now = time.time()
+        if budget.blocked_until > now:
+            self._count("rejected")
+            raise GitHubRateLimited(budget.blocked_until - now)
+        if budget.reset_at <= now or budget.remaining > budget.limit * GITHUB_THROTTLE_FRACTION:
+            return
+        if budget.remaining <= 0:
+            self._count("rejected")
+            raise GitHubRateLimited(budget.reset_at - now)
+
+        # Low on budget: hand out evenly spaced slots until the window resets
+        with self._lock:
+            interval = (budget.reset_at - now) / budget.remaining
+            slot = max(now, budget.next_slot)
+            delay = slot - now
+            if delay > GITHUB_MAX_THROTTLE_SECONDS:
+                self.rejected += 1
+                raise GitHubRateLimited(delay)
+            budget.next_slot = slot + interval
+            budget.remaining -= 1
+            self.throttled += 1
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record(self, principal: str, response: httpx.Response):
+        """Update the budget from a response; raises GitHubRateLimited if GitHub refused it"""
+        now = time.time()
+        headers = response.headers
+        budget = self._budgets.get(principal) or _Budget()
+
+        if "X-RateLimit-Remaining" in headers:
+            budget.limit = int(headers.get("X-RateLimit-Limit", budget.limit))
+            budget.remaining = int(headers["X-RateLimit-Remaining"])
+            budget.reset_at = float(headers.get("X-RateLimit-Reset", now + 3600))
+
+        limited = None
+        if response.status_code in (403, 429):
+            retry_after = headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                limited = int(retry_after)
+            elif budget.remaining == 0 and "X-RateLimit-Remaining" in headers:
+                limited = budget.reset_at - now
+            elif "secondary rate limit" in response.text.lower():
+                limited = GITHUB_SECONDARY_LIMIT_BACKOFF_SECONDS
+            if limited is not None:
+                budget.blocked_until = now + limited
+
+        if budget.reset_at or budget.blocked_until:
+            self._budgets.set(principal, budget, max(budget.reset_at, budget.blocked_until, now + 1))
+
+        if limited is not None:
+            self._count("rejected")
+            print(f"GitHub rate limit hit for {principal[:16]}, backing off {int(limited)}s")
+            raise GitHubRateLimited(limited)
+
+    def stats(self, lowest: int = 5) -> dict:
+        """Counters plus the principals closest to exhausting their budget"""
+        now = time.time()
+        budgets = self._budgets.items()
+        gauges = sorted(
+            (
+                {
+                    "principal": principal[:16],
+                    "remaining": budget.remaining,
+                    "limit": budget.limit,
+                    "resets_in": max(0, int(budget.reset_at - now)),
+                }
+                for principal, budget in budgets
+                if budget.limit
+            ),
+            key=lambda gauge: gauge["remaining"] / gauge["limit"],
+        )
+        with self._lock:
+            return {
+                "tracked_principals": len(budgets),
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+                "lowest_budgets": gauges[:lowest],
+            }
+
+
+github_rate_limiter = GitHubRateLimiter(GITHUB_RATE_LIMIT_TRACKED)
+
+
+async def send_github_request(client: httpx.AsyncClient, request: httpx.Request, principal: str) -> httpx.Response:
+    """Send a GitHub request through the rate limiter"""
+    await github_rate_limiter.acquire(principal)
+    response = await client.send(request)
+    github_rate_limiter.record(principal, response)
+    return response
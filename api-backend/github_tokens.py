@@ -0,0 +1,158 @@
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+import jwt
+from cryptography.hazmat.primitives import serialization
+from fastapi import HTTPException
+from github_client import get_github_client
+from github_ratelimit import send_github_request
+
+# GitHub App credentials for installation access
+GITHUB_APP_ID = os.environ.get("GITHUB_APP_ID", "")
+GITHUB_APP_PRIVATE_KEY = os.environ.get("GITHUB_APP_PRIVATE_KEY", "")
+
+# App JWTs may live at most 10 minutes; reuse one until it has less than
+# APP_JWT_MIN_REMAINING_SECONDS left.
+APP_JWT_LIFETIME_SECONDS = 10 * 60
+APP_JWT_MIN_REMAINING_SECONDS = int(os.environ.get("GITHUB_APP_JWT_MIN_REMAINING_SECONDS", "120"))
+# Installation tokens last an hour; refresh them this long before they expire
+INSTALLATION_TOKEN_REFRESH_MARGIN_SECONDS = int(
+    os.environ.get("GITHUB_INSTALLATION_TOKEN_REFRESH_MARGIN_SECONDS", "300")
+)
+
+
+def _parse_github_timestamp(value: str) -> float:
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+
+
+class GitHubAppTokens:
+    """
+    Caches everything needed to authenticate as the GitHub App: the parsed
+    private key, the app JWT (reused for most of its lifetime) and one
+    installation access token per installation, refreshed ahead of expiry.
+    Concurrent requests for the same installation share a single refresh.
+    """
+
+    def __init__(self, app_id: str, private_key_pem: str):
+        self.app_id = app_id
+        self.private_key_pem = private_key_pem
+        self._private_key = None
+        self._jwt = None
+        self._jwt_expires_at = 0.0
+        self._jwt_lock = threading.Lock()
+        self._installation_tokens = {}  # installation_id -> (token, expires_at)
+        self._refresh_locks = {}  # installation_id -> asyncio.Lock
+        self.jwt_signings = 0
+        self.token_mints = 0
+        self.token_hits = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.app_id and self.private_key_pem)
+
+    def _get_private_key(self):
+        if self._private_key is None:
+            # Handle private key - it might have escaped newlines
+            pem = self.private_key_pem.replace("\\n", "\n").encode()
+            self._private_key = serialization.load_pem_private_key(pem, password=None)
+        return self._private_key
+
+    def app_jwt(self) -> Optional[str]:
+        """Generate (or reuse) a JWT for GitHub App authentication"""
+        if not self.configured:
+            return None
+
+        with self._jwt_lock:
+            now = time.time()
+            if self._jwt and self._jwt_expires_at - now > APP_JWT_MIN_REMAINING_SECONDS:
+                return self._jwt
+
+            issued_at = int(now)
+            payload = {
+                "iat": issued_at - 60,  # Issued 60 seconds ago, to allow for clock drift
+                "exp": issued_at + APP_JWT_LIFETIME_SECONDS - 60,
+                "iss": self.app_id,
+            }
+            self._jwt = jwt.encode(payload, self._get_private_key(), algorithm="RS256")
+            self._jwt_expires_at = payload["exp"]
+            self.jwt_signings += 1
+            return self._jwt
+
+    def _cached_installation_token(self, installation_id: str) -> Optional[str]:
+        cached = self._installation_tokens.get(installation_id)
+        if cached and cached[1] - time.time() > INSTALLATION_TOKEN_REFRESH_MARGIN_SECONDS:
+            return cached[0]
+        return None
+
+    async def installation_token(self, installation_id: str) -> str:
+        """Get an access token for a specific GitHub App installation"""
+        token = self._cached_installation_token(installation_id)
+        if token:
+            self.token_hits += 1
+            return token
+
+        lock = self._refresh_locks.setdefault(installation_id, asyncio.Lock())
+        async with lock:
+            # Another request may have refreshed it while we waited
+            token = self._cached_installation_token(installation_id)
+            if token:
+                self.token_hits += 1
+                return token
+
+            token, expires_at = await self._mint_installation_token(installation_id)
+            self._installation_tokens[installation_id] = (token, expires_at)
+            return token
+
+    async def _mint_installation_token(self, installation_id: str):
+        app_jwt = self.app_jwt()
+        if not app_jwt:
+            raise HTTPException(
+                status_code=500,
+                detail="GitHub App not configured. Please set GITHUB_APP_ID and GITHUB_APP_PRIVATE_KEY."
+            )
+
+        client = get_github_client()
+        request = client.build_request(
+            "POST",
+            f"/app/installations/{installation_id}/access_tokens",
+            headers={"Authorization": f"Bearer {app_jwt}"}
+        )
+        response = await send_github_request(client, request, "app")
+
+        if response.status_code != 201:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to get installation access token: {response.text}"
+            )
+
+        data = response.json()
+        self.token_mints += 1
+        return data["token"], _parse_github_timestamp(data["expires_at"])
+
+    def invalidate_installation(self, installation_id: str):
+        """Forget a cached token, e.g. after GitHub rejected it"""
+        self._installation_tokens.pop(installation_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "jwt_signings": self.jwt_signings,
+            "installation_token_mints": self.token_mints,
+            "installation_token_hits": self.token_hits,
+            "cached_installations": len(self._installation_tokens),
+        }
+
+
+github_app_tokens = GitHubAppTokens(GITHUB_APP_ID, GITHUB_APP_PRIVATE_KEY)
+
+
+def get_github_app_jwt() -> Optional[str]:
+    """A JWT for GitHub App authentication, or None if the app isn't configured"""
+    return github_app_tokens.app_jwt()
+
+
+async def get_installation_access_token(installation_id: str) -> str:
+    """Get an access token for a specific GitHub App installation"""
+    return await github_app_tokens.installation_token(installation_id)
@@ -0,0 +1,128 @@
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from models import User, Workspace
+from cache import ExpiringLRUCache
+
+# Identities are cached briefly so steady-state requests skip the database.
+# Keep the TTL short: nothing evicts entries early, so plan changes (made
+# directly in the database, there is no API for them) show up once it expires.
+IDENTITY_CACHE_TTL_SECONDS = float(os.environ.get("IDENTITY_CACHE_TTL_SECONDS", "30"))
+IDENTITY_CACHE_SIZE = int(os.environ.get("IDENTITY_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    id: uuid.UUID
+    firebase_uid: str
+    email: str
+    created_at: datetime
+
+
+@dataclass(frozen=True)
+class CurrentWorkspace:
+    id: uuid.UUID
+    owner_id: uuid.UUID
+    plan_level: str
+
+
+@dataclass(frozen=True)
+class Identity:
+    user: CurrentUser
+    workspace: CurrentWorkspace
+
+
+identity_cache = ExpiringLRUCache(max_size=IDENTITY_CACHE_SIZE)
+
+
+def _to_identity(user: User, workspace: Workspace) -> Identity:
+    return Identity(
+        user=CurrentUser(
+            id=user.id,
+            firebase_uid=user.firebase_uid,
+            email=user.email,
+            created_at=user.created_at,
+        ),
+        workspace=CurrentWorkspace(
+            id=workspace.id,
+            owner_id=workspace.owner_id,
+            plan_level=workspace.plan_level,
+        ),
+    )
+
+
+def _provision_identity(db: Session, firebase_uid: str, email: Optional[str], user: Optional[User]) -> Identity:
+    """
+    Idempotently create the user and their default workspace in one transaction.
+    The user row is upserted (or locked, if it already exists) first, so
+    concurrent first logins for the same uid serialize on it and only one of
+    them ever creates the workspace.
+    """
+    try:
+        if user is None:
+            if not email:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Firebase user has no email. Cannot create Arcanext account.",
+                )
+            upsert = insert(User).values(firebase_uid=firebase_uid, email=email)
+            upsert = upsert.on_conflict_do_update(
+                index_elements=[User.firebase_uid],
+                set_={"firebase_uid": upsert.excluded.firebase_uid},
+            ).returning(User)
+            user = db.scalars(upsert).one()
+        else:
+            db.execute(select(User.id).where(User.id == user.id).with_for_update())
+
+        workspace = db.execute(
+            select(Workspace)
+            .where(Workspace.owner_id == user.id)
+            .order_by(Workspace.created_at)
+            .limit(1)
+        ).scalar_one_or_none()
+
+        if workspace is None:
+            workspace = Workspace(owner_id=user.id, plan_level="free")  # Default plan
+            db.add(workspace)
+            db.flush()
+
+        identity = _to_identity(user, workspace)
+        db.commit()
+        return identity
+    except Exception:
+        db.rollback()
+        raise
+
+
+def resolve_identity(db: Session, firebase_uid: str, email: Optional[str]) -> Identity:
+    """
+    Resolve a Firebase uid to our (user, workspace) pair.
+    Served from the in-process cache when possible, otherwise with a single
+    joined query; first logins fall through to _provision_identity.
+    """
+    identity = identity_cache.get(firebase_uid)
+    if identity is not None:
+        return identity
+
+    row = db.execute(
+        select(User, Workspace)
+        .outerjoin(Workspace, Workspace.owner_id == User.id)
+        .where(User.firebase_uid == firebase_uid)
+        .order_by(Workspace.created_at)
+        .limit(1)
+    ).first()
+
+    if row is not None and row.Workspace is not None:
+        identity = _to_identity(row.User, row.Workspace)
+    else:
+        identity = _provision_identity(db, firebase_uid, email, row.User if row else None)
+
+    identity_cache.set(firebase_uid, identity, expires_at=time.time() + IDENTITY_CACHE_TTL_SECONDS)
+    return identity
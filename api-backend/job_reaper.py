@@ -0,0 +1,120 @@
+import os
+import asyncio
+from datetime import datetime
+from sqlalchemy import delete, select
+from async_db import AsyncSessionLocal
+from job_service import dispatch_jobs, undispatched_jobs
+from models import ScanJob, ScanQueueItem
+from webhook_inbox import prune_deliveries
+from workspace_stats import apply_stats_delta, status_transition
+
+# How often the reaper looks for running jobs whose worker lease ran out,
+# for queued jobs that were never enqueued and for webhook deliveries past
+# their retention
+REAPER_INTERVAL_SECONDS = float(os.environ.get("SCAN_REAPER_INTERVAL_SECONDS", "30"))
+REAPER_BATCH_SIZE = int(os.environ.get("SCAN_REAPER_BATCH_SIZE", "100"))
+# Attempts (runs started by a worker) before a job is given up on
+SCAN_MAX_ATTEMPTS = int(os.environ.get("SCAN_MAX_ATTEMPTS", "3"))
+
+_reaper_task = None
+
+
+async def reap_expired_leases() -> int:
+    """
+    Re-queue running jobs whose lease expired (the worker died or gave the
+    job back on shutdown), or fail them once they used up their attempts.
+    Rows are locked with SKIP LOCKED so several API instances can reap at once.
+    Returns the number of jobs reaped.
+    """
+    async with AsyncSessionLocal() as db:
+        expired = (await db.execute(
+            select(ScanJob)
+            .where(
+                ScanJob.status == "running",
+                ScanJob.lease_expires_at < datetime.utcnow(),
+            )
+            .limit(REAPER_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )).scalars().all()
+        if not expired:
+            return 0
+
+        requeued = []
+        for job in expired:
+            print(f"Lease expired for job {job.id} (worker {job.worker_id}, attempt {job.attempts})")
+            if job.attempts >= SCAN_MAX_ATTEMPTS:
+                await apply_stats_delta(db, job.workspace_id, status_transition("running", "failed"))
+                job.status = "failed"
+                job.completed_at = datetime.utcnow()
+                job.failure_reason = (
+                    f"Worker lease expired on attempt {job.attempts} of {SCAN_MAX_ATTEMPTS} "
+                    f"(last worker {job.worker_id})"
+                )
+            else:
+                await apply_stats_delta(db, job.workspace_id, status_transition("running", "queued"))
+                job.status = "queued"
+                job.queued_at = datetime.utcnow()
+                job.dispatched_at = None
+                requeued.append(job)
+            job.worker_id = None
+            job.lease_expires_at = None
+
+        # Drop any queue row the dead worker still had claimed, so its
+        # workspace gets the slot back and the job can be enqueued afresh
+        await db.execute(
+            delete(ScanQueueItem).where(ScanQueueItem.job_id.in_([job.id for job in expired]))
+        )
+        await db.commit()
+
+        await dispatch_jobs(db, requeued, "Failed to re-enqueue after lease expiry")
+        await db.commit()
+
+        return len(expired)
+
+
+async def dispatch_stranded_jobs() -> int:
+    """
+    Enqueue queued jobs that were committed but never handed to the queue
+    backend (the API instance died in between). Returns the number found.
+    """
+    async with AsyncSessionLocal() as db:
+        stranded = await undispatched_jobs(db, REAPER_BATCH_SIZE)
+        if stranded:
+            print(f"Dispatching {len(stranded)} queued job(s) that were never enqueued")
+            await dispatch_jobs(db, stranded, "Failed to enqueue from the dispatch sweep")
+            await db.commit()
+        return len(stranded)
+
+
+async def _reaper_loop():
+    while True:
+        try:
+            reaped = await reap_expired_leases()
+            reaped = max(reaped, await dispatch_stranded_jobs())
+            pruned = await prune_deliveries()
+            if pruned:
+                print(f"Pruned {pruned} old webhook deliveries")
+        except Exception as e:
+            print(f"Job reaper failed: {e}")
+            reaped = 0
+
+        # A full batch means there is probably more waiting
+        if reaped < REAPER_BATCH_SIZE:
+            await asyncio.sleep(REAPER_INTERVAL_SECONDS)
+
+
+def start_reaper():
+    global _reaper_task
+    if _reaper_task is None:
+        _reaper_task = asyncio.create_task(_reaper_loop())
+
+
+async def stop_reaper():
+    global _reaper_task
+    if _reaper_task is not None:
+        _reaper_task.cancel()
+        try:
+            await _reaper_task
+        except asyncio.CancelledError:
+            pass
+        _reaper_task = None
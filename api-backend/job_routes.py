@@ -1,32 +1,91 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import uuid
+import base64
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from db import get_db
-from models import User, ScanJob, Repository, Workspace
-from auth import get_or_create_user
-from typing import List
+from async_db import get_async_db
+from models import ScanJob, WorkspaceStats
+from workspace_stats import SCAN_STATUSES, reconcile_workspace
+from auth import get_current_workspace
+from identity import CurrentWorkspace
+from typing import List, Optional
 
 router = APIRouter(prefix="/api/v1/jobs", tags=["Jobs"])
 
 
-def get_user_workspace(db: Session, user: User) -> Workspace:
-    """Helper to get user's first workspace"""
-    workspace = db.query(Workspace).filter(Workspace.owner_id == user.id).first()
-    if not workspace:
-        raise HTTPException(status_code=404, detail="User has no workspace")
-    return workspace
+# Page size for the job listing
+JOBS_PAGE_SIZE = 50
+JOBS_MAX_PAGE_SIZE = 200
+
+
+def encode_job_cursor(created_at: datetime, job_id) -> str:
+    """Opaque cursor pointing just past a job in (created_at, id) order"""
+    raw = json.dumps([created_at.isoformat(), str(job_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_job_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, job_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), uuid.UUID(job_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 
 @router.get("/", response_model=List[dict])
 def get_user_scan_jobs(
+    response: Response,
+    repository_id: Optional[uuid.UUID] = None,
+    status: Optional[str] = None,
+    pr_number: Optional[int] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(JOBS_PAGE_SIZE, ge=1, le=JOBS_MAX_PAGE_SIZE),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_or_create_user)
+    workspace: CurrentWorkspace = Depends(get_current_workspace)
 ):
-    """Get all scan jobs for the current user's workspace"""
-    workspace = get_user_workspace(db, current_user)
+    """
+    Get scan jobs for the current user's workspace, newest first.
+    Pages are keyset-paginated on (created_at, id): when there are more jobs,
+    the X-Next-Cursor header carries the cursor for the next page.
+    """
+    query = select(
+        ScanJob.id,
+        ScanJob.status,
+        ScanJob.commit_sha,
+        ScanJob.pr_number,
+        ScanJob.created_at,
+        ScanJob.completed_at,
+        ScanJob.repository_id,
+    ).where(ScanJob.workspace_id == workspace.id)
+
+    if repository_id is not None:
+        query = query.where(ScanJob.repository_id == repository_id)
+    if status is not None:
+        query = query.where(ScanJob.status == status)
+    if pr_number is not None:
+        query = query.where(ScanJob.pr_number == pr_number)
+    if created_after is not None:
+        query = query.where(ScanJob.created_at >= created_after)
+    if created_before is not None:
+        query = query.where(ScanJob.created_at < created_before)
+    if cursor:
+        cursor_created_at, cursor_id = decode_job_cursor(cursor)
+        query = query.where(tuple_(ScanJob.created_at, ScanJob.id) < tuple_(cursor_created_at, cursor_id))
 
-    jobs = db.query(ScanJob).join(Repository).filter(
-        Repository.workspace_id == workspace.id
-    ).order_by(ScanJob.created_at.desc()).limit(50).all()
+    # One extra row tells us whether there is a next page
+    jobs = db.execute(
+        query.order_by(ScanJob.created_at.desc(), ScanJob.id.desc()).limit(limit + 1)
+    ).all()
+    if len(jobs) > limit:
+        jobs = jobs[:limit]
+        response.headers["X-Next-Cursor"] = encode_job_cursor(jobs[-1].created_at, jobs[-1].id)
 
     return [
         {
@@ -42,23 +101,33 @@ def get_user_scan_jobs(
 
 
 @router.get("/stats")
-def get_user_stats(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_or_create_user)
+async def get_user_stats(
+    db: AsyncSession = Depends(get_async_db),
+    workspace: CurrentWorkspace = Depends(get_current_workspace)
 ):
-    """Get dashboard statistics for the current user"""
-    workspace = get_user_workspace(db, current_user)
-    
-    repo_count = db.query(Repository).filter(Repository.workspace_id == workspace.id).count()
-    scan_count = db.query(ScanJob).join(Repository).filter(
-        Repository.workspace_id == workspace.id
-    ).count()
-    
-    # Placeholder for vulnerability count (would come from scan results)
-    vulnerability_count = 0
-    
+    """
+    Get dashboard statistics for the current user.
+    Reads the workspace's maintained counters (one primary-key lookup); they
+    are computed from scratch only the first time a workspace is seen.
+    """
+    stats = await db.get(WorkspaceStats, workspace.id)
+    if stats is None or stats.reconciled_at is None:
+        stats = await reconcile_workspace(db, workspace.id)
+        await db.commit()
+
+    scans_by_status = {status: getattr(stats, f"{status}_scans") for status in SCAN_STATUSES}
+    findings_by_severity = {
+        "critical": stats.critical_findings,
+        "high": stats.high_findings,
+        "medium": stats.medium_findings,
+        "low": stats.low_findings,
+    }
+
     return {
-        "repo_count": repo_count,
-        "scan_count": scan_count,
-        "vulnerability_count": vulnerability_count
+        "repo_count": stats.repo_count,
+        "scan_count": sum(scans_by_status.values()),
+        "superseded_count": stats.superseded_scans,
+        "vulnerability_count": sum(findings_by_severity.values()),
+        "scans_by_status": scans_by_status,
+        "findings_by_severity": findings_by_severity,
     }
@@ -0,0 +1,347 @@
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import func, literal, or_, select, text, update
+from sqlalchemy.dialects.postgresql import UUID, insert
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Finding, Repository, ScanJob, ScanJobFinding
+from queue_service import enqueue_scan_task
+from workspace_stats import apply_stats_delta, status_transition
+
+# Version of the scanning rules; must match the scanner worker's setting.
+# Bumping it invalidates every stored result for reuse purposes. Workers
+# stamp jobs with it plus the digest of the plan's prepared ruleset.
+SCAN_RULESET_VERSION = os.environ.get("SCAN_RULESET_VERSION", "1")
+# How old a completed scan of the same commit may be and still be reused (0 disables reuse)
+SCAN_RESULT_REUSE_SECONDS = int(os.environ.get("SCAN_RESULT_REUSE_SECONDS", str(7 * 24 * 60 * 60)))
+# Queued jobs still not handed to the queue backend after this long (the API
+# died between committing and enqueueing them) are enqueued by the sweep
+SCAN_DISPATCH_SWEEP_SECONDS = int(os.environ.get("SCAN_DISPATCH_SWEEP_SECONDS", "60"))
+# Advisory lock class (with the repository id) serializing changes to a
+# repository's open findings with their counter deltas; must match the worker's
+FINDINGS_LOCK_KEY = 0x5CA9_0002
+
+
+def pr_ref(pr_number: int) -> str:
+    """The ScanJob / Finding ref of a pull request"""
+    return f"pr/{pr_number}"
+
+
+def branch_ref(branch: str) -> str:
+    """The ScanJob / Finding ref of a branch"""
+    return f"branch/{branch}"
+
+
+async def supersede_stale_jobs(db: AsyncSession, repository_id, ref: str, commit_sha: Optional[str]) -> int:
+    """
+    Coalesce scans per (repository, ref) when a newer commit arrives.
+    Queued jobs for older commits are marked 'superseded' (the worker skips
+    anything that isn't 'queued' when it picks a job up), and running ones
+    get a cooperative cancel signal that run_scan checks between phases.
+    commit_sha None supersedes every job for the ref (a PR was closed).
+    Returns the number of queued jobs superseded.
+    """
+    stale = (
+        ScanJob.repository_id == repository_id,
+        ScanJob.ref == ref,
+    )
+    if commit_sha is not None:
+        stale += (ScanJob.commit_sha != commit_sha,)
+
+    superseded = (await db.execute(
+        update(ScanJob)
+        .where(*stale, ScanJob.status == "queued")
+        .values(status="superseded", completed_at=datetime.utcnow())
+        .returning(ScanJob.workspace_id)
+    )).scalars().all()
+    await db.execute(
+        update(ScanJob)
+        .where(*stale, ScanJob.status == "running")
+        .values(cancel_requested=True)
+    )
+    if superseded:
+        await apply_stats_delta(db, superseded[0], status_transition("queued", "superseded", len(superseded)))
+    return len(superseded)
+
+
+async def current_ruleset_version(db: AsyncSession, plan_level: str) -> Optional[str]:
+    """
+    The ruleset stamp ("<SCAN_RULESET_VERSION>:<ruleset digest>") workers
+    put on the latest scan of this plan, i.e. the rules a new scan would
+    run with. Stamps from before a SCAN_RULESET_VERSION bump don't count.
+    """
+    return (await db.execute(
+        select(ScanJob.ruleset_version)
+        .where(
+            ScanJob.plan_level == plan_level,
+            ScanJob.status == "completed",
+            ScanJob.reused_from_id.is_(None),
+            or_(
+                ScanJob.ruleset_version == SCAN_RULESET_VERSION,
+                ScanJob.ruleset_version.startswith(f"{SCAN_RULESET_VERSION}:"),
+            ),
+        )
+        .order_by(ScanJob.completed_at.desc())
+        .limit(1)
+    )).scalar_one_or_none()
+
+
+async def find_reusable_result(
+    db: AsyncSession,
+    repository_id,
+    commit_sha: str,
+    plan_level: str,
+) -> Optional[ScanJob]:
+    """
+    Find a completed scan a new job for (repository, commit, plan level)
+    can reuse, whatever ref it was for (a branch pushed to two PRs, a
+    reopened PR, a redelivered webhook): the latest original result that
+    was produced with the current ruleset version, is inside the freshness
+    window and recorded its finding set, which adopt_result copies over.
+    The ruleset version is the full stamp, so a changed ruleset isn't reused.
+    """
+    if SCAN_RESULT_REUSE_SECONDS <= 0:
+        return None
+
+    ruleset_version = await current_ruleset_version(db, plan_level)
+    if ruleset_version is None:
+        return None
+    fresh_since = datetime.utcnow() - timedelta(seconds=SCAN_RESULT_REUSE_SECONDS)
+    return (await db.execute(
+        select(ScanJob)
+        .where(
+            ScanJob.repository_id == repository_id,
+            ScanJob.commit_sha == commit_sha,
+            ScanJob.plan_level == plan_level,
+            ScanJob.status == "completed",
+            ScanJob.reused_from_id.is_(None),
+            ScanJob.findings_count.is_not(None),
+            ScanJob.ruleset_version == ruleset_version,
+            ScanJob.completed_at >= fresh_since,
+        )
+        .order_by(ScanJob.completed_at.desc())
+        .limit(1)
+    )).scalar_one_or_none()
+
+
+async def _lock_repository_findings(db: AsyncSession, repository_id):
+    # Held until the caller commits, so a scan finishing meanwhile can't land
+    # between the before and after counts of a change to open findings
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(:key, hashtext(:repository_id))"),
+        {"key": FINDINGS_LOCK_KEY, "repository_id": str(repository_id)},
+    )
+
+
+async def adopt_result(db: AsyncSession, job: ScanJob, source: ScanJob) -> int:
+    """
+    Make a reused result the state of the job's ref, like the worker's
+    FindingWriter does for a scan: the source job's findings are upserted
+    onto the ref and the ref's other open findings marked fixed, the job
+    records them as its finding set, and the workspace's open-findings
+    counters move by the difference. Returns the number of findings.
+    """
+    await _lock_repository_findings(db, job.repository_id)
+    open_before = await _open_finding_counts(db, job.repository_id)
+
+    now = datetime.utcnow()
+    stmt = insert(Finding).from_select(
+        ["id", "repository_id", "workspace_id", "ref", "fingerprint", "rule_id", "severity", "status",
+         "file_path", "start_line", "end_line", "message", "first_seen_job_id", "last_seen_job_id",
+         "first_seen_at", "last_seen_at"],
+        select(
+            func.gen_random_uuid(),
+            Finding.repository_id,
+            Finding.workspace_id,
+            literal(job.ref).label("ref"),
+            Finding.fingerprint,
+            Finding.rule_id,
+            Finding.severity,
+            literal("open").label("status"),
+            Finding.file_path,
+            Finding.start_line,
+            Finding.end_line,
+            Finding.message,
+            Finding.first_seen_job_id,
+            literal(job.id, UUID(as_uuid=True)).label("last_seen_job_id"),
+            Finding.first_seen_at,
+            literal(now).label("last_seen_at"),
+        )
+        .join(ScanJobFinding, ScanJobFinding.finding_id == Finding.id)
+        .where(ScanJobFinding.job_id == source.id),
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        constraint="uq_findings_repository_ref_fingerprint",
+        set_={
+            "severity": stmt.excluded.severity,
+            "status": "open",
+            "start_line": stmt.excluded.start_line,
+            "end_line": stmt.excluded.end_line,
+            "message": stmt.excluded.message,
+            "last_seen_job_id": stmt.excluded.last_seen_job_id,
+            "last_seen_at": stmt.excluded.last_seen_at,
+        },
+    ))
+    ref_open = (
+        Finding.repository_id == job.repository_id,
+        Finding.ref == job.ref,
+        Finding.status == "open",
+    )
+    await db.execute(
+        update(Finding)
+        .where(*ref_open, Finding.last_seen_job_id != job.id)
+        .values(status="fixed")
+    )
+    job.findings_count = (await db.execute(
+        insert(ScanJobFinding).from_select(
+            ["job_id", "finding_id"],
+            select(literal(job.id, UUID(as_uuid=True)), Finding.id).where(*ref_open),
+        ).on_conflict_do_nothing()
+    )).rowcount
+
+    open_after = await _open_finding_counts(db, job.repository_id)
+    await apply_stats_delta(db, job.workspace_id, {
+        f"{severity}_findings": open_after.get(severity, 0) - open_before.get(severity, 0)
+        for severity in ("critical", "high", "medium", "low")
+    })
+    return job.findings_count
+
+
+async def _open_finding_counts(db: AsyncSession, repository_id) -> dict:
+    # Counted like the worker's findings writer: once per fingerprint across refs
+    return dict((await db.execute(
+        select(Finding.severity, func.count(Finding.fingerprint.distinct()))
+        .where(Finding.repository_id == repository_id, Finding.status == "open")
+        .group_by(Finding.severity)
+    )).all())
+
+
+async def close_pr(db: AsyncSession, repository: Repository, pr_number: int) -> int:
+    """
+    A PR was closed: supersede its pending scans and mark its open findings
+    'closed', so they stop counting towards the workspace's open findings.
+    Returns the number of findings closed.
+    """
+    await supersede_stale_jobs(db, repository.id, pr_ref(pr_number), None)
+    await _lock_repository_findings(db, repository.id)
+    open_before = await _open_finding_counts(db, repository.id)
+    closed = (await db.execute(
+        update(Finding)
+        .where(
+            Finding.repository_id == repository.id,
+            Finding.ref == pr_ref(pr_number),
+            Finding.status == "open",
+        )
+        .values(status="closed")
+    )).rowcount
+    if closed:
+        open_after = await _open_finding_counts(db, repository.id)
+        await apply_stats_delta(db, repository.workspace_id, {
+            f"{severity}_findings": open_after.get(severity, 0) - open_before.get(severity, 0)
+            for severity in ("critical", "high", "medium", "low")
+        })
+    return closed
+
+
+async def latest_job(db: AsyncSession, repository_id, ref: str) -> Optional[ScanJob]:
+    """The newest job for a ref, whatever its status"""
+    return (await db.execute(
+        select(ScanJob)
+        .where(ScanJob.repository_id == repository_id, ScanJob.ref == ref)
+        .order_by(ScanJob.created_at.desc())
+        .limit(1)
+    )).scalar_one_or_none()
+
+
+async def create_scan_job(
+    db: AsyncSession,
+    repository: Repository,
+    plan_level: str,
+    commit_sha: str,
+    ref: str,
+    pr_number: Optional[int] = None,
+    base_sha: Optional[str] = None,
+    event_at: Optional[datetime] = None,
+) -> ScanJob:
+    """
+    Create a ScanJob for the head commit of a ref (a PR, or a branch that
+    was pushed to), superseding older ones for the same ref.
+    If this commit was already scanned (on any ref), the job links to that
+    result, takes over its findings and is created 'completed' so it never
+    reaches a worker; otherwise it is 'queued'.
+    """
+    superseded = await supersede_stale_jobs(db, repository.id, ref, commit_sha)
+    if superseded:
+        print(f"Superseded {superseded} queued job(s) for {repository.repo_name} {ref}")
+
+    new_job = ScanJob(
+        repository_id=repository.id,
+        workspace_id=repository.workspace_id,
+        plan_level=plan_level,
+        status="queued",
+        commit_sha=commit_sha,
+        base_sha=base_sha,
+        pr_number=pr_number,
+        ref=ref,
+        event_at=event_at,
+    )
+
+    previous = await find_reusable_result(db, repository.id, commit_sha, plan_level)
+    if previous is not None:
+        new_job.status = "completed"
+        new_job.completed_at = datetime.utcnow()
+        new_job.ruleset_version = previous.ruleset_version
+        new_job.reused_from_id = previous.id
+
+    db.add(new_job)
+    # Flush so later deliveries in the same batch can supersede this job too
+    await db.flush()
+    await apply_stats_delta(db, repository.workspace_id, status_transition(None, new_job.status))
+    if previous is not None:
+        await adopt_result(db, new_job, previous)
+    return new_job
+
+
+async def dispatch_jobs(db: AsyncSession, jobs: list, failure_reason: str):
+    """
+    Hand committed 'queued' jobs to the queue backend (a blocking client,
+    so off the event loop) and record the dispatch; jobs the backend
+    rejects are failed with failure_reason. The caller commits. A crash
+    before that commit leaves the jobs undispatched for the sweep, and
+    enqueueing one twice is harmless: workers only start 'queued' jobs.
+    """
+    for job in jobs:
+        if job.status != "queued":
+            continue  # e.g. superseded by a later delivery in the same batch
+        try:
+            await run_in_threadpool(
+                enqueue_scan_task,
+                job_id=str(job.id),
+                plan_level=job.plan_level,
+                workspace_id=str(job.workspace_id),
+            )
+        except Exception as e:
+            print(f"Failed to enqueue job {job.id}: {e}")
+            job.status = "failed"
+            job.completed_at = datetime.utcnow()
+            job.failure_reason = f"{failure_reason}: {e}"
+            await apply_stats_delta(db, job.workspace_id, status_transition("queued", "failed"))
+            continue
+        job.dispatched_at = datetime.utcnow()
+
+
+async def undispatched_jobs(db: AsyncSession, limit: int) -> list:
+    """Queued jobs committed over SCAN_DISPATCH_SWEEP_SECONDS ago and never dispatched, locked for this caller"""
+    stranded_since = datetime.utcnow() - timedelta(seconds=SCAN_DISPATCH_SWEEP_SECONDS)
+    return (await db.execute(
+        select(ScanJob)
+        .where(
+            ScanJob.status == "queued",
+            ScanJob.dispatched_at.is_(None),
+            ScanJob.queued_at < stranded_since,
+        )
+        .order_by(ScanJob.queued_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
@@ -2,14 +2,28 @@
 
 
 from fastapi import FastAPI, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from db import Base, engine
-
-from models import User
-from auth import get_or_create_user
+from db import Base, engine, upgrade_schema
+from async_db import async_engine
+
+from identity import CurrentUser, identity_cache
+from auth import (
+    get_or_create_user,
+    start_public_key_refresher,
+    stop_public_key_refresher,
+    token_cache,
+)
 from webhook_routes import router as webhook_router
 from repository_routes import router as repository_router
 from job_routes import router as job_router
+from webhook_inbox import start_drain_loop, stop_drain_loop
+from job_reaper import start_reaper, stop_reaper
+from workspace_stats import start_stats_reconciler, stop_stats_reconciler
+from github_client import close_github_client
+from github_tokens import github_app_tokens
+from github_cache import github_response_cache
+from github_ratelimit import github_rate_limiter
 
 
 
@@ -28,12 +42,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
 @app.on_event("startup")
-def on_startup():
-    Base.metadata.create_all(bind=engine)
+async def on_startup():
+    await run_in_threadpool(Base.metadata.create_all, bind=engine)
+    await run_in_threadpool(upgrade_schema)
+    start_public_key_refresher()
+    start_drain_loop()
+    start_reaper()
+    start_stats_reconciler()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_drain_loop()
+    await stop_reaper()
+    await stop_stats_reconciler()
+    await close_github_client()
+    stop_public_key_refresher()
+    await async_engine.dispose()
 
 
 @app.get("/")
@@ -47,9 +77,21 @@ def health_check():
     return {"status": "healthy", "service": "arcanext-api"}
 
 
+# In-process cache counters, for spotting regressions in hit rates
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "auth_token_cache": token_cache.stats(),
+        "identity_cache": identity_cache.stats(),
+        "github_app_tokens": github_app_tokens.stats(),
+        "github_response_cache": github_response_cache.stats(),
+        "github_rate_limits": github_rate_limiter.stats(),
+    }
+
+
 # Protected route to verify login and get user data
 @app.get("/api/v1/auth/me")
-def get_current_user_data(current_user: User = Depends(get_or_create_user)):
+def get_current_user_data(current_user: CurrentUser = Depends(get_or_create_user)):
     """
     Protected route.
     When a user hits this, it verifies their Firebase token (via the dependency).
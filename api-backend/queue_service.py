@@ -1,50 +1,111 @@
 import os
 import json
-import time
-import google.cloud.tasks_v2
-from google.protobuf.timestamp_pb2 import Timestamp
+import threading
+from sqlalchemy.dialects.postgresql import insert
+from db import SessionLocal
+from models import ScanQueueItem
 
-# Initialize the Cloud Tasks client as None
-tasks_client = None
+# Which queue backend dispatches scans to the scanner-worker:
+#   "cloudtasks" - Google Cloud Tasks pushes an HTTP request per job
+#   "postgres"   - jobs go into the scan_queue table and workers pull them
+# Only "postgres" gets the worker's scheduler (plan priority lanes, weighted
+# fairness between workspaces and SCHED_WORKSPACE_MAX_IN_FLIGHT); with
+# "cloudtasks" the sole plan handling is routing each plan to its own queue.
+SCAN_QUEUE_BACKEND = os.environ.get("SCAN_QUEUE_BACKEND", "cloudtasks")
 
 # Get config from environment variables
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT")
 QUEUE_LOCATION = os.environ.get("GOOGLE_CLOUD_TASKS_LOCATION")
 QUEUE_ID = os.environ.get("GOOGLE_CLOUD_TASKS_QUEUE")
+# Optional per-plan queues (e.g. GOOGLE_CLOUD_TASKS_QUEUE_ENTERPRISE), so paid
+# plans get their own dispatch rate; plans without one share QUEUE_ID.
+PLAN_QUEUE_ENV_PREFIX = "GOOGLE_CLOUD_TASKS_QUEUE_"
 SCAN_JOB_HANDLER_URL = os.environ.get("SCAN_JOB_HANDLER_URL")
 
-def enqueue_scan_task(job_id: str, plan_level: str):
-    global tasks_client
-
-    # Initialize the client if it's not already initialized
-    if tasks_client is None:
-        tasks_client = google.cloud.tasks_v2.CloudTasksClient()
-
-    parent = tasks_client.queue_path(PROJECT_ID, QUEUE_LOCATION, QUEUE_ID)
-
-    # Construct the task payload
-    task_payload = {"job_id": str(job_id), "plan_level": plan_level}
-
-    # Construct the task
-    task = {
-        "http_request": {
-            "http_method": google.cloud.tasks_v2.HttpMethod.POST,
-            "url": SCAN_JOB_HANDLER_URL,
-            "headers": {"Content-type": "application/json"},
-            "body": json.dumps(task_payload).encode(),
-            "oauth_token": {
-                "service_account_email": os.environ.get("SERVICE_ACCOUNT_EMAIL")
-            }
-        },
-    }
-
-    # Set a 60-minute deadline (our max scan time)
-    in_seconds = 60 * 60
-    now = time.time()
-    schedule_time = Timestamp()
-    schedule_time.seconds = int(now + in_seconds)
-    task["schedule_time"] = schedule_time
-
-    # Use the client to create the task
-    tasks_client.create_task(parent=parent, task=task)
-    print(f"Enqueued task for job {job_id}")
+# How long Cloud Tasks waits for the worker to answer a dispatch.
+# Cloud Tasks caps this at 30 minutes for HTTP targets.
+DISPATCH_DEADLINE_SECONDS = min(int(os.environ.get("SCAN_DISPATCH_DEADLINE_SECONDS", "600")), 30 * 60)
+
+
+class CloudTasksQueue:
+    """Pushes one HTTP task per job to the scanner-worker's /run-scan endpoint"""
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        # Build the client once, on first use (import is deferred so the
+        # Postgres backend runs without any Google Cloud dependency)
+        with self._lock:
+            if self._client is None:
+                import google.cloud.tasks_v2
+                self._client = google.cloud.tasks_v2.CloudTasksClient()
+        return self._client
+
+    def _queue_path(self, plan_level: str) -> str:
+        queue_id = os.environ.get(PLAN_QUEUE_ENV_PREFIX + plan_level.upper(), QUEUE_ID)
+        return self._client.queue_path(PROJECT_ID, QUEUE_LOCATION, queue_id)
+
+    def enqueue(self, job_id: str, plan_level: str, workspace_id: str):
+        import google.cloud.tasks_v2
+        from google.protobuf.duration_pb2 import Duration
+
+        client = self._get_client()
+
+        # Construct the task payload
+        task_payload = {"job_id": str(job_id), "plan_level": plan_level}
+
+        # Construct the task. It is dispatched right away; the deadline only
+        # bounds how long Cloud Tasks waits for the worker to accept it.
+        task = {
+            "http_request": {
+                "http_method": google.cloud.tasks_v2.HttpMethod.POST,
+                "url": SCAN_JOB_HANDLER_URL,
+                "headers": {"Content-type": "application/json"},
+                "body": json.dumps(task_payload).encode(),
+                "oauth_token": {
+                    "service_account_email": os.environ.get("SERVICE_ACCOUNT_EMAIL")
+                }
+            },
+            "dispatch_deadline": Duration(seconds=DISPATCH_DEADLINE_SECONDS),
+        }
+
+        client.create_task(parent=self._queue_path(plan_level), task=task)
+
+
+class PostgresQueue:
+    """
+    Inserts jobs into the scan_queue table. Scanner-worker instances claim
+    them in batches through their scheduler (see scanner-worker/scheduler.py),
+    which applies plan priority lanes and per-workspace fairness, so the
+    whole pipeline can run locally with nothing but Postgres.
+    """
+
+    def enqueue(self, job_id: str, plan_level: str, workspace_id: str):
+        db = SessionLocal()
+        try:
+            db.execute(
+                insert(ScanQueueItem)
+                .values(job_id=job_id, workspace_id=workspace_id, plan_level=plan_level)
+                .on_conflict_do_nothing(index_elements=[ScanQueueItem.job_id])
+            )
+            db.commit()
+        finally:
+            db.close()
+
+
+QUEUE_BACKENDS = {
+    "cloudtasks": CloudTasksQueue,
+    "postgres": PostgresQueue,
+}
+
+if SCAN_QUEUE_BACKEND not in QUEUE_BACKENDS:
+    raise ValueError(f"Unknown SCAN_QUEUE_BACKEND '{SCAN_QUEUE_BACKEND}'")
+
+scan_queue = QUEUE_BACKENDS[SCAN_QUEUE_BACKEND]()
+
+
+def enqueue_scan_task(job_id: str, plan_level: str, workspace_id: str):
+    scan_queue.enqueue(job_id, plan_level, workspace_id)
+    print(f"Enqueued task for job {job_id} ({SCAN_QUEUE_BACKEND})")
@@ -1,11 +1,25 @@
 import os
+import json
+import uuid
 import httpx
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from db import get_db
-from models import User, Repository, Workspace
-from auth import get_or_create_user
+from async_db import get_async_db
+from github_cache import github_get
+from github_pages import GitHubAPIError, GitHubListingTruncated, fetch_all_github_pages, iter_github_pages
+from github_ratelimit import GitHubRateLimited
+from github_tokens import github_app_tokens, get_github_app_jwt, get_installation_access_token
+from models import Repository
+from repository_service import bulk_sync_repositories
+from workspace_stats import apply_stats_delta
+from auth import get_or_create_user, get_current_workspace
+from identity import CurrentUser, CurrentWorkspace
 
 router = APIRouter(prefix="/api/v1/repositories", tags=["Repositories"])
 
@@ -26,22 +40,12 @@ class SyncInstallationRequest(BaseModel):
     installation_id: str
 
 
-def get_user_workspace(db: Session, user: User) -> Workspace:
-    """Helper to get user's first workspace (users have one workspace for now)"""
-    workspace = db.query(Workspace).filter(Workspace.owner_id == user.id).first()
-    if not workspace:
-        raise HTTPException(status_code=404, detail="User has no workspace")
-    return workspace
-
-
 @router.get("/", response_model=list[dict])
 def get_user_repositories(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_or_create_user)
+    workspace: CurrentWorkspace = Depends(get_current_workspace)
 ):
     """Get all repositories for the current user's workspace"""
-    workspace = get_user_workspace(db, current_user)
-    
     repos = db.query(Repository).filter(Repository.workspace_id == workspace.id).all()
     return [
         {
@@ -55,78 +59,115 @@ def get_user_repositories(
 
 
 @router.get("/github-install-url")
-def get_github_install_url(current_user: User = Depends(get_or_create_user)):
+def get_github_install_url(current_user: CurrentUser = Depends(get_or_create_user)):
     """Get the GitHub App installation URL"""
     return {
         "url": f"https://github.com/apps/{GITHUB_APP_NAME}/installations/new"
     }
 
 
+def _user_repo_summary(repo: dict) -> dict:
+    return {
+        "id": repo["id"],
+        "name": repo["name"],
+        "full_name": repo["full_name"],
+        "private": repo["private"],
+        "description": repo["description"],
+        "html_url": repo["html_url"],
+        "default_branch": repo["default_branch"],
+        "updated_at": repo["updated_at"],
+    }
+
+
 @router.post("/github/user-repos")
 async def get_github_user_repos(
     request: GitHubTokenRequest,
-    current_user: User = Depends(get_or_create_user)
+    response: Response,
+    stream: bool = False,
+    current_user: CurrentUser = Depends(get_or_create_user)
 ):
     """
     Fetch the user's GitHub repositories using their OAuth access token.
     This allows users who signed in with GitHub to see their repos directly.
+    With ?stream=true the repos are sent as NDJSON, one per line, as each
+    page arrives. Listings longer than GITHUB_MAX_PAGES are cut short and
+    say so: an X-Listing-Truncated header, or a final {"truncated": true}
+    line when streaming.
     """
+    pages = iter_github_pages(
+        "/user/repos",
+        f"token {request.github_token}",
+        params={
+            "sort": "updated",
+            "type": "all",
+        }
+    )
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.github.com/user/repos",
-                headers={
-                    "Authorization": f"token {request.github_token}",
-                    "Accept": "application/vnd.github.v3+json",
-                },
-                params={
-                    "sort": "updated",
-                    "per_page": 100,
-                    "type": "all",
-                }
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail="Failed to fetch GitHub repositories"
-                )
-            
-            repos = response.json()
-            return [
-                {
-                    "id": repo["id"],
-                    "name": repo["name"],
-                    "full_name": repo["full_name"],
-                    "private": repo["private"],
-                    "description": repo["description"],
-                    "html_url": repo["html_url"],
-                    "default_branch": repo["default_branch"],
-                    "updated_at": repo["updated_at"],
-                }
-                for repo in repos
-            ]
+        # Read the first page up front so auth errors still surface as a status code
+        first_page = await pages.__anext__()
+    except GitHubAPIError as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail="Failed to fetch GitHub repositories"
+        )
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"GitHub API error: {str(e)}")
 
+    if stream:
+        async def ndjson():
+            try:
+                for repo in first_page:
+                    yield json.dumps(_user_repo_summary(repo)) + "\n"
+                async for page in pages:
+                    yield "".join(json.dumps(_user_repo_summary(repo)) + "\n" for repo in page)
+            except GitHubRateLimited as e:
+                # Headers are already sent; tell the client the listing is incomplete
+                yield json.dumps({"error": e.detail, "retry_after": e.retry_after}) + "\n"
+            except GitHubListingTruncated as e:
+                yield json.dumps({"error": str(e), "truncated": True}) + "\n"
+            except (GitHubAPIError, httpx.RequestError) as e:
+                yield json.dumps({"error": f"GitHub API error: {str(e)}"}) + "\n"
+            finally:
+                await pages.aclose()
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    try:
+        repos = list(first_page)
+        async for page in pages:
+            repos.extend(page)
+    except GitHubListingTruncated as e:
+        print(f"{e}; returning the first {len(repos)} repositories")
+        response.headers["X-Listing-Truncated"] = "true"
+    except GitHubAPIError as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail="Failed to fetch GitHub repositories"
+        )
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=500, detail=f"GitHub API error: {str(e)}")
+
+    return [_user_repo_summary(repo) for repo in repos]
+
 
 @router.post("/github/connect")
 async def connect_github_repo(
     request: ConnectRepoRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_or_create_user)
+    db: AsyncSession = Depends(get_async_db),
+    workspace: CurrentWorkspace = Depends(get_current_workspace)
 ):
     """
     Connect a GitHub repository for scanning.
     This creates a repository record in our database.
     """
-    workspace = get_user_workspace(db, current_user)
-    
     # Check if repo already connected
-    existing = db.query(Repository).filter(
-        Repository.workspace_id == workspace.id,
-        Repository.repo_name == request.repo_name
-    ).first()
+    existing = (await db.execute(
+        select(Repository).where(
+            Repository.workspace_id == workspace.id,
+            Repository.repo_name == request.repo_name
+        ).limit(1)
+    )).scalar_one_or_none()
     
     if existing:
         return {
@@ -138,158 +179,111 @@ async def connect_github_repo(
     
     # Verify the repo exists and user has access
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://api.github.com/repos/{request.repo_name}",
-                headers={
-                    "Authorization": f"token {request.github_token}",
-                    "Accept": "application/vnd.github.v3+json",
-                }
+        response = await github_get(
+            f"/repos/{request.repo_name}",
+            f"token {request.github_token}"
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=404,
+                detail="Repository not found or you don't have access"
             )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=404,
-                    detail="Repository not found or you don't have access"
-                )
-            
-            repo_data = response.json()
+        
+        repo_data = response.json()
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"GitHub API error: {str(e)}")
     
-    # Create the repository record
-    new_repo = Repository(
-        workspace_id=workspace.id,
-        repo_name=request.repo_name,
-        provider="github",
-        external_id=str(repo_data["id"])
-    )
-    db.add(new_repo)
-    db.commit()
-    db.refresh(new_repo)
+    # Create the repository record. Rows are unique per GitHub id, not name:
+    # the repository may be connected already under an older name, or by a
+    # concurrent request, in which case the existing row is kept (renamed)
+    external_id = str(repo_data["id"])
+    new_repo_id = (await db.execute(
+        insert(Repository)
+        .values(
+            id=uuid.uuid4(),
+            workspace_id=workspace.id,
+            repo_name=request.repo_name,
+            provider="github",
+            external_id=external_id
+        )
+        .on_conflict_do_nothing(index_elements=["workspace_id", "external_id"])
+        .returning(Repository.id)
+    )).scalar_one_or_none()
     
-    return {
-        "id": str(new_repo.id),
-        "repo_name": new_repo.repo_name,
-        "provider": new_repo.provider,
-        "message": "Repository connected successfully"
-    }
-
-
-# GitHub App credentials for installation access
-GITHUB_APP_ID = os.environ.get("GITHUB_APP_ID", "")
-GITHUB_APP_PRIVATE_KEY = os.environ.get("GITHUB_APP_PRIVATE_KEY", "")
-
-
-def get_github_app_jwt():
-    """Generate a JWT for GitHub App authentication"""
-    import jwt
-    import time
+    if new_repo_id is None:
+        existing = (await db.execute(
+            select(Repository).where(
+                Repository.workspace_id == workspace.id,
+                Repository.external_id == external_id
+            )
+        )).scalar_one()
+        existing.repo_name = request.repo_name
+        await db.commit()
+        return {
+            "id": str(existing.id),
+            "repo_name": existing.repo_name,
+            "provider": existing.provider,
+            "message": "Repository already connected"
+        }
     
-    if not GITHUB_APP_ID or not GITHUB_APP_PRIVATE_KEY:
-        return None
+    await apply_stats_delta(db, workspace.id, {"repo_count": 1})
+    await db.commit()
     
-    now = int(time.time())
-    payload = {
-        "iat": now - 60,  # Issued 60 seconds ago
-        "exp": now + (10 * 60),  # Expires in 10 minutes
-        "iss": GITHUB_APP_ID,
+    return {
+        "id": str(new_repo_id),
+        "repo_name": request.repo_name,
+        "provider": "github",
+        "message": "Repository connected successfully"
     }
-    
-    # Handle private key - it might be base64 encoded or have escaped newlines
-    private_key = GITHUB_APP_PRIVATE_KEY.replace("\\n", "\n")
-    
-    return jwt.encode(payload, private_key, algorithm="RS256")
-
-
-async def get_installation_access_token(installation_id: str) -> str:
-    """Get an access token for a specific GitHub App installation"""
-    app_jwt = get_github_app_jwt()
-    if not app_jwt:
-        raise HTTPException(
-            status_code=500,
-            detail="GitHub App not configured. Please set GITHUB_APP_ID and GITHUB_APP_PRIVATE_KEY."
-        )
-    
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"https://api.github.com/app/installations/{installation_id}/access_tokens",
-            headers={
-                "Authorization": f"Bearer {app_jwt}",
-                "Accept": "application/vnd.github.v3+json",
-            }
-        )
-        
-        if response.status_code != 201:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail=f"Failed to get installation access token: {response.text}"
-            )
-        
-        return response.json()["token"]
 
 
 @router.post("/github/sync-installation")
 async def sync_github_app_installation(
     request: SyncInstallationRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_or_create_user)
+    db: AsyncSession = Depends(get_async_db),
+    workspace: CurrentWorkspace = Depends(get_current_workspace)
 ):
     """
     Sync repositories from a GitHub App installation.
     Called after user installs the GitHub App and is redirected back.
     """
-    workspace = get_user_workspace(db, current_user)
-    
     try:
         # Get installation access token
         access_token = await get_installation_access_token(request.installation_id)
         
-        # Fetch repositories accessible to this installation
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.github.com/installation/repositories",
-                headers={
-                    "Authorization": f"token {access_token}",
-                    "Accept": "application/vnd.github.v3+json",
-                },
-                params={"per_page": 100}
+        # Fetch repositories accessible to this installation. Past
+        # GITHUB_MAX_PAGES the ones read are synced and the response says so.
+        truncated = False
+        try:
+            repos = await fetch_all_github_pages(
+                "/installation/repositories",
+                f"token {access_token}",
+                principal=f"installation:{request.installation_id}",
+                items_key="repositories"
+            )
+        except GitHubListingTruncated as e:
+            print(f"{e}; syncing the first {len(e.items)} repositories")
+            repos, truncated = e.items, True
+        except GitHubAPIError as e:
+            if e.status_code == 401:
+                # The cached token was revoked early; mint a fresh one next time
+                github_app_tokens.invalidate_installation(request.installation_id)
+            raise HTTPException(
+                status_code=e.status_code,
+                detail="Failed to fetch installation repositories"
             )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail="Failed to fetch installation repositories"
-                )
-            
-            data = response.json()
-            repos = data.get("repositories", [])
-        
-        # Sync each repository
-        synced_repos = []
-        for repo in repos:
-            # Check if already exists
-            existing = db.query(Repository).filter(
-                Repository.workspace_id == workspace.id,
-                Repository.repo_name == repo["full_name"]
-            ).first()
-            
-            if not existing:
-                new_repo = Repository(
-                    workspace_id=workspace.id,
-                    repo_name=repo["full_name"],
-                    provider="github",
-                    external_id=str(repo["id"])
-                )
-                db.add(new_repo)
-                synced_repos.append(repo["full_name"])
         
-        db.commit()
+        # Sync them in bulk: one lookup, one rename update, batched inserts
+        result = await bulk_sync_repositories(db, workspace.id, repos)
+        await db.commit()
         
         return {
-            "message": f"Synced {len(synced_repos)} new repositories",
-            "synced_repos": synced_repos,
-            "total_repos": len(repos)
+            "message": f"Synced {len(result.added)} new repositories",
+            "synced_repos": result.added,
+            "renamed_repos": [new_name for _, new_name in result.renamed],
+            "total_repos": len(repos),
+            "truncated": truncated
         }
         
     except HTTPException:
@@ -300,7 +294,7 @@ async def sync_github_app_installation(
 
 @router.get("/github/installations")
 async def get_github_installations(
-    current_user: User = Depends(get_or_create_user)
+    current_user: CurrentUser = Depends(get_or_create_user)
 ):
     """
     Get GitHub App installations for the authenticated user.
@@ -311,29 +305,28 @@ async def get_github_installations(
         return {"installations": [], "message": "GitHub App not configured"}
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.github.com/app/installations",
-                headers={
-                    "Authorization": f"Bearer {app_jwt}",
-                    "Accept": "application/vnd.github.v3+json",
+        response = await github_get(
+            "/app/installations",
+            f"Bearer {app_jwt}",
+            principal="app"
+        )
+        
+        if response.status_code != 200:
+            return {"installations": [], "message": "Failed to fetch installations"}
+        
+        installations = response.json()
+        return {
+            "installations": [
+                {
+                    "id": inst["id"],
+                    "account": inst["account"]["login"],
+                    "account_type": inst["account"]["type"],
+                    "repository_selection": inst.get("repository_selection", "all"),
                 }
-            )
-            
-            if response.status_code != 200:
-                return {"installations": [], "message": "Failed to fetch installations"}
-            
-            installations = response.json()
-            return {
-                "installations": [
-                    {
-                        "id": inst["id"],
-                        "account": inst["account"]["login"],
-                        "account_type": inst["account"]["type"],
-                        "repository_selection": inst.get("repository_selection", "all"),
-                    }
-                    for inst in installations
-                ]
-            }
+                for inst in installations
+            ]
+        }
+    except GitHubRateLimited:
+        raise
     except Exception as e:
         return {"installations": [], "message": str(e)}
@@ -0,0 +1,78 @@
+import os
+import uuid
+from dataclasses import dataclass, field
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Repository
+from workspace_stats import apply_stats_delta
+
+# Rows per INSERT statement. asyncpg caps a statement at 32767 bind
+# parameters, so very large installations are written in a few batches.
+REPO_INSERT_BATCH_SIZE = int(os.environ.get("REPO_INSERT_BATCH_SIZE", "1000"))
+
+
+@dataclass
+class RepositorySyncResult:
+    added: list = field(default_factory=list)  # full names of new repositories
+    renamed: list = field(default_factory=list)  # (old name, new name)
+    unchanged: int = 0
+
+
+async def bulk_sync_repositories(db: AsyncSession, workspace_id, github_repos: list) -> RepositorySyncResult:
+    """
+    Make sure every GitHub repository (dicts with "id" and "full_name") has a
+    row in the workspace, in a constant number of round trips: one lookup of
+    the workspace's existing rows, one UPDATE for repositories renamed on
+    GitHub (matched by external_id) and batched multi-row inserts for the
+    rest. Inserts skip rows another request added meanwhile, via the
+    (workspace_id, external_id) unique constraint. The caller commits.
+    """
+    result = RepositorySyncResult()
+
+    wanted = {}
+    for repo in github_repos:
+        wanted[str(repo["id"])] = repo["full_name"]
+    if not wanted:
+        return result
+
+    existing = (await db.execute(
+        select(Repository.id, Repository.external_id, Repository.repo_name)
+        .where(Repository.workspace_id == workspace_id)
+    )).all()
+    existing_by_external_id = {row.external_id: row for row in existing}
+
+    renames = []
+    new_rows = []
+    for external_id, repo_name in wanted.items():
+        row = existing_by_external_id.get(external_id)
+        if row is None:
+            new_rows.append({
+                "id": uuid.uuid4(),
+                "workspace_id": workspace_id,
+                "provider": "github",
+                "repo_name": repo_name,
+                "external_id": external_id,
+            })
+        elif row.repo_name != repo_name:
+            renames.append({"id": row.id, "repo_name": repo_name})
+            result.renamed.append((row.repo_name, repo_name))
+        else:
+            result.unchanged += 1
+
+    if renames:
+        # ORM bulk UPDATE by primary key: one executemany round trip
+        await db.execute(update(Repository), renames)
+
+    for start in range(0, len(new_rows), REPO_INSERT_BATCH_SIZE):
+        inserted = await db.execute(
+            insert(Repository)
+            .values(new_rows[start:start + REPO_INSERT_BATCH_SIZE])
+            .on_conflict_do_nothing(index_elements=["workspace_id", "external_id"])
+            .returning(Repository.repo_name)
+        )
+        result.added.extend(inserted.scalars().all())
+
+    if result.added:
+        await apply_stats_delta(db, workspace_id, {"repo_count": len(result.added)})
+    return result
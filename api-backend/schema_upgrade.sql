@@ -0,0 +1,123 @@
+-- Brings a database created by an earlier version up to models.py.
+-- create_all only creates missing tables; it never alters existing ones, so
+-- columns, constraints and indexes added to existing tables live here.
+-- Idempotent: the API applies it on every start, right after create_all
+-- (db.upgrade_schema), and it can be run by hand with psql -f.
+
+-- One instance upgrades at a time
+SELECT pg_advisory_xact_lock(hashtext('arcanext.schema_upgrade'));
+
+-- scanjobs ------------------------------------------------------------------
+
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS workspace_id UUID REFERENCES workspaces (id);
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS base_sha VARCHAR;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS ref VARCHAR;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS cancel_requested BOOLEAN NOT NULL DEFAULT false;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS ruleset_version VARCHAR;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS reused_from_id UUID REFERENCES scanjobs (id);
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS worker_id VARCHAR;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITHOUT TIME ZONE;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS failure_reason TEXT;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS queued_at TIMESTAMP WITHOUT TIME ZONE;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS dispatched_at TIMESTAMP WITHOUT TIME ZONE;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS scan_scope VARCHAR;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS analysis_cache_hits INTEGER;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS analysis_cache_misses INTEGER;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS findings_count INTEGER;
+ALTER TABLE scanjobs ADD COLUMN IF NOT EXISTS event_at TIMESTAMP WITHOUT TIME ZONE;
+
+UPDATE scanjobs j SET workspace_id = r.workspace_id
+FROM repositories r
+WHERE j.workspace_id IS NULL AND r.id = j.repository_id;
+ALTER TABLE scanjobs ALTER COLUMN workspace_id SET NOT NULL;
+
+-- Every job before refs were recorded was a PR scan
+UPDATE scanjobs SET ref = 'pr/' || pr_number WHERE ref IS NULL AND pr_number IS NOT NULL;
+
+-- Jobs from before dispatch was recorded were enqueued when they were
+-- created; without this the dispatch sweep would enqueue them all again
+UPDATE scanjobs SET queued_at = created_at, dispatched_at = created_at WHERE queued_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS ix_scanjobs_workspace_id ON scanjobs (workspace_id);
+CREATE INDEX IF NOT EXISTS ix_scanjobs_lease_expires_at ON scanjobs (lease_expires_at);
+CREATE INDEX IF NOT EXISTS ix_scanjobs_repository_commit ON scanjobs (repository_id, commit_sha);
+CREATE INDEX IF NOT EXISTS ix_scanjobs_repository_ref_completed ON scanjobs (repository_id, ref, completed_at);
+CREATE INDEX IF NOT EXISTS ix_scanjobs_plan_completed ON scanjobs (plan_level, completed_at);
+CREATE INDEX IF NOT EXISTS ix_scanjobs_workspace_created ON scanjobs (workspace_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_scanjobs_workspace_status_created ON scanjobs (workspace_id, status, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_scanjobs_repository_created ON scanjobs (repository_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_scanjobs_undispatched ON scanjobs (queued_at)
+    WHERE status = 'queued' AND dispatched_at IS NULL;
+
+-- findings: open/fixed state per ref --------------------------------------
+
+ALTER TABLE findings ADD COLUMN IF NOT EXISTS ref VARCHAR;
+-- Before refs, a repository's findings belonged to whichever PR scanned it last
+UPDATE findings f SET ref = coalesce(j.ref, 'pr/' || j.pr_number, 'legacy')
+FROM scanjobs j
+WHERE f.ref IS NULL AND j.id = f.last_seen_job_id;
+ALTER TABLE findings ALTER COLUMN ref SET NOT NULL;
+ALTER TABLE findings DROP CONSTRAINT IF EXISTS uq_findings_repository_fingerprint;
+
+-- repositories: one row per GitHub repository per workspace -----------------
+
+-- Merge duplicates into one row per (workspace, external id), the one
+-- with the lowest id (an arbitrary but stable choice), before the unique
+-- constraint goes on: move their jobs and findings over, dropping findings
+-- the surviving row already has on the same ref
+CREATE TEMPORARY TABLE repository_duplicates ON COMMIT DROP AS
+SELECT id AS duplicate_id, survivor_id
+FROM (
+    SELECT id, first_value(id) OVER (PARTITION BY workspace_id, external_id ORDER BY id::text) AS survivor_id
+    FROM repositories
+) ranked
+WHERE id <> survivor_id;
+
+UPDATE scanjobs j SET repository_id = d.survivor_id
+FROM repository_duplicates d
+WHERE j.repository_id = d.duplicate_id;
+
+CREATE TEMPORARY TABLE finding_duplicates ON COMMIT DROP AS
+SELECT id
+FROM (
+    SELECT f.id, row_number() OVER (
+        PARTITION BY coalesce(d.survivor_id, f.repository_id), f.ref, f.fingerprint
+        ORDER BY d.survivor_id IS NOT NULL, f.id::text
+    ) AS rank
+    FROM findings f
+    LEFT JOIN repository_duplicates d ON d.duplicate_id = f.repository_id
+    WHERE f.repository_id IN (
+        SELECT duplicate_id FROM repository_duplicates UNION SELECT survivor_id FROM repository_duplicates
+    )
+) ranked
+WHERE rank > 1;
+
+DELETE FROM scan_job_findings WHERE finding_id IN (SELECT id FROM finding_duplicates);
+DELETE FROM findings WHERE id IN (SELECT id FROM finding_duplicates);
+UPDATE findings f SET repository_id = d.survivor_id
+FROM repository_duplicates d
+WHERE f.repository_id = d.duplicate_id;
+
+DELETE FROM repositories r USING repository_duplicates d WHERE r.id = d.duplicate_id;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_repositories_workspace_external_id') THEN
+        ALTER TABLE repositories
+            ADD CONSTRAINT uq_repositories_workspace_external_id UNIQUE (workspace_id, external_id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_findings_repository_ref_fingerprint') THEN
+        ALTER TABLE findings
+            ADD CONSTRAINT uq_findings_repository_ref_fingerprint UNIQUE (repository_id, ref, fingerprint);
+    END IF;
+END
+$$;
+
+-- Tables added during earlier upgrades, and the columns they gained since ---
+
+ALTER TABLE scan_queue ADD COLUMN IF NOT EXISTS claimed_by VARCHAR;
+ALTER TABLE scan_queue ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP WITHOUT TIME ZONE;
+ALTER TABLE webhook_deliveries ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP WITHOUT TIME ZONE;
+CREATE INDEX IF NOT EXISTS ix_webhook_deliveries_processed_at ON webhook_deliveries (processed_at);
+ALTER TABLE workspace_stats ADD COLUMN IF NOT EXISTS reconciled_at TIMESTAMP WITHOUT TIME ZONE;
@@ -0,0 +1,273 @@
+import os
+import json
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from async_db import AsyncSessionLocal
+from models import Repository, Workspace, WebhookDelivery
+from job_service import branch_ref, close_pr, create_scan_job, dispatch_jobs, latest_job, pr_ref
+
+# How many deliveries one drain pass claims, and how long the loop sleeps
+# when the inbox is empty (a new delivery wakes it up immediately anyway).
+INBOX_BATCH_SIZE = int(os.environ.get("WEBHOOK_INBOX_BATCH_SIZE", "50"))
+INBOX_POLL_SECONDS = float(os.environ.get("WEBHOOK_INBOX_POLL_SECONDS", "5"))
+INBOX_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_INBOX_MAX_ATTEMPTS", "5"))
+# A failed delivery is retried after this many seconds, doubling per attempt up to the cap
+INBOX_RETRY_BASE_SECONDS = float(os.environ.get("WEBHOOK_INBOX_RETRY_BASE_SECONDS", "10"))
+INBOX_RETRY_MAX_SECONDS = float(os.environ.get("WEBHOOK_INBOX_RETRY_MAX_SECONDS", "600"))
+# How long processed, ignored and failed deliveries are kept, and how many
+# one prune pass deletes (the reaper loop runs it)
+INBOX_RETENTION_SECONDS = int(os.environ.get("WEBHOOK_INBOX_RETENTION_SECONDS", str(7 * 24 * 60 * 60)))
+INBOX_PRUNE_BATCH_SIZE = int(os.environ.get("WEBHOOK_INBOX_PRUNE_BATCH_SIZE", "1000"))
+
+# We only care about PRs being opened or updated (new commits)
+RELEVANT_PR_ACTIONS = ["opened", "synchronize"]
+# Commits GitHub sends for the "before" of a newly created or the "after" of a deleted branch
+NULL_SHA = "0" * 40
+
+_wakeup = asyncio.Event()
+_drain_task = None
+
+
+async def record_delivery(db: AsyncSession, delivery_id: str, event: str, body: bytes) -> bool:
+    """
+    Store a verified delivery in the inbox.
+    Returns False if this delivery id was already recorded (a GitHub redelivery).
+    """
+    result = await db.execute(
+        insert(WebhookDelivery)
+        .values(delivery_id=delivery_id, event=event, payload=body.decode("utf-8"))
+        .on_conflict_do_nothing(index_elements=[WebhookDelivery.delivery_id])
+    )
+    await db.commit()
+    inserted = result.rowcount == 1
+    if inserted:
+        _wakeup.set()
+    return inserted
+
+
+def _github_time(value: Optional[str]) -> Optional[datetime]:
+    """A GitHub API timestamp ("2024-05-01T12:00:00Z") as naive UTC, like our columns"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+    except ValueError:
+        return None
+
+
+async def _find_repository(db: AsyncSession, payload: dict):
+    """The delivery's repository and its workspace's plan level, or None if we don't know it"""
+    return (await db.execute(
+        select(Repository, Workspace.plan_level)
+        .join(Workspace, Repository.workspace_id == Workspace.id)
+        .where(Repository.external_id == str(payload["repository"]["id"]))
+        .limit(1)
+    )).first()
+
+
+async def _process_pull_request(db: AsyncSession, payload: dict):
+    """
+    Turn a pull_request delivery into a queued ScanJob, or close the PR's
+    findings when it was closed.
+    Returns (delivery_status, job, reason).
+    """
+    action = payload.get("action")
+    if action not in RELEVANT_PR_ACTIONS and action != "closed":
+        return "ignored", None, "Event not relevant"
+
+    pr = payload["pull_request"]
+
+    # 1. Find the repository in our database, along with its workspace plan level
+    row = await _find_repository(db, payload)
+    if not row:
+        # If we don't know this repo, we can't scan it
+        return "ignored", None, f"Repository {payload['repository']['id']} not found in Arcanext"
+
+    db_repo, plan_level = row
+
+    if action == "closed":
+        closed = await close_pr(db, db_repo, pr["number"])
+        print(f"Closed {closed} finding(s) of {db_repo.repo_name}#{pr['number']}")
+        return "processed", None, None
+
+    # 2. A delivery retried after a failure may be older than one already
+    # processed: never let it supersede the job for a newer head commit
+    head_sha = pr["head"]["sha"]
+    event_at = _github_time(pr.get("updated_at"))
+    latest = await latest_job(db, db_repo.id, pr_ref(pr["number"]))
+    if (
+        latest is not None
+        and latest.commit_sha != head_sha
+        and latest.event_at is not None
+        and event_at is not None
+        and event_at < latest.event_at
+    ):
+        return "ignored", None, f"Stale delivery: a newer commit ({latest.commit_sha[:12]}) was already queued"
+
+    # 3. Create the ScanJob in our database, superseding older jobs for this PR
+    new_job = await create_scan_job(
+        db,
+        db_repo,
+        plan_level=plan_level,
+        commit_sha=head_sha,
+        ref=pr_ref(pr["number"]),
+        pr_number=pr["number"],
+        base_sha=pr.get("base", {}).get("sha"),
+        event_at=event_at,
+    )
+    return "processed", new_job, None
+
+
+async def _process_push(db: AsyncSession, payload: dict):
+    """
+    Turn a push to the repository's default branch into a queued ScanJob
+    for the branch, diffed against the commit the branch was at before.
+    Returns (delivery_status, job, reason).
+    """
+    repository = payload["repository"]
+    branch = f"refs/heads/{repository.get('default_branch')}"
+    if payload.get("ref") != branch or payload.get("deleted") or payload.get("after") in (None, NULL_SHA):
+        return "ignored", None, "Not a push to the default branch"
+
+    row = await _find_repository(db, payload)
+    if not row:
+        return "ignored", None, f"Repository {repository['id']} not found in Arcanext"
+
+    db_repo, plan_level = row
+    before = payload.get("before")
+    new_job = await create_scan_job(
+        db,
+        db_repo,
+        plan_level=plan_level,
+        commit_sha=payload["after"],
+        ref=branch_ref(repository["default_branch"]),
+        base_sha=before if before != NULL_SHA else None,
+    )
+    return "processed", new_job, None
+
+
+async def _process_delivery(db: AsyncSession, delivery: WebhookDelivery):
+    payload = json.loads(delivery.payload)
+    if delivery.event == "pull_request" and "pull_request" in payload:
+        return await _process_pull_request(db, payload)
+    if delivery.event == "push" and "repository" in payload:
+        return await _process_push(db, payload)
+    return "ignored", None, "Event not relevant"
+
+
+async def drain_once() -> int:
+    """
+    Claim a batch of pending deliveries that are due and turn them into
+    ScanJobs. Rows are claimed with SKIP LOCKED so several API instances
+    can drain concurrently. Jobs are committed before they are enqueued, so
+    a worker can never receive a job id that isn't visible in the database
+    yet; jobs stranded by a crash in between are picked up by the dispatch
+    sweep (job_reaper.py). Failed deliveries back off exponentially.
+    Returns the number of deliveries claimed.
+    """
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        deliveries = (await db.execute(
+            select(WebhookDelivery)
+            .where(
+                WebhookDelivery.status == "pending",
+                or_(WebhookDelivery.next_attempt_at.is_(None), WebhookDelivery.next_attempt_at <= now),
+            )
+            .order_by(WebhookDelivery.received_at)
+            .limit(INBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )).scalars().all()
+        if not deliveries:
+            return 0
+
+        new_jobs = []
+        for delivery in deliveries:
+            delivery.attempts += 1
+            try:
+                async with db.begin_nested():
+                    delivery_status, job, reason = await _process_delivery(db, delivery)
+            except Exception as e:
+                print(f"Failed to process webhook delivery {delivery.delivery_id}: {e}")
+                delivery.error = str(e)
+                if delivery.attempts >= INBOX_MAX_ATTEMPTS:
+                    delivery.status = "failed"
+                    delivery.processed_at = datetime.utcnow()
+                else:
+                    backoff = min(INBOX_RETRY_BASE_SECONDS * 2 ** (delivery.attempts - 1), INBOX_RETRY_MAX_SECONDS)
+                    delivery.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+                continue
+
+            delivery.status = delivery_status
+            delivery.error = reason
+            delivery.processed_at = datetime.utcnow()
+            if job is not None:
+                new_jobs.append(job)
+
+        await db.commit()
+
+        # A later delivery in this batch may already have superseded a job
+        await dispatch_jobs(db, new_jobs, "Failed to enqueue")
+        await db.commit()
+
+        return len(deliveries)
+
+
+async def prune_deliveries() -> int:
+    """
+    Delete deliveries that were finished (processed, ignored or failed)
+    over INBOX_RETENTION_SECONDS ago, at most INBOX_PRUNE_BATCH_SIZE per
+    call. Pending ones are never pruned. Returns the number deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=INBOX_RETENTION_SECONDS)
+    async with AsyncSessionLocal() as db:
+        expired = (
+            select(WebhookDelivery.delivery_id)
+            .where(WebhookDelivery.status != "pending", WebhookDelivery.processed_at < cutoff)
+            .limit(INBOX_PRUNE_BATCH_SIZE)
+        )
+        pruned = (await db.execute(
+            delete(WebhookDelivery).where(WebhookDelivery.delivery_id.in_(expired))
+        )).rowcount
+        await db.commit()
+        return pruned
+
+
+async def _drain_loop():
+    while True:
+        # Cleared before draining, so a delivery recorded mid-drain still wakes us
+        _wakeup.clear()
+        try:
+            claimed = await drain_once()
+        except Exception as e:
+            print(f"Webhook inbox drain failed: {e}")
+            claimed = 0
+
+        # A full batch means there is probably more waiting
+        if claimed >= INBOX_BATCH_SIZE:
+            continue
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=INBOX_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_drain_loop():
+    global _drain_task
+    if _drain_task is None:
+        _drain_task = asyncio.create_task(_drain_loop())
+
+
+async def stop_drain_loop():
+    global _drain_task
+    if _drain_task is not None:
+        _drain_task.cancel()
+        try:
+            await _drain_task
+        except asyncio.CancelledError:
+            pass
+        _drain_task = None
@@ -0,0 +1,145 @@
+import os
+import asyncio
+from datetime import datetime
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from async_db import AsyncSessionLocal
+from models import Finding, Repository, ScanJob, Workspace, WorkspaceStats
+
+# How often every workspace's counters are recomputed from the source tables
+STATS_RECONCILE_INTERVAL_SECONDS = float(os.environ.get("STATS_RECONCILE_INTERVAL_SECONDS", "3600"))
+STATS_RECONCILE_BATCH_SIZE = int(os.environ.get("STATS_RECONCILE_BATCH_SIZE", "100"))
+
+SCAN_STATUSES = ("queued", "running", "completed", "failed", "superseded")
+COUNTER_COLUMNS = ("repo_count",) + tuple(f"{status}_scans" for status in SCAN_STATUSES) + (
+    "critical_findings",
+    "high_findings",
+    "medium_findings",
+    "low_findings",
+)
+
+_reconcile_task = None
+
+
+def status_transition(old_status, new_status, count: int = 1) -> dict:
+    """Counter deltas for `count` jobs moving from old_status to new_status (None for created)"""
+    deltas = {}
+    if old_status is not None:
+        deltas[f"{old_status}_scans"] = -count
+    if new_status is not None:
+        deltas[f"{new_status}_scans"] = deltas.get(f"{new_status}_scans", 0) + count
+    return deltas
+
+
+def stats_delta_statement(workspace_id, deltas: dict):
+    """
+    Upsert adding deltas to a workspace's counters. Run it in the same
+    transaction as the change it accounts for, so the two commit together.
+    """
+    unknown = set(deltas) - set(COUNTER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown workspace stats counters: {sorted(unknown)}")
+
+    stmt = insert(WorkspaceStats).values(workspace_id=workspace_id, updated_at=datetime.utcnow(), **deltas)
+    return stmt.on_conflict_do_update(
+        index_elements=[WorkspaceStats.workspace_id],
+        set_={
+            **{column: getattr(WorkspaceStats, column) + stmt.excluded[column] for column in deltas},
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+
+async def apply_stats_delta(db: AsyncSession, workspace_id, deltas: dict):
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if deltas:
+        await db.execute(stats_delta_statement(workspace_id, deltas))
+
+
+async def reconcile_workspace(db: AsyncSession, workspace_id) -> WorkspaceStats:
+    """
+    Recompute one workspace's counters from the source tables and overwrite
+    the row. The stats row is locked first: deltas committed before we got the
+    lock are in our counts, and later ones wait and apply on top. The caller commits.
+    """
+    await db.execute(
+        select(WorkspaceStats.workspace_id)
+        .where(WorkspaceStats.workspace_id == workspace_id)
+        .with_for_update()
+    )
+
+    counts = {column: 0 for column in COUNTER_COLUMNS}
+    counts["repo_count"] = (await db.execute(
+        select(func.count()).select_from(Repository).where(Repository.workspace_id == workspace_id)
+    )).scalar_one()
+    for status, count in (await db.execute(
+        select(ScanJob.status, func.count())
+        .where(ScanJob.workspace_id == workspace_id)
+        .group_by(ScanJob.status)
+    )).all():
+        if f"{status}_scans" in counts:
+            counts[f"{status}_scans"] = count
+    # An issue open on several refs of a repository counts once, as in the worker
+    for severity, count in (await db.execute(
+        select(Finding.severity, func.count(tuple_(Finding.repository_id, Finding.fingerprint).distinct()))
+        .where(Finding.workspace_id == workspace_id, Finding.status == "open")
+        .group_by(Finding.severity)
+    )).all():
+        if f"{severity}_findings" in counts:
+            counts[f"{severity}_findings"] = count
+
+    now = datetime.utcnow()
+    stmt = insert(WorkspaceStats).values(workspace_id=workspace_id, updated_at=now, reconciled_at=now, **counts)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[WorkspaceStats.workspace_id],
+        set_={column: stmt.excluded[column] for column in (*COUNTER_COLUMNS, "updated_at", "reconciled_at")},
+    ).returning(WorkspaceStats)
+    return (await db.scalars(stmt, execution_options={"populate_existing": True})).one()
+
+
+async def reconcile_all_workspaces() -> int:
+    """Correct drift in every workspace's counters, one short transaction each"""
+    reconciled = 0
+    last_id = None
+    while True:
+        async with AsyncSessionLocal() as db:
+            query = select(Workspace.id).order_by(Workspace.id).limit(STATS_RECONCILE_BATCH_SIZE)
+            if last_id is not None:
+                query = query.where(Workspace.id > last_id)
+            workspace_ids = (await db.execute(query)).scalars().all()
+            if not workspace_ids:
+                return reconciled
+
+            for workspace_id in workspace_ids:
+                await reconcile_workspace(db, workspace_id)
+                await db.commit()
+                reconciled += 1
+            last_id = workspace_ids[-1]
+
+
+async def _reconcile_loop():
+    while True:
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL_SECONDS)
+        try:
+            reconciled = await reconcile_all_workspaces()
+            print(f"Reconciled stats for {reconciled} workspace(s)")
+        except Exception as e:
+            print(f"Workspace stats reconciliation failed: {e}")
+
+
+def start_stats_reconciler():
+    global _reconcile_task
+    if _reconcile_task is None:
+        _reconcile_task = asyncio.create_task(_reconcile_loop())
+
+
+async def stop_stats_reconciler():
+    global _reconcile_task
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+        try:
+            await _reconcile_task
+        except asyncio.CancelledError:
+            pass
+        _reconcile_task = None
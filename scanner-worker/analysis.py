@@ -0,0 +1,129 @@
+import os
+import shutil
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+from analysis_cache import analysis_cache
+from analyzers import SemgrepAnalyzer
+from clone_cache import clone_cache
+from cpu_pool import cpu_pool
+from rulesets import PLAN_RULESETS, RulesetError, rulesets
+from shards import analyze_sharded
+
+# Files looked up and analyzed per round; bounds memory and is where cancellation is checked
+ANALYSIS_CHUNK_FILES = int(os.environ.get("ANALYSIS_CHUNK_FILES", "5000"))
+
+
+class NoAnalyzersError(Exception):
+    """This container can't run any analyzer, so a scan would report nothing"""
+
+
+def get_analyzers(plan_level: str) -> list:
+    """
+    The analyzers this container can run, with the plan's rulesets. Raises
+    NoAnalyzersError rather than returning none: a scan that analyzed
+    nothing would mark every open finding on its ref as fixed.
+    """
+    if shutil.which("semgrep") is None:
+        raise NoAnalyzersError("semgrep is not installed on this worker")
+    ruleset = rulesets.current(plan_level)
+    return [SemgrepAnalyzer(ruleset.path, version=ruleset.version, path_filtered=ruleset.path_filtered)]
+
+
+def ruleset_stamp(base_version: str, analyzers: list) -> str:
+    """
+    What a scan's results depend on, stamped on the job: the configured
+    ruleset version plus the digest of each analyzer's prepared rules
+    (e.g. "1:3f2a9c..."). Reuse and diff scans only match on equal stamps.
+    """
+    return ":".join([base_version, *(analyzer.version for analyzer in analyzers if analyzer.version)])
+
+
+def warm_up():
+    """Start the pool processes analysis runs in and prepare every plan's rulesets before the first scan"""
+    cpu_pool.warm_up()
+    if shutil.which("semgrep") is None:
+        print("semgrep is not installed; every scan on this worker will fail")
+        return
+    for plan_level in PLAN_RULESETS:
+        try:
+            rulesets.current(plan_level)
+        except RulesetError as e:
+            print(f"Could not prepare the ruleset for plan '{plan_level}': {e}")
+
+
+@dataclass
+class AnalysisStats:
+    """Per-scan counts of (file, analyzer) pairs served from the cache vs. analyzed"""
+    cache_hits: int = 0
+    cache_misses: int = 0
+    shards: int = 0  # shards analyzed, counting the halves of ones that timed out
+    skipped_paths: set = field(default_factory=set)  # analysis timed out
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.cache_hits + self.cache_misses
+        return self.cache_hits / total if total else 0.0
+
+
+def collect_findings(
+    repo_key: str,
+    commit_sha: str,
+    worktree: str,
+    plan_level: str,
+    ruleset_version: str,
+    paths: Optional[set] = None,
+    stats: Optional[AnalysisStats] = None,
+    check: Optional[Callable[[], None]] = None,
+    analyzers: Optional[list] = None,
+) -> Iterator[dict]:
+    """
+    Stream the findings for a checkout with the plan's analyzers, limited
+    to `paths` when given. Files are addressed by git blob SHA plus the
+    analyzer's cache scope (the extension, for semgrep): each chunk is
+    looked up in the analysis cache first, and only the misses are
+    analyzed (each distinct key once, however many paths share it),
+    sharded across the CPU pool with findings streamed back shard by shard. `check` is called while
+    waiting so a cancelled scan stops promptly. `analyzers` defaults to
+    the plan's current ones; pass the list the job's stamp was taken from.
+    """
+    stats = stats if stats is not None else AnalysisStats()
+    files = clone_cache.list_files(repo_key, commit_sha)
+    if paths is not None:
+        files = [(path, blob) for path, blob in files if path in paths]
+
+    for analyzer in analyzers if analyzers is not None else get_analyzers(plan_level):
+        targets = [(path, blob) for path, blob in files if analyzer.applies_to(path)]
+        # Results are only reused for the exact rules that produced them
+        version = f"{ruleset_version}:{analyzer.version}" if analyzer.version else ruleset_version
+        for start in range(0, len(targets), ANALYSIS_CHUNK_FILES):
+            if check is not None:
+                check()
+            chunk = targets[start:start + ANALYSIS_CHUNK_FILES]
+            key = lambda path, blob: (blob, f"{analyzer.name}:{analyzer.cache_scope(path)}", version)
+
+            cached = analysis_cache.get_many(list({key(path, blob) for path, blob in chunk}))
+            to_analyze = {}  # cache key -> every path with that content and scope
+            for path, blob in chunk:
+                if key(path, blob) in cached:
+                    stats.cache_hits += 1
+                    for finding in cached[key(path, blob)]:
+                        yield {**finding, "file_path": path}
+                else:
+                    to_analyze.setdefault(key(path, blob), []).append(path)
+            if not to_analyze:
+                continue
+
+            key_at = {key_paths[0]: cache_key for cache_key, key_paths in to_analyze.items()}
+            for shard_paths, results in analyze_sharded(analyzer, worktree, list(key_at), check=check):
+                stats.shards += 1
+                if results is None:
+                    for path in shard_paths:
+                        stats.skipped_paths.update(to_analyze[key_at[path]])
+                    continue
+                new_entries = {key_at[path]: results.get(path, []) for path in shard_paths}
+                analysis_cache.put_many(new_entries)
+                for path in shard_paths:
+                    for same_content_path in to_analyze[key_at[path]]:
+                        stats.cache_misses += 1
+                        for finding in new_entries[key_at[path]]:
+                            yield {**finding, "file_path": same_content_path}
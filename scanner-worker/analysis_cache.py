@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from database import SessionLocal
+from models import AnalysisResult
+
+# Local tier: one small JSON file per entry, least recently used evicted past the budget
+ANALYSIS_CACHE_DIR = os.environ.get("ANALYSIS_CACHE_DIR", "/tmp/arcanext/analysis-cache")
+ANALYSIS_CACHE_MAX_BYTES = int(os.environ.get("ANALYSIS_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Keys per query / rows per insert against the shared tier
+ANALYSIS_CACHE_DB_BATCH = int(os.environ.get("ANALYSIS_CACHE_DB_BATCH", "1000"))
+
+
+class AnalysisCache:
+    """
+    Content-addressed cache of analyzer output, keyed by (git blob SHA,
+    analyzer and its cache scope, ruleset version). Lookups try the local
+    disk first, then the shared analysis_results table (filling the local
+    tier on the way back); new results are written to both. The same file
+    content on any branch, fork or path (within the analyzer's scope) is
+    analyzed once per ruleset.
+    """
+
+    def __init__(self, root: str = ANALYSIS_CACHE_DIR, max_bytes: int = ANALYSIS_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._used_bytes = None  # measured lazily on first write
+        self._counters = {"local_hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0}
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: tuple) -> str:
+        digest = hashlib.sha256("\0".join(key).encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:] + ".json")
+
+    def _read_local(self, key: tuple):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                results = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)  # recency for LRU eviction
+        except OSError:
+            pass
+        return results
+
+    def _write_local(self, key: tuple, results: list):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(results, f)
+        os.replace(tmp_path, path)  # readers never see a partial file
+        with self._lock:
+            if self._used_bytes is not None:
+                self._used_bytes += os.path.getsize(path)
+
+    def get_many(self, keys: list) -> dict:
+        """{key: results} for the keys found in either tier; keys are (blob_sha, analyzer, ruleset_version)"""
+        found = {}
+        remote = []
+        for key in keys:
+            results = self._read_local(key)
+            if results is None:
+                remote.append(key)
+            else:
+                found[key] = results
+        local_hits = len(found)
+
+        if remote:
+            db = SessionLocal()
+            try:
+                for start in range(0, len(remote), ANALYSIS_CACHE_DB_BATCH):
+                    batch = remote[start:start + ANALYSIS_CACHE_DB_BATCH]
+                    rows = db.execute(
+                        select(
+                            AnalysisResult.blob_sha,
+                            AnalysisResult.analyzer,
+                            AnalysisResult.ruleset_version,
+                            AnalysisResult.results,
+                        ).where(
+                            tuple_(AnalysisResult.blob_sha, AnalysisResult.analyzer, AnalysisResult.ruleset_version)
+                            .in_(batch)
+                        )
+                    ).all()
+                    for blob_sha, analyzer, ruleset_version, results in rows:
+                        key = (blob_sha, analyzer, ruleset_version)
+                        found[key] = json.loads(results)
+                        self._write_local(key, found[key])
+            finally:
+                db.close()
+
+        with self._lock:
+            self._counters["local_hits"] += local_hits
+            self._counters["shared_hits"] += len(found) - local_hits
+            self._counters["misses"] += len(keys) - len(found)
+        self.evict()
+        return found
+
+    def put_many(self, entries: dict):
+        """Store {key: results} in both tiers"""
+        if not entries:
+            return
+        for key, results in entries.items():
+            self._write_local(key, results)
+
+        now = datetime.utcnow()
+        rows = [
+            {
+                "blob_sha": blob_sha,
+                "analyzer": analyzer,
+                "ruleset_version": ruleset_version,
+                "results": json.dumps(results),
+                "created_at": now,
+            }
+            for (blob_sha, analyzer, ruleset_version), results in entries.items()
+        ]
+        db = SessionLocal()
+        try:
+            for start in range(0, len(rows), ANALYSIS_CACHE_DB_BATCH):
+                db.execute(
+                    insert(AnalysisResult)
+                    .values(rows[start:start + ANALYSIS_CACHE_DB_BATCH])
+                    .on_conflict_do_nothing()
+                )
+            db.commit()
+        finally:
+            db.close()
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop least recently used local entries while over the disk budget"""
+        with self._lock:
+            if self._used_bytes is not None and self._used_bytes <= self.max_bytes:
+                return 0
+
+        entries = []
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        used = sum(size for _, size, _ in entries)
+
+        evicted = 0
+        # Evict down to 90% so we don't walk the directory on every write
+        target = self.max_bytes * 0.9 if used > self.max_bytes else used
+        for _, size, path in sorted(entries):
+            if used <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            used -= size
+            evicted += 1
+
+        with self._lock:
+            self._used_bytes = used
+            self._counters["evictions"] += evicted
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "local_bytes": self._used_bytes}
+
+
+analysis_cache = AnalysisCache()
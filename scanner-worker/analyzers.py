@@ -0,0 +1,125 @@
+import os
+import json
+import subprocess
+
+# Processes semgrep itself uses per invocation; scans already run one
+# invocation per CPU (see analysis.py), so more would oversubscribe
+SEMGREP_JOBS = int(os.environ.get("SEMGREP_JOBS", "1"))
+# Memory cap per semgrep invocation in MiB (0 for none); files that would
+# need more are reported as errors and skipped
+SEMGREP_MAX_MEMORY_MB = int(os.environ.get("SEMGREP_MAX_MEMORY_MB", "0"))
+# Files passed to one analyzer invocation
+ANALYZER_BATCH_FILES = int(os.environ.get("ANALYZER_BATCH_FILES", "500"))
+
+SEMGREP_EXTENSIONS = (
+    ".py", ".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".go", ".java", ".kt", ".rb",
+    ".php", ".cs", ".c", ".h", ".cc", ".cpp", ".hpp", ".rs", ".scala", ".swift",
+    ".yaml", ".yml", ".json", ".tf", ".sh", ".dockerfile",
+)
+
+
+class AnalyzerError(Exception):
+    """An analyzer run failed"""
+
+
+class AnalyzerTimeout(AnalyzerError):
+    """An analyzer run over these paths took longer than its timeout"""
+
+    def __init__(self, paths: list):
+        super().__init__(paths)
+        self.paths = paths
+
+
+class Analyzer:
+    """
+    Runs over files of a checkout and reports findings per file. Results
+    are cached by blob SHA plus cache_scope(path), and reused for the same
+    content wherever that scope matches, so they must depend on nothing
+    else about the path. `version` identifies the rules it runs and is part
+    of those cache keys.
+    """
+    name = ""
+    version = ""
+
+    def applies_to(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def cache_scope(self, path: str) -> str:
+        """The part of a path results depend on; "" when they depend on content alone"""
+        return ""
+
+    def analyze(self, worktree: str, paths: list, timeout: float = None) -> dict:
+        """
+        {path: [finding, ...]} for every path given, without "file_path" set.
+        Raises AnalyzerTimeout if the run takes longer than timeout seconds.
+        """
+        raise NotImplementedError
+
+
+class SemgrepAnalyzer(Analyzer):
+    """
+    semgrep over a prepared local ruleset. Each batch is a new semgrep
+    process, which parses the rules again: semgrep has no resident mode.
+    What scans share is the prepared ruleset (no registry download or
+    config resolution per run) and the warm pool the runs start from.
+    """
+    name = "semgrep"
+
+    def __init__(self, config: str, version: str = "", path_filtered: bool = False):
+        self.config = config  # a prepared ruleset directory (see rulesets.py)
+        self.version = version
+        self.path_filtered = path_filtered
+
+    def applies_to(self, path: str) -> bool:
+        return path.lower().endswith(SEMGREP_EXTENSIONS) or os.path.basename(path) == "Dockerfile"
+
+    def cache_scope(self, path: str) -> str:
+        # semgrep picks the language from the extension (or the name, for
+        # Dockerfile); rules with paths: include/exclude see the whole path
+        if self.path_filtered:
+            return path
+        return os.path.splitext(path)[1].lower() or os.path.basename(path)
+
+    def analyze(self, worktree: str, paths: list, timeout: float = None) -> dict:
+        results = {path: [] for path in paths}
+        for start in range(0, len(paths), ANALYZER_BATCH_FILES):
+            batch = paths[start:start + ANALYZER_BATCH_FILES]
+            command = [
+                "semgrep", "scan", "--json", "--quiet", "--metrics=off", "--disable-version-check",
+                "--jobs", str(SEMGREP_JOBS), "--config", self.config,
+            ]
+            if SEMGREP_MAX_MEMORY_MB:
+                command += ["--max-memory", str(SEMGREP_MAX_MEMORY_MB)]
+            try:
+                completed = subprocess.run(
+                    [*command, "--", *batch],
+                    cwd=worktree,
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout,
+                )
+            except subprocess.TimeoutExpired:
+                raise AnalyzerTimeout(paths)  # the child is killed by subprocess.run
+            # semgrep exits 1 when it found something
+            if completed.returncode not in (0, 1):
+                raise AnalyzerError(f"semgrep exited {completed.returncode}: {completed.stderr.strip()[-500:]}")
+            for match in json.loads(completed.stdout).get("results", []):
+                path = match["path"]
+                if path.startswith("./"):
+                    path = path[2:]
+                extra = match.get("extra", {})
+                results.setdefault(path, []).append({
+                    "rule_id": match["check_id"],
+                    "severity": extra.get("metadata", {}).get("severity") or extra.get("severity"),
+                    "start_line": match.get("start", {}).get("line"),
+                    "end_line": match.get("end", {}).get("line"),
+                    "message": extra.get("message"),
+                    "snippet": extra.get("lines"),
+                })
+        return results
+
+
+def run_shard(analyzer: Analyzer, worktree: str, paths: list, timeout: float = None) -> dict:
+    """Process-pool entry point: one analyzer over one shard of files"""
+    return analyzer.analyze(worktree, paths, timeout)
+
@@ -0,0 +1,90 @@
+"""
+Clone cache timings against a local file:// remote: cold (new mirror),
+warm (mirror exists, new commit fetched) and hot (commit already mirrored),
+compared with a plain full clone per job.
+
+    python benchmarks/bench_clone_cache.py
+
+Settings:
+    BENCH_FILES      files in the synthetic repository (default 2000)
+    BENCH_FILE_KB    size of each file in KiB (default 8)
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clone_cache import CloneCache
+
+FILES = int(os.environ.get("BENCH_FILES", "2000"))
+FILE_KB = int(os.environ.get("BENCH_FILE_KB", "8"))
+
+
+def git(*args, cwd=None) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def make_remote(path: str) -> list:
+    """A repository with two commits; returns their shas"""
+    git("init", "--quiet", path)
+    git("config", "user.email", "bench@example.com", cwd=path)
+    git("config", "user.name", "bench", cwd=path)
+    # Needed for fetching single commits and partial clone over file://
+    git("config", "uploadpack.allowAnySHA1InWant", "true", cwd=path)
+    git("config", "uploadpack.allowFilter", "true", cwd=path)
+    for i in range(FILES):
+        directory = os.path.join(path, f"pkg{i % 50}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"mod{i}.py"), "w") as f:
+            f.write(f"# module {i}\n" + os.urandom(FILE_KB * 512).hex() + "\n")
+    git("add", "-A", cwd=path)
+    git("commit", "--quiet", "-m", "initial", cwd=path)
+    first = git("rev-parse", "HEAD", cwd=path)
+    with open(os.path.join(path, "pkg0", "mod0.py"), "a") as f:
+        f.write("# changed\n")
+    git("commit", "--quiet", "-am", "change", cwd=path)
+    return [first, git("rev-parse", "HEAD", cwd=path)]
+
+
+def timed(label: str, fn):
+    start = time.perf_counter()
+    fn()
+    print(f"{label:<28}{(time.perf_counter() - start) * 1000:>9.1f}ms")
+
+
+def main():
+    scratch = tempfile.mkdtemp(prefix="bench-clone-")
+    try:
+        remote = os.path.join(scratch, "remote")
+        first, second = make_remote(remote)
+        url = f"file://{remote}"
+        cache = CloneCache(root=os.path.join(scratch, "cache"))
+        print(f"{FILES} files x {FILE_KB} KiB")
+
+        def full_clone():
+            target = os.path.join(scratch, "full")
+            git("clone", "--quiet", url, target)
+            git("checkout", "--quiet", second, cwd=target)
+            shutil.rmtree(target)
+
+        def cached_checkout(sha, job):
+            def run():
+                with cache.checkout("bench", url, sha, job) as worktree:
+                    assert os.path.exists(os.path.join(worktree, "pkg0", "mod0.py"))
+            return run
+
+        timed("full clone per job", full_clone)
+        timed("cache: cold (new mirror)", cached_checkout(first, "job-1"))
+        timed("cache: warm (fetch commit)", cached_checkout(second, "job-2"))
+        timed("cache: hot (commit present)", cached_checkout(second, "job-3"))
+        print(cache.stats())
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
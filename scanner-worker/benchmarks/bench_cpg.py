@@ -0,0 +1,164 @@
+"""
+Code property graph build cost on a synthetic Python repository: a full
+build of a commit vs. the incremental update from its parent, where a
+few files changed.
+
+The graph store and fragment cache are in-memory stand-ins, so this
+measures parsing and diffing (the builder's own work) and the size of the
+write it would send to neo4j, not neo4j itself. Needs the tree-sitter
+Python grammar (pip install tree-sitter tree-sitter-python).
+
+    python benchmarks/bench_cpg.py
+
+Settings:
+    BENCH_FILES      files in the synthetic repository (default 2000)
+    BENCH_CHANGED    files changed by the second commit (default 20)
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The stand-in cache below never touches the database
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import cpg
+from clone_cache import CloneCache
+
+FILES = int(os.environ.get("BENCH_FILES", "2000"))
+CHANGED = int(os.environ.get("BENCH_CHANGED", "20"))
+
+
+class MemoryFragments:
+    """Stands in for the analysis cache"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get_many(self, keys: list) -> dict:
+        return {key: self.entries[key] for key in keys if key in self.entries}
+
+    def put_many(self, entries: dict):
+        self.entries.update(entries)
+
+
+class MemoryGraph:
+    """Stands in for neo4j: keeps the head and counts what would be written"""
+
+    def __init__(self):
+        self.heads = {}
+        self.builds = {}
+        self.rows = 0
+
+    def head(self, repo):
+        return self.heads.get(repo)
+
+    def begin_build(self, repo, previous, token):
+        if self.heads.get(repo) != previous or self.builds.get(repo):
+            return False
+        self.heads[repo], self.builds[repo] = None, token
+        return True
+
+    def owns_build(self, repo, token):
+        return self.builds.get(repo) == token
+
+    def finish_build(self, repo, token, commit):
+        if self.builds.get(repo) != token:
+            return False
+        self.heads[repo], self.builds[repo] = commit, None
+        return True
+
+    def clear(self, repo, token):
+        return self.owns_build(repo, token)
+
+    def apply(self, repo, changes, token):
+        if not self.owns_build(repo, token):
+            return False
+        for _, deleted, written, removed, added in changes:
+            self.rows += len(deleted) + len(written or ()) + len(removed) + len(added)
+        return True
+
+
+def git(*args, cwd=None) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def module_source(i: int, revision: int) -> str:
+    lines = [f"from pkg{(i + 1) % 40} import mod{(i + 1) % FILES}\n\n"]
+    for n in range(8):
+        lines.append(
+            f"class Handler{n}:\n"
+            f"    def handle(self, request):\n"
+            f"        data = parse_{n}(request)\n"
+            f"        return render(validate(data), {revision})\n\n"
+        )
+        lines.append(f"def helper_{n}(value):\n    trace_{revision}(value)\n    return Handler{n}().handle(value)\n\n")
+    return "".join(lines)
+
+
+def make_remote(path: str) -> list:
+    """A repository with two commits, the second changing CHANGED files; returns their shas"""
+    git("init", "--quiet", path)
+    git("config", "user.email", "bench@example.com", cwd=path)
+    git("config", "user.name", "bench", cwd=path)
+    git("config", "uploadpack.allowAnySHA1InWant", "true", cwd=path)
+    git("config", "uploadpack.allowFilter", "true", cwd=path)
+    for i in range(FILES):
+        directory = os.path.join(path, f"pkg{i % 40}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"mod{i}.py"), "w") as f:
+            f.write(module_source(i, 0))
+    git("add", "-A", cwd=path)
+    git("commit", "--quiet", "-m", "initial", cwd=path)
+    first = git("rev-parse", "HEAD", cwd=path)
+    for i in range(0, FILES, max(1, FILES // CHANGED)):
+        with open(os.path.join(path, f"pkg{i % 40}", f"mod{i}.py"), "w") as f:
+            f.write(module_source(i, 1))
+    git("commit", "--quiet", "-am", "change", cwd=path)
+    return [first, git("rev-parse", "HEAD", cwd=path)]
+
+
+def build(builder, clone_cache, url: str, sha: str):
+    graph = builder.graph
+    rows_before = graph.rows
+    with clone_cache.checkout("bench", url, sha, f"job-{sha[:12]}") as worktree:
+        stats = builder.update("bench", sha, worktree, url)
+    print(
+        f"{stats.mode:<12}{stats.seconds * 1000:>9.0f} ms  {stats.files_changed:>5} files  "
+        f"{stats.full_parses:>5} full / {stats.incremental_parses:>3} incremental parses  "
+        f"{graph.rows - rows_before:>7} graph rows written"
+    )
+
+
+def main():
+    if cpg._language("python") is None:
+        return
+    scratch = tempfile.mkdtemp(prefix="bench-cpg-")
+    try:
+        remote = os.path.join(scratch, "remote")
+        first, second = make_remote(remote)
+        url = f"file://{remote}"
+        clone_cache = CloneCache(root=os.path.join(scratch, "cache"))
+        cpg.clone_cache = clone_cache
+        print(f"{FILES} files, {CHANGED} changed")
+
+        # A full build of the second commit from nothing
+        cpg.analysis_cache = MemoryFragments()
+        builder = cpg.CpgBuilder()
+        builder.graph = MemoryGraph()
+        build(builder, clone_cache, url, second)
+
+        # The first commit, then the second on top of it
+        cpg.analysis_cache = MemoryFragments()
+        builder = cpg.CpgBuilder()
+        builder.graph = MemoryGraph()
+        build(builder, clone_cache, url, first)
+        build(builder, clone_cache, url, second)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
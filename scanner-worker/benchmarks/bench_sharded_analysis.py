@@ -0,0 +1,120 @@
+"""
+Sharded analysis speedup on a synthetic repository: the same files analyzed
+with process pools of 1, 2, 4, ... workers up to the container's CPU quota,
+plus one run with a pathological file to show the per-shard timeout.
+
+The analyzer is a stand-in with CPU cost proportional to file size (regex
+passes over the source), so this measures the engine and not semgrep.
+
+    python benchmarks/bench_sharded_analysis.py
+
+Settings:
+    BENCH_FILES          files in the synthetic repository (default 3000)
+    BENCH_PASSES         regex passes per file, i.e. CPU per byte (default 20)
+    BENCH_MAX_WORKERS    largest pool tried (default: the CPU quota)
+"""
+import os
+import re
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyzers import Analyzer, AnalyzerTimeout
+from cpu_pool import CpuPool, cpu_quota
+from shards import analyze_sharded, plan_shards
+
+FILES = int(os.environ.get("BENCH_FILES", "3000"))
+PASSES = int(os.environ.get("BENCH_PASSES", "20"))
+MAX_WORKERS = int(os.environ.get("BENCH_MAX_WORKERS", "0")) or cpu_quota()
+
+_PATTERN = re.compile(r"(eval|exec|password\s*=\s*['\"]\w+)")
+LANGUAGES = {".py": "x = eval(data)\n", ".js": "const password = 'hunter2';\n", ".go": "exec(cmd)\n"}
+
+
+class BenchAnalyzer(Analyzer):
+    name = "bench"
+
+    def applies_to(self, path: str) -> bool:
+        return True
+
+    def analyze(self, worktree: str, paths: list, timeout: float = None) -> dict:
+        deadline = time.monotonic() + timeout if timeout else None
+        results = {}
+        for path in paths:
+            with open(os.path.join(worktree, path)) as f:
+                source = f.read()
+            passes = 10 ** 9 if "PATHOLOGICAL" in source else PASSES
+            matches = []
+            for _ in range(passes):
+                if deadline is not None and time.monotonic() > deadline:
+                    raise AnalyzerTimeout(paths)
+                matches = _PATTERN.findall(source)
+            results[path] = [{"rule_id": "bench", "severity": "low", "message": m} for m in matches[:5]]
+        return results
+
+
+def make_repo(path: str) -> list:
+    """Files of mixed languages with a long-tailed size distribution"""
+    rng = random.Random(42)
+    paths = []
+    for i in range(FILES):
+        extension = list(LANGUAGES)[i % len(LANGUAGES)]
+        relative = f"pkg{i % 40}/mod{i}{extension}"
+        lines = int(rng.lognormvariate(4, 1)) + 1
+        os.makedirs(os.path.join(path, os.path.dirname(relative)), exist_ok=True)
+        with open(os.path.join(path, relative), "w") as f:
+            for line in range(lines):
+                f.write(LANGUAGES[extension] if line % 25 == 0 else f"value_{line} = compute({line}, {i})\n")
+        paths.append(relative)
+    return paths
+
+
+def run(worktree: str, paths: list, workers: int, timeout: float = None) -> tuple:
+    pool = CpuPool(workers)
+    pool.submit(int).result()  # start the pool outside the measurement
+    start = time.perf_counter()
+    analyzed = skipped = 0
+    for shard_paths, results in analyze_sharded(BenchAnalyzer(), worktree, paths, pool=pool, timeout=timeout):
+        if results is None:
+            skipped += len(shard_paths)
+        else:
+            analyzed += len(shard_paths)
+    elapsed = time.perf_counter() - start
+    pool.shutdown(wait=True)
+    return elapsed, analyzed, skipped
+
+
+def main():
+    worktree = tempfile.mkdtemp(prefix="bench-shards-")
+    try:
+        paths = make_repo(worktree)
+        total_kb = sum(os.path.getsize(os.path.join(worktree, p)) for p in paths) // 1024
+        print(f"{len(paths)} files, {total_kb} KiB, CPU quota {cpu_quota()}")
+
+        baseline = None
+        workers = 1
+        while workers <= MAX_WORKERS:
+            shards = plan_shards(worktree, paths, workers)
+            elapsed, analyzed, _ = run(worktree, paths, workers)
+            baseline = baseline or elapsed
+            print(
+                f"{workers:>3} worker(s): {len(shards):>4} shards  {elapsed * 1000:8.0f} ms  "
+                f"speedup {baseline / elapsed:4.2f}x  ({analyzed} files)"
+            )
+            workers *= 2
+
+        # One file that never finishes on its own
+        with open(os.path.join(worktree, paths[0]), "a") as f:
+            f.write("# PATHOLOGICAL\n")
+        elapsed, analyzed, skipped = run(worktree, paths, MAX_WORKERS, timeout=1.0)
+        print(f"with a pathological file, 1s shard timeout: {elapsed * 1000:.0f} ms, {analyzed} analyzed, {skipped} skipped")
+    finally:
+        shutil.rmtree(worktree, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
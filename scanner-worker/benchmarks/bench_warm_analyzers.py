@@ -0,0 +1,106 @@
+"""
+Fixed per-scan overhead of analysis for a one-file PR scan, split into the
+parts the worker removes and the part it doesn't:
+
+- pool: starting a process pool per scan vs. dispatching to the warm one
+- ruleset: preparing the plan's rules (fetch, digest, validate) vs. the
+  prepared ruleset rulesets.py hands every later scan
+- semgrep (needs semgrep): a run with a registry config, which downloads
+  and resolves it, vs. one with the prepared local ruleset
+
+What is left, and printed last, is a semgrep run itself: every shard
+starts a semgrep process that parses the prepared rules again. semgrep
+has no resident mode, so that cost is still paid per shard.
+
+    python benchmarks/bench_warm_analyzers.py
+
+Settings:
+    BENCH_RUNS       scans timed per variant (default 20)
+    BENCH_CONFIG     semgrep config, a registry name or local path (default p/default)
+"""
+import os
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cpu_pool import CpuPool
+
+RUNS = int(os.environ.get("BENCH_RUNS", "20"))
+CONFIG = os.environ.get("BENCH_CONFIG", "p/default")
+
+
+def median_ms(fn, runs: int = RUNS) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def cold_dispatch():
+    pool = CpuPool(1)
+    pool.submit(len, "x").result()
+    pool.shutdown(wait=True)
+
+
+def semgrep(config: str, target: str):
+    subprocess.run(
+        ["semgrep", "scan", "--json", "--quiet", "--metrics=off", "--disable-version-check",
+         "--jobs", "1", "--config", config, "--", target],
+        cwd=os.path.dirname(target),
+        capture_output=True,
+    )
+
+
+def main():
+    warm = CpuPool(1)
+    warm.warm_up()
+    cold_pool = median_ms(cold_dispatch)
+    warm_pool = median_ms(lambda: warm.submit(len, "x").result())
+    warm.shutdown(wait=True)
+    print(f"pool, started per scan:       {cold_pool:8.1f} ms")
+    print(f"pool, warm:                   {warm_pool:8.1f} ms")
+
+    if shutil.which("semgrep") is None:
+        print("semgrep is not installed; skipping the ruleset and semgrep timings")
+        return
+
+    os.environ["SEMGREP_PLAN_CONFIGS"] = json.dumps({"free": [CONFIG]})
+    from rulesets import Rulesets
+
+    workdir = tempfile.mkdtemp(prefix="bench-rulesets-")
+    try:
+        target = os.path.join(workdir, "app.py")
+        with open(target, "w") as f:
+            f.write("import subprocess\nsubprocess.call(user_input, shell=True)\n")
+
+        runs = max(3, RUNS // 4)
+        prepare = median_ms(lambda: Rulesets(tempfile.mkdtemp(dir=workdir)).current("free"), runs)
+        store = Rulesets(os.path.join(workdir, "rulesets"))
+        ruleset = store.current("free")
+        prepared = median_ms(lambda: store.current("free"))
+        print(f"ruleset, prepared per scan:   {prepare:8.1f} ms")
+        print(f"ruleset, already prepared:    {prepared:8.1f} ms")
+
+        registry = median_ms(lambda: semgrep(CONFIG, target), runs)
+        local = median_ms(lambda: semgrep(ruleset.path, target), runs)
+        print(f"semgrep, registry config:     {registry:8.1f} ms")
+        print(f"semgrep, prepared ruleset:    {local:8.1f} ms")
+
+        print(
+            f"fixed cost per one-shard scan: {cold_pool + registry:.0f} ms before, {warm_pool + prepared + local:.0f} ms now, "
+            f"of which {local:.0f} ms is the semgrep run (process start and rule parsing), still paid per shard"
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
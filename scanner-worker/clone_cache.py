@@ -0,0 +1,318 @@
+import os
+import time
+import base64
+import fcntl
+import shutil
+import hashlib
+import threading
+import subprocess
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+# Local-disk cache of bare mirrors, one per repository, shared by every job
+# on this worker. Jobs get a throwaway worktree at their commit.
+CLONE_CACHE_DIR = os.environ.get("CLONE_CACHE_DIR", "/tmp/arcanext/clone-cache")
+# Disk budget for the mirrors; least recently used ones are evicted beyond it
+CLONE_CACHE_MAX_BYTES = int(os.environ.get("CLONE_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+# Partial-clone filter for fetches ("" fetches everything up front)
+CLONE_FILTER = os.environ.get("CLONE_FILTER", "blob:none")
+# History depth fetched per commit (0 for full history)
+CLONE_FETCH_DEPTH = int(os.environ.get("CLONE_FETCH_DEPTH", "1"))
+GIT_TIMEOUT_SECONDS = float(os.environ.get("GIT_TIMEOUT_SECONDS", "600"))
+# Where repositories are fetched from ({repo_name} is "owner/name"); a file://
+# template works for local testing
+GIT_REMOTE_URL_TEMPLATE = os.environ.get("GIT_REMOTE_URL_TEMPLATE", "https://github.com/{repo_name}.git")
+# Token for private repositories, sent as HTTP basic auth per command. One
+# static token for every repository: it must be able to read all of them
+# (e.g. a machine user's PAT). Repositories don't record their GitHub App
+# installation yet, so per-installation tokens can't be minted here.
+GIT_AUTH_TOKEN = os.environ.get("GIT_AUTH_TOKEN", "")
+
+
+def remote_url_for(repo_name: str) -> str:
+    return GIT_REMOTE_URL_TEMPLATE.format(repo_name=repo_name)
+
+
+def auth_header() -> Optional[str]:
+    if not GIT_AUTH_TOKEN:
+        return None
+    credentials = base64.b64encode(f"x-access-token:{GIT_AUTH_TOKEN}".encode()).decode()
+    return f"Authorization: Basic {credentials}"
+
+
+class GitError(Exception):
+    """A git command failed"""
+
+
+class _Timings:
+    """Count, total and worst duration per operation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def record(self, op: str, seconds: float):
+        with self._lock:
+            count, total, worst = self._ops.get(op, (0, 0.0, 0.0))
+            self._ops[op] = (count + 1, total + seconds, max(worst, seconds))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                op: {
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 1),
+                    "max_ms": round(worst * 1000, 1),
+                }
+                for op, (count, total, worst) in self._ops.items()
+            }
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class CloneCache:
+    """
+    Bare mirrors on local disk, fetched incrementally and checked out per job.
+
+    - A mirror is created on first use and afterwards only fetches the
+      commits a job needs (shallow, and blobless where the server supports
+      partial clone, so blobs are downloaded lazily at checkout).
+    - Jobs get a detached worktree that is removed when they finish.
+    - All git operations on a mirror hold an flock on it, so concurrent jobs
+      for the same repository (in any process) don't corrupt it.
+    - Mirrors beyond the disk budget are evicted least recently used first,
+      skipping those with live worktrees.
+
+    auth_header, when given, is passed as http.extraHeader for that command
+    only, so credentials never end up in the mirror's config.
+    """
+
+    def __init__(self, root: str = CLONE_CACHE_DIR, max_bytes: int = CLONE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.timings = _Timings()
+        self._lock = threading.Lock()
+        self._active = {}  # mirror path -> live worktrees
+        self._counters = {"mirror_hits": 0, "fetches": 0, "mirrors_created": 0, "evictions": 0}
+        os.makedirs(os.path.join(root, "mirrors"), exist_ok=True)
+        os.makedirs(os.path.join(root, "worktrees"), exist_ok=True)
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def mirror_path(self, repo_key: str) -> str:
+        digest = hashlib.sha256(repo_key.encode()).hexdigest()[:32]
+        return os.path.join(self.root, "mirrors", f"{digest}.git")
+
+    def _git(self, *args, cwd: str = None, auth_header: Optional[str] = None) -> str:
+        command = ["git"]
+        if auth_header:
+            command += ["-c", f"http.extraHeader={auth_header}"]
+        command += list(args)
+        result = subprocess.run(
+            command,
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            timeout=GIT_TIMEOUT_SECONDS,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+        if result.returncode != 0:
+            raise GitError(f"git {args[0]} failed: {result.stderr.strip()}")
+        return result.stdout
+
+    @contextmanager
+    def _locked(self, mirror: str, blocking: bool = True):
+        with open(mirror + ".lock", "a") as lock_file:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            fcntl.flock(lock_file, flags)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _has_commit(self, mirror: str, sha: str) -> bool:
+        # Checked through the ref we keep per fetched commit: asking for the
+        # object itself would make a partial clone fetch it lazily
+        try:
+            self._git("show-ref", "--verify", "--quiet", f"refs/scans/{sha}", cwd=mirror)
+            return True
+        except GitError:
+            return False
+
+    def _create_mirror(self, mirror: str, remote_url: str):
+        start = time.perf_counter()
+        self._git("init", "--bare", "--quiet", mirror)
+        self._git("remote", "add", "origin", remote_url, cwd=mirror)
+        if CLONE_FILTER:
+            # Lets later checkouts fetch the blobs they need on demand
+            self._git("config", "remote.origin.promisor", "true", cwd=mirror)
+            self._git("config", "remote.origin.partialclonefilter", CLONE_FILTER, cwd=mirror)
+        self.timings.record("create_mirror", time.perf_counter() - start)
+        self._count("mirrors_created")
+
+    def ensure_commits(self, repo_key: str, remote_url: str, shas: Iterable[str], auth_header: Optional[str] = None) -> str:
+        """Make sure the mirror has these commits; returns the mirror path"""
+        mirror = self.mirror_path(repo_key)
+        with self._locked(mirror):
+            if not os.path.isdir(mirror):
+                self._create_mirror(mirror, remote_url)
+            elif self._git("remote", "get-url", "origin", cwd=mirror).strip() != remote_url:
+                self._git("remote", "set-url", "origin", remote_url, cwd=mirror)
+
+            missing = [sha for sha in dict.fromkeys(shas) if not self._has_commit(mirror, sha)]
+            if not missing:
+                self._count("mirror_hits")
+            else:
+                args = ["fetch", "--quiet", "--no-tags", "origin", *missing]
+                if CLONE_FETCH_DEPTH:
+                    args.insert(1, f"--depth={CLONE_FETCH_DEPTH}")
+                if CLONE_FILTER:
+                    args.insert(1, f"--filter={CLONE_FILTER}")
+                start = time.perf_counter()
+                self._git(*args, cwd=mirror, auth_header=auth_header)
+                self.timings.record("fetch", time.perf_counter() - start)
+                for sha in missing:
+                    self._git("update-ref", f"refs/scans/{sha}", sha, cwd=mirror)
+                self._count("fetches")
+            os.utime(mirror)  # recency for LRU eviction
+        return mirror
+
+    @contextmanager
+    def checkout(
+        self,
+        repo_key: str,
+        remote_url: str,
+        commit_sha: str,
+        job_id: str,
+        auth_header: Optional[str] = None,
+        extra_commits: Iterable[str] = (),
+    ):
+        """
+        Yield the path of a worktree at commit_sha for one job, removed on
+        exit. extra_commits are fetched too (e.g. a PR's base commit) so the
+        job can diff against them without another fetch.
+        """
+        mirror = self.mirror_path(repo_key)
+        worktree = os.path.join(self.root, "worktrees", job_id)
+
+        # Counted before fetching, so another job's evict() can't remove the
+        # mirror between the fetch and the worktree
+        with self._lock:
+            self._active[mirror] = self._active.get(mirror, 0) + 1
+        try:
+            self.ensure_commits(repo_key, remote_url, [commit_sha, *extra_commits], auth_header)
+            with self._locked(mirror):
+                if os.path.exists(worktree):
+                    # Left over from a run of this job that died mid-scan
+                    shutil.rmtree(worktree, ignore_errors=True)
+                    self._git("worktree", "prune", cwd=mirror)
+                start = time.perf_counter()
+                self._git("worktree", "add", "--detach", "--quiet", worktree, commit_sha, cwd=mirror, auth_header=auth_header)
+                self.timings.record("checkout", time.perf_counter() - start)
+            try:
+                yield worktree
+            finally:
+                with self._locked(mirror):
+                    try:
+                        self._git("worktree", "remove", "--force", worktree, cwd=mirror)
+                    except GitError:
+                        shutil.rmtree(worktree, ignore_errors=True)
+                        self._git("worktree", "prune", cwd=mirror)
+        finally:
+            with self._lock:
+                self._active[mirror] -= 1
+                if not self._active[mirror]:
+                    del self._active[mirror]
+            self.evict()
+
+    def list_files(self, repo_key: str, commit_sha: str) -> list:
+        """(path, blob sha) of every file at a commit, read from the mirror without a checkout"""
+        output = self._git("ls-tree", "-r", "-z", commit_sha, cwd=self.mirror_path(repo_key))
+        files = []
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            meta, path = entry.split("\t", 1)
+            _, kind, sha = meta.split()
+            if kind == "blob":
+                files.append((path, sha))
+        return files
+
+    def changed_files(self, repo_key: str, base_sha: str, head_sha: str):
+        """
+        (changed, removed) paths between two mirrored commits. Compares trees
+        only, with rename detection off, so no blobs need downloading.
+        """
+        output = self._git(
+            "diff-tree", "-r", "--no-renames", "--name-status", "-z", base_sha, head_sha,
+            cwd=self.mirror_path(repo_key),
+        )
+        parts = [part for part in output.split("\0") if part]
+        changed, removed = set(), set()
+        for status, path in zip(parts[0::2], parts[1::2]):
+            (removed if status == "D" else changed).add(path)
+        return changed, removed
+
+    def changed_blobs(self, repo_key: str, base_sha: str, head_sha: str) -> list:
+        """
+        (path, old blob sha, new blob sha) for every file that differs
+        between two mirrored commits; None stands for "absent". Trees only,
+        like changed_files.
+        """
+        output = self._git(
+            "diff-tree", "-r", "--no-renames", "--raw", "-z", base_sha, head_sha,
+            cwd=self.mirror_path(repo_key),
+        )
+        parts = [part for part in output.split("\0") if part]
+        changes = []
+        for meta, path in zip(parts[0::2], parts[1::2]):
+            _, _, old_sha, new_sha, _ = meta.lstrip(":").split()
+            changes.append((path, None if set(old_sha) == {"0"} else old_sha, None if set(new_sha) == {"0"} else new_sha))
+        return changes
+
+    def evict(self) -> int:
+        """Drop least recently used mirrors until the cache fits its disk budget"""
+        mirrors_dir = os.path.join(self.root, "mirrors")
+        mirrors = []
+        for name in os.listdir(mirrors_dir):
+            path = os.path.join(mirrors_dir, name)
+            if name.endswith(".git") and os.path.isdir(path):
+                mirrors.append((os.stat(path).st_mtime, path, _dir_size(path)))
+
+        used = sum(size for _, _, size in mirrors)
+        evicted = 0
+        for _, path, size in sorted(mirrors):
+            if used <= self.max_bytes:
+                break
+            with self._lock:
+                if path in self._active:
+                    continue
+            try:
+                with self._locked(path, blocking=False):
+                    shutil.rmtree(path)
+            except BlockingIOError:
+                continue  # another process is using it
+            used -= size
+            evicted += 1
+            self._count("evictions")
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            counters["live_worktrees"] = sum(self._active.values())
+        return {**counters, "timings": self.timings.snapshot()}
+
+
+clone_cache = CloneCache()
@@ -0,0 +1,506 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from analysis_cache import analysis_cache
+from clone_cache import GitError, clone_cache
+
+# Build the code property graph after scans of the default branch
+CPG_ENABLED = os.environ.get("CPG_ENABLED", "false").lower() == "true"
+NEO4J_URI = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
+NEO4J_USER = os.environ.get("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.environ.get("NEO4J_PASSWORD", "")
+# Bump when extraction changes, so cached fragments are rebuilt
+CPG_SCHEMA_VERSION = "1"
+# Parse trees kept in memory for incremental re-parsing, by blob SHA
+CPG_TREE_CACHE_SIZE = int(os.environ.get("CPG_TREE_CACHE_SIZE", "2048"))
+# Files whose graph changes are written per neo4j transaction
+CPG_WRITE_BATCH_FILES = int(os.environ.get("CPG_WRITE_BATCH_FILES", "500"))
+# Files larger than this are left out of the graph
+CPG_MAX_FILE_BYTES = int(os.environ.get("CPG_MAX_FILE_BYTES", str(1024 * 1024)))
+# A build that hasn't written for this long is presumed dead and may be taken over
+CPG_BUILD_STALE_SECONDS = int(os.environ.get("CPG_BUILD_STALE_SECONDS", "900"))
+
+# First statement of every write transaction of a build: checks the build is
+# still ours and records that it is alive. Setting a property write-locks the
+# graph node, so a takeover waits for a batch in flight instead of racing it.
+_TOUCH_BUILD = (
+    "MATCH (g:RepositoryGraph {repo: $repo}) WHERE g.build = $token "
+    "SET g.build_at = timestamp() RETURN count(g) AS owned"
+)
+
+EDGE_TYPES = ("CONTAINS", "DEFINES", "CALLS", "IMPORTS")
+
+# Node types per grammar: definitions, calls (and the field naming the
+# callee) and imports
+_PYTHON = {
+    "function": ("function_definition",),
+    "class": ("class_definition",),
+    "call": ("call", "function"),
+    "import": ("import_statement", "import_from_statement"),
+}
+_JAVASCRIPT = {
+    "function": ("function_declaration", "generator_function_declaration", "method_definition"),
+    "class": ("class_declaration",),
+    "call": ("call_expression", "function"),
+    "import": ("import_statement",),
+}
+GRAMMARS = {
+    ".py": ("python", _PYTHON),
+    ".js": ("javascript", _JAVASCRIPT),
+    ".jsx": ("javascript", _JAVASCRIPT),
+    ".mjs": ("javascript", _JAVASCRIPT),
+    ".cjs": ("javascript", _JAVASCRIPT),
+    ".ts": ("typescript", _JAVASCRIPT),
+    ".tsx": ("tsx", _JAVASCRIPT),
+}
+
+_languages = {}
+_languages_lock = threading.Lock()
+
+
+def _language(name: str):
+    """The tree-sitter Language for a grammar, or None if its package isn't installed"""
+    with _languages_lock:
+        if name not in _languages:
+            try:
+                from tree_sitter import Language
+                if name == "python":
+                    import tree_sitter_python as grammar
+                    _languages[name] = Language(grammar.language())
+                elif name == "javascript":
+                    import tree_sitter_javascript as grammar
+                    _languages[name] = Language(grammar.language())
+                else:
+                    import tree_sitter_typescript as grammar
+                    pointer = grammar.language_tsx() if name == "tsx" else grammar.language_typescript()
+                    _languages[name] = Language(pointer)
+            except ImportError:
+                print(f"tree-sitter grammar for {name} is not installed; leaving it out of the graph")
+                _languages[name] = None
+        return _languages[name]
+
+
+def grammar_for(path: str):
+    return GRAMMARS.get(os.path.splitext(path)[1].lower())
+
+
+def _text(node) -> str:
+    return node.text.decode("utf-8", errors="replace") if node is not None else ""
+
+
+def extract_fragment(tree, spec: dict) -> dict:
+    """
+    A file's part of the graph, independent of its path so it can be cached
+    by blob SHA: {"nodes": {local id: [kind, name, line]}, "edges": [[src,
+    type, dst, dst is a symbol name]]}. Definitions are identified by their
+    qualified name, so edits elsewhere in the file leave their ids alone.
+    """
+    nodes = {"file": ["file", "", 0]}
+    edges = set()
+    call_type, callee_field = spec["call"]
+    stack = [(tree.root_node, "file", "")]
+    while stack:
+        node, scope, qualifier = stack.pop()
+        child_scope, child_qualifier = scope, qualifier
+        kind = "function" if node.type in spec["function"] else "class" if node.type in spec["class"] else None
+
+        if kind is not None and node.child_by_field_name("name") is not None:
+            name = _text(node.child_by_field_name("name"))
+            qualified = f"{qualifier}.{name}" if qualifier else name
+            local_id = f"{kind}:{qualified}"
+            ordinal = 1
+            while local_id in nodes:  # redefinitions, e.g. under if/else
+                ordinal += 1
+                local_id = f"{kind}:{qualified}#{ordinal}"
+            nodes[local_id] = [kind, qualified, node.start_point[0] + 1]
+            edges.add((scope, "CONTAINS", local_id, False))
+            edges.add((local_id, "DEFINES", name, True))
+            child_scope, child_qualifier = local_id, qualified
+        elif node.type == call_type:
+            callee = _text(node.child_by_field_name(callee_field))
+            name = callee.replace("?.", ".").rsplit(".", 1)[-1].strip()
+            if name.isidentifier():
+                edges.add((scope, "CALLS", name, True))
+        elif node.type in spec["import"]:
+            module = node.child_by_field_name("module_name") or node.child_by_field_name("source")
+            if module is not None:
+                edges.add(("file", "IMPORTS", "module:" + _text(module).strip("'\""), True))
+            else:
+                for child in node.named_children:
+                    if child.type in ("dotted_name", "aliased_import"):
+                        target = child.child_by_field_name("name") if child.type == "aliased_import" else child
+                        edges.add(("file", "IMPORTS", "module:" + _text(target), True))
+
+        for child in reversed(node.named_children):
+            stack.append((child, child_scope, child_qualifier))
+    return {"nodes": nodes, "edges": sorted([list(edge) for edge in edges])}
+
+
+def _point(source: bytes, offset: int) -> tuple:
+    row = source.count(b"\n", 0, offset)
+    return row, offset - (source.rfind(b"\n", 0, offset) + 1)
+
+
+def _edit(tree, old: bytes, new: bytes):
+    """Tell tree-sitter which byte range changed: everything between the common prefix and suffix"""
+    prefix = len(os.path.commonprefix([old, new]))
+    longest_suffix = min(len(old), len(new)) - prefix
+    suffix = min(len(os.path.commonprefix([old[::-1], new[::-1]])), longest_suffix)
+    old_end, new_end = len(old) - suffix, len(new) - suffix
+    tree.edit(
+        start_byte=prefix,
+        old_end_byte=old_end,
+        new_end_byte=new_end,
+        start_point=_point(old, prefix),
+        old_end_point=_point(old, old_end),
+        new_end_point=_point(new, new_end),
+    )
+
+
+class TreeCache:
+    """
+    Live parse trees with their source, by blob SHA, least recently used
+    evicted. A changed file whose previous version is here is re-parsed
+    incrementally: the old tree is edited and handed to the parser, which
+    reuses every subtree outside the edit.
+    """
+
+    def __init__(self, size: int = CPG_TREE_CACHE_SIZE):
+        self.size = size
+        self._trees = OrderedDict()  # blob sha -> (grammar, tree, source)
+        self._lock = threading.Lock()
+
+    def take(self, blob_sha: str, grammar: str):
+        """Remove and return (tree, source) for a blob; editing a tree invalidates it for that blob"""
+        with self._lock:
+            entry = self._trees.get(blob_sha)
+            if entry is None or entry[0] != grammar:
+                return None
+            del self._trees[blob_sha]
+            return entry[1], entry[2]
+
+    def put(self, blob_sha: str, grammar: str, tree, source: bytes):
+        with self._lock:
+            self._trees[blob_sha] = (grammar, tree, source)
+            self._trees.move_to_end(blob_sha)
+            while len(self._trees) > self.size:
+                self._trees.popitem(last=False)
+
+
+@dataclass
+class CpgBuildStats:
+    mode: str = "incremental"
+    files_changed: int = 0
+    fragments_cached: int = 0
+    full_parses: int = 0
+    incremental_parses: int = 0
+    nodes_written: int = 0
+    nodes_deleted: int = 0
+    edges_added: int = 0
+    edges_removed: int = 0
+    seconds: float = 0.0
+
+
+def diff_fragments(old: Optional[dict], new: Optional[dict]):
+    """(deleted node ids, {node id: props} to write, removed edges, added edges)"""
+    old_nodes = old["nodes"] if old else {}
+    new_nodes = new["nodes"] if new else {}
+    old_edges = {tuple(edge) for edge in old["edges"]} if old else set()
+    new_edges = {tuple(edge) for edge in new["edges"]} if new else set()
+    deleted = [node_id for node_id in old_nodes if node_id not in new_nodes]
+    written = {node_id: props for node_id, props in new_nodes.items() if old_nodes.get(node_id) != props}
+    return deleted, written, old_edges - new_edges, new_edges - old_edges
+
+
+class GraphStore:
+    """
+    The repository's graph in neo4j, as of one commit. Code nodes are keyed
+    by (repo, path, local id); calls, definitions and imports point at
+    shared Symbol nodes by name, so a file's subgraph can be replaced
+    without touching any other file's.
+    """
+
+    def __init__(self):
+        self._driver = None
+        self._lock = threading.Lock()
+
+    def _session(self):
+        with self._lock:
+            if self._driver is None:
+                from neo4j import GraphDatabase
+                self._driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+        return self._driver.session()
+
+    def head(self, repo: str) -> Optional[str]:
+        """The commit the graph is complete for; None if there is no graph or a build is in progress"""
+        with self._session() as session:
+            record = session.run("MATCH (g:RepositoryGraph {repo: $repo}) RETURN g.commit AS commit", repo=repo).single()
+            return record["commit"] if record else None
+
+    def begin_build(self, repo: str, previous: Optional[str], token: str) -> bool:
+        """
+        Move the graph's commit from previous to NULL (build in progress)
+        before anything is written, so a build that dies midway leaves a
+        graph the next build knows to start over. False if someone else
+        moved it meanwhile, or another build is in progress and has written
+        within CPG_BUILD_STALE_SECONDS.
+        """
+        with self._session() as session:
+            return session.run(
+                "MERGE (g:RepositoryGraph {repo: $repo}) "
+                "WITH g, coalesce(g.commit, '') = coalesce($previous, '') "
+                "AND (g.build IS NULL OR coalesce(g.build_at, 0) < timestamp() - $stale_ms) AS claimed "
+                "SET g.commit = CASE WHEN claimed THEN null ELSE g.commit END, "
+                "g.build = CASE WHEN claimed THEN $token ELSE g.build END, "
+                "g.build_at = CASE WHEN claimed THEN timestamp() ELSE g.build_at END "
+                "RETURN claimed",
+                repo=repo, previous=previous, token=token, stale_ms=CPG_BUILD_STALE_SECONDS * 1000,
+            ).single()["claimed"]
+
+    def owns_build(self, repo: str, token: str) -> bool:
+        """Whether the build in progress is still ours (another one may have claimed the graph since)"""
+        with self._session() as session:
+            record = session.run("MATCH (g:RepositoryGraph {repo: $repo}) RETURN g.build AS build", repo=repo).single()
+            return record is not None and record["build"] == token
+
+    def finish_build(self, repo: str, token: str, commit: str) -> bool:
+        """Mark the graph complete at commit, once every batch is written; False if the build isn't ours any more"""
+        with self._session() as session:
+            return session.run(
+                "MATCH (g:RepositoryGraph {repo: $repo}) WHERE g.build = $token "
+                "SET g.commit = $commit, g.build = null, g.build_at = null RETURN count(g) AS finished",
+                repo=repo, token=token, commit=commit,
+            ).single()["finished"] == 1
+
+    def clear(self, repo: str, token: str) -> bool:
+        """Delete the graph's nodes for a full rebuild; False if the build isn't ours any more"""
+        def delete_some(tx):
+            if not tx.run(_TOUCH_BUILD, repo=repo, token=token).single()["owned"]:
+                return None
+            return tx.run(
+                "MATCH (n:CodeNode {repo: $repo}) WITH n LIMIT 10000 DETACH DELETE n RETURN count(n) AS deleted",
+                repo=repo,
+            ).single()["deleted"]
+
+        with self._session() as session:
+            while True:
+                deleted = session.execute_write(delete_some)
+                if deleted is None:
+                    return False
+                if not deleted:
+                    return True
+
+    def apply(self, repo: str, changes: list, token: str) -> bool:
+        """
+        Write one batch of per-file diffs: [(path, deleted, written, removed
+        edges, added edges)]. Nothing is written, and False returned, if the
+        build isn't ours any more.
+        """
+        deleted_files = [path for path, deleted, written, _, _ in changes if written is None]
+        deleted_nodes = [{"path": path, "id": node_id} for path, deleted, written, _, _ in changes if written is not None for node_id in deleted]
+        written_nodes = [
+            {"path": path, "id": node_id, "kind": props[0], "name": props[1], "line": props[2]}
+            for path, _, written, _, _ in changes if written for node_id, props in written.items()
+        ]
+        removed, added = {}, {}
+        for path, _, _, removed_edges, added_edges in changes:
+            for target, edges in ((removed, removed_edges), (added, added_edges)):
+                for src, edge_type, dst, to_symbol in edges:
+                    target.setdefault((edge_type, to_symbol), []).append({"path": path, "src": src, "dst": dst})
+
+        def write(tx):
+            if not tx.run(_TOUCH_BUILD, repo=repo, token=token).single()["owned"]:
+                return False
+            if deleted_files:
+                tx.run(
+                    "UNWIND $paths AS path MATCH (n:CodeNode {repo: $repo, path: path}) DETACH DELETE n",
+                    repo=repo, paths=deleted_files,
+                )
+            if deleted_nodes:
+                tx.run(
+                    "UNWIND $rows AS row MATCH (n:CodeNode {repo: $repo, path: row.path, local_id: row.id}) DETACH DELETE n",
+                    repo=repo, rows=deleted_nodes,
+                )
+            if written_nodes:
+                tx.run(
+                    "UNWIND $rows AS row MERGE (n:CodeNode {repo: $repo, path: row.path, local_id: row.id}) "
+                    "SET n.kind = row.kind, n.name = row.name, n.line = row.line",
+                    repo=repo, rows=written_nodes,
+                )
+            for (edge_type, to_symbol), rows in removed.items():
+                assert edge_type in EDGE_TYPES
+                target = "(b:Symbol {repo: $repo, name: row.dst})" if to_symbol else "(b:CodeNode {repo: $repo, path: row.path, local_id: row.dst})"
+                tx.run(
+                    f"UNWIND $rows AS row MATCH (a:CodeNode {{repo: $repo, path: row.path, local_id: row.src}})"
+                    f"-[r:{edge_type}]->{target} DELETE r",
+                    repo=repo, rows=rows,
+                )
+            for (edge_type, to_symbol), rows in added.items():
+                assert edge_type in EDGE_TYPES
+                target = "MERGE (b:Symbol {repo: $repo, name: row.dst})" if to_symbol else "MATCH (b:CodeNode {repo: $repo, path: row.path, local_id: row.dst})"
+                tx.run(
+                    f"UNWIND $rows AS row MATCH (a:CodeNode {{repo: $repo, path: row.path, local_id: row.src}}) "
+                    f"{target} MERGE (a)-[:{edge_type}]->(b)",
+                    repo=repo, rows=rows,
+                )
+            # Symbols nothing points at any more
+            names = sorted({row["dst"] for (_, to_symbol), rows in removed.items() if to_symbol for row in rows})
+            if names:
+                tx.run(
+                    "UNWIND $names AS name MATCH (s:Symbol {repo: $repo, name: name}) WHERE NOT (s)--() DELETE s",
+                    repo=repo, names=names,
+                )
+            return True
+
+        with self._session() as session:
+            return session.execute_write(write)
+
+
+class CpgBuilder:
+    """
+    Keeps each repository's code property graph in step with its scanned
+    commits, doing work in proportion to the diff:
+
+    - only files whose blob changed since the graph's commit are looked at;
+    - a blob's graph fragment is cached by SHA (in the analysis cache), so
+      content seen before on any branch isn't parsed again;
+    - a changed file whose previous tree is still in memory is re-parsed
+      incrementally;
+    - the old and new fragments are diffed and only the difference is
+      written to neo4j.
+
+    Without a usable previous graph (first build, a build that died
+    midway, or its commit can't be fetched) the graph is rebuilt from every
+    file, still reusing cached fragments.
+    """
+
+    def __init__(self):
+        self.trees = TreeCache()
+        self.graph = GraphStore()
+        self._repo_locks = {}
+        self._lock = threading.Lock()
+
+    def _repo_lock(self, repo: str) -> threading.Lock:
+        with self._lock:
+            return self._repo_locks.setdefault(repo, threading.Lock())
+
+    def _parse(self, path: str, blob_sha: str, old_blob_sha: Optional[str], worktree: str, stats: CpgBuildStats):
+        grammar, spec = grammar_for(path)
+        language = _language(grammar)
+        if language is None:
+            return None
+        full_path = os.path.join(worktree, path)
+        try:
+            if os.path.getsize(full_path) > CPG_MAX_FILE_BYTES:
+                return None
+            with open(full_path, "rb") as f:
+                source = f.read()
+        except OSError:
+            return None  # e.g. a symlink pointing outside the checkout
+
+        from tree_sitter import Parser
+        parser = Parser(language)
+        previous = self.trees.take(old_blob_sha, grammar) if old_blob_sha else None
+        if previous is not None:
+            old_tree, old_source = previous
+            _edit(old_tree, old_source, source)
+            tree = parser.parse(source, old_tree)
+            stats.incremental_parses += 1
+        else:
+            tree = parser.parse(source)
+            stats.full_parses += 1
+        self.trees.put(blob_sha, grammar, tree, source)
+        return extract_fragment(tree, spec)
+
+    def _fragments(self, files: list, worktree: Optional[str], stats: CpgBuildStats) -> dict:
+        """{blob sha: fragment} for [(path, blob sha, previous blob sha)], parsing only the ones not cached"""
+        keys = {blob: (blob, "cpg", CPG_SCHEMA_VERSION) for _, blob, _ in files if blob}
+        cached = analysis_cache.get_many(list(set(keys.values())))
+        fragments = {blob: cached[key] for blob, key in keys.items() if key in cached}
+        stats.fragments_cached += len(fragments)
+        if worktree is None:
+            return fragments
+
+        parsed = {}
+        for path, blob, old_blob in files:
+            if blob and blob not in fragments and blob not in parsed:
+                fragment = self._parse(path, blob, old_blob, worktree, stats)
+                if fragment is not None:
+                    parsed[blob] = fragment
+        analysis_cache.put_many({keys[blob]: fragment for blob, fragment in parsed.items()})
+        return {**fragments, **parsed}
+
+    def update(self, repo_key: str, commit_sha: str, worktree: str, remote_url: str, auth_header: Optional[str] = None) -> CpgBuildStats:
+        """Bring the repository's graph from its current commit to commit_sha"""
+        start = time.perf_counter()
+        stats = CpgBuildStats()
+        with self._repo_lock(repo_key):
+            previous = self.graph.head(repo_key)
+            if previous == commit_sha:
+                stats.mode = "unchanged"
+                return stats
+            token = uuid.uuid4().hex
+            if not self.graph.begin_build(repo_key, previous, token):
+                print(f"CPG for {repo_key} is being updated by another worker; skipping.")
+                stats.mode = "skipped"
+                return stats
+            changes = None
+            if previous:
+                try:
+                    clone_cache.ensure_commits(repo_key, remote_url, [previous], auth_header)
+                    changes = clone_cache.changed_blobs(repo_key, previous, commit_sha)
+                except GitError as e:
+                    print(f"CPG for {repo_key}: can't diff against {previous[:12]} ({e}); rebuilding.")
+            claimed_by_another = False
+            if changes is None:
+                stats.mode = "full"
+                claimed_by_another = not self.graph.clear(repo_key, token)
+                changes = [(path, None, blob) for path, blob in clone_cache.list_files(repo_key, commit_sha)]
+
+            changes = [change for change in changes if grammar_for(change[0])]
+            stats.files_changed = len(changes)
+            for batch_start in range(0, len(changes), CPG_WRITE_BATCH_FILES):
+                # A build that finds ours stale (died, or stalled past
+                # CPG_BUILD_STALE_SECONDS) takes it over; stop parsing early
+                if claimed_by_another or not self.graph.owns_build(repo_key, token):
+                    claimed_by_another = True
+                    break
+                batch = changes[batch_start:batch_start + CPG_WRITE_BATCH_FILES]
+                old = self._fragments([(path, old_blob, None) for path, old_blob, _ in batch], None, stats)
+                new = self._fragments([(path, new_blob, old_blob) for path, old_blob, new_blob in batch], worktree, stats)
+                diffs = []
+                for path, old_blob, new_blob in batch:
+                    old_fragment, new_fragment = old.get(old_blob), new.get(new_blob)
+                    if new_fragment is None:
+                        # Deleted, unparseable or too big: drop the file's subgraph
+                        deleted, _, removed, _ = diff_fragments(old_fragment, None)
+                        diffs.append((path, deleted, None, removed, set()))
+                        stats.nodes_deleted += len(deleted)
+                        continue
+                    if old_blob and old_fragment is None:
+                        # The old fragment is gone from the cache: replace the file's subgraph outright
+                        diffs.append((path, [], None, set(), set()))
+                    deleted, written, removed, added = diff_fragments(old_fragment, new_fragment)
+                    diffs.append((path, deleted, written, removed, added))
+                    stats.nodes_deleted += len(deleted)
+                    stats.nodes_written += len(written)
+                    stats.edges_removed += len(removed)
+                    stats.edges_added += len(added)
+                # Checked again inside the write, which is what makes it safe
+                if not self.graph.apply(repo_key, diffs, token):
+                    claimed_by_another = True
+                    break
+
+            # The head only moves to commit_sha once every batch is written
+            if claimed_by_another or not self.graph.finish_build(repo_key, token, commit_sha):
+                print(f"CPG for {repo_key} was claimed by another build; leaving it to that one.")
+                stats.mode = "abandoned"
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+
+cpg_builder = CpgBuilder()
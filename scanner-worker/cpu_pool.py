@@ -0,0 +1,150 @@
+import os
+import math
+import resource
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+
+def cpu_quota() -> int:
+    """
+    CPUs this container may actually use: the cgroup CPU quota (v2, then v1)
+    when one is set, else the CPUs we're allowed to run on. os.cpu_count()
+    alone reports the host's cores, which oversubscribes a limited container.
+    """
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()[:2]
+        if limit != "max":
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+# Processes available to CPU-bound scan stages, shared by all in-flight jobs
+WORKER_CPU_POOL_SIZE = int(os.environ.get("WORKER_CPU_POOL_SIZE", "0")) or cpu_quota()
+# Tasks a pool process runs before it is replaced (0 for never), so leaks
+# in long-lived pool processes can't build up
+WORKER_MAX_TASKS_PER_PROCESS = int(os.environ.get("WORKER_MAX_TASKS_PER_PROCESS", "200"))
+# Resident memory of any pool process, or of any analyzer it ran as a child
+# process (semgrep), past which the pool is replaced once its running tasks
+# finish (0 for no limit)
+WORKER_MAX_PROCESS_RSS_MB = int(os.environ.get("WORKER_MAX_PROCESS_RSS_MB", "1024"))
+
+_peak_rss = None  # in pool processes: shared with the parent, see _start()
+
+
+def _init_process(peak_rss):
+    global _peak_rss
+    _peak_rss = peak_rss
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _children_peak_rss_bytes() -> int:
+    # Peak of the largest child this process has waited for; ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+def _run_measured(fn, *args):
+    try:
+        return fn(*args)
+    finally:
+        # The process itself, and the analyzers it ran (they do the real work)
+        rss = max(_rss_bytes(), _children_peak_rss_bytes())
+        with _peak_rss.get_lock():
+            if rss > _peak_rss.value:
+                _peak_rss.value = rss
+
+
+def _noop():
+    return None
+
+
+class CpuPool:
+    """
+    Long-lived processes for CPU-bound scan work, sized to the container's
+    CPU quota and kept warm between scans. A process is replaced after
+    max_tasks_per_process tasks; if any process grows past max_rss_mb the
+    whole pool is replaced, with tasks already submitted finishing on the
+    old processes.
+    """
+
+    def __init__(
+        self,
+        workers: int = WORKER_CPU_POOL_SIZE,
+        max_tasks_per_process: int = WORKER_MAX_TASKS_PER_PROCESS,
+        max_rss_mb: int = WORKER_MAX_PROCESS_RSS_MB,
+    ):
+        self.workers = workers
+        self.max_tasks_per_process = max_tasks_per_process
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self._pool = None
+        self._peak_rss = None
+        self._lock = threading.Lock()
+        self._counters = {"tasks": 0, "pools_started": 0, "recycled_for_memory": 0}
+
+    def _start(self):
+        # spawn rather than fork: this process runs threads and holds DB connections
+        context = multiprocessing.get_context("spawn")
+        self._peak_rss = context.Value("q", 0)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_process,
+            initargs=(self._peak_rss,),
+            max_tasks_per_child=self.max_tasks_per_process or None,
+        )
+        self._counters["pools_started"] += 1
+
+    def submit(self, fn, *args) -> Future:
+        """Run a picklable function in the pool"""
+        with self._lock:
+            if self._pool is not None and self.max_rss_bytes and self._peak_rss.value > self.max_rss_bytes:
+                print(f"CPU pool process reached {self._peak_rss.value // 2 ** 20} MiB; replacing the pool.")
+                self._pool.shutdown(wait=False)
+                self._pool = None
+                self._counters["recycled_for_memory"] += 1
+            if self._pool is None:
+                self._start()
+            self._counters["tasks"] += 1
+            pool = self._pool
+        return pool.submit(_run_measured, fn, *args)
+
+    def warm_up(self):
+        """Start every process now, so the first scan doesn't pay for it"""
+        for future in [self.submit(_noop) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self, wait: bool = False):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            peak_rss = self._peak_rss.value if self._peak_rss is not None else 0
+            return {"workers": self.workers, **self._counters, "peak_rss_mb": peak_rss // 2 ** 20}
+
+
+cpu_pool = CpuPool()
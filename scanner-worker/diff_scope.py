@@ -0,0 +1,169 @@
+import os
+import re
+import posixpath
+from dataclasses import dataclass, field
+from typing import Optional
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+from clone_cache import GitError, auth_header, clone_cache, remote_url_for
+from models import ScanJob
+
+# Scan PRs and pushes incrementally when a base result exists
+DIFF_SCOPE_ENABLED = os.environ.get("DIFF_SCOPE_ENABLED", "true").lower() == "true"
+# Past this many files in scope a diff scan saves little; scan everything instead
+DIFF_SCOPE_MAX_FILES = int(os.environ.get("DIFF_SCOPE_MAX_FILES", "2000"))
+# Files larger than this aren't searched for imports of changed modules
+DIFF_SCOPE_MAX_IMPORTER_BYTES = int(os.environ.get("DIFF_SCOPE_MAX_IMPORTER_BYTES", str(512 * 1024)))
+
+PYTHON_EXTENSIONS = (".py",)
+JS_EXTENSIONS = (".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx")
+
+_PY_IMPORT = re.compile(r"^\s*(?:from\s+([\w.]+)\s+import\s+([\w., ()*]+)|import\s+([\w., ]+))", re.MULTILINE)
+_JS_IMPORT = re.compile(r"""(?:\bfrom\s+|\brequire\(\s*|\bimport\(\s*|^\s*import\s+)['"]([^'"]+)['"]""", re.MULTILINE)
+
+
+@dataclass
+class ScanScope:
+    mode: str  # "full" or "diff"
+    paths: Optional[set] = None  # files to analyze; None means all of them
+    removed: set = field(default_factory=set)  # files deleted since the base
+    base_job_id: Optional[str] = None  # whose finding set stands for the files left out
+    reason: str = ""
+
+    @property
+    def covered_paths(self) -> Optional[set]:
+        """Files this scan decides the findings of itself, rather than taking the base's (None for all)"""
+        if self.paths is None:
+            return None
+        return self.paths | self.removed
+
+
+def _python_module(path: str) -> Optional[str]:
+    if not path.endswith(PYTHON_EXTENSIONS):
+        return None
+    module = path[:-3].replace("/", ".")
+    return module[:-len(".__init__")] if module.endswith(".__init__") else module
+
+
+def _imports_python(source: str, modules: set, short_names: set) -> bool:
+    for match in _PY_IMPORT.finditer(source):
+        if match.group(1):
+            base = match.group(1).lstrip(".")
+            names = [name.strip(" ()") for name in match.group(2).split(",")]
+            candidates = [base] + [f"{base}.{name}" for name in names if name]
+        else:
+            candidates = [name.split(" as ")[0].strip() for name in match.group(3).split(",")]
+        for candidate in candidates:
+            # Absolute imports match the module path; relative/flat ones its last part
+            if candidate in modules or candidate.rsplit(".", 1)[-1] in short_names:
+                return True
+    return False
+
+
+def _js_module(path: str) -> Optional[str]:
+    if not path.endswith(JS_EXTENSIONS):
+        return None
+    stem = posixpath.splitext(path)[0]
+    return stem[:-len("/index")] if stem.endswith("/index") else stem
+
+
+def _imports_js(importer: str, source: str, modules: set) -> bool:
+    directory = posixpath.dirname(importer)
+    for match in _JS_IMPORT.finditer(source):
+        specifier = match.group(1)
+        if not specifier.startswith("."):
+            continue  # packages, not files in this repository
+        target = posixpath.normpath(posixpath.join(directory, specifier))
+        stem = posixpath.splitext(target)[0] if target.endswith(JS_EXTENSIONS) else target
+        if stem in modules or (stem.endswith("/index") and stem[:-len("/index")] in modules):
+            return True
+    return False
+
+
+def affected_paths(worktree: str, changed: set) -> set:
+    """
+    Files outside the diff that directly import a changed module (Python and
+    JavaScript/TypeScript), since a change can make their code vulnerable too.
+    """
+    py_modules = {module for module in map(_python_module, changed) if module}
+    py_short_names = {module.rsplit(".", 1)[-1] for module in py_modules}
+    js_modules = {module for module in map(_js_module, changed) if module}
+    if not py_modules and not js_modules:
+        return set()
+
+    affected = set()
+    for root, dirs, files in os.walk(worktree):
+        dirs[:] = [d for d in dirs if d not in (".git", "node_modules")]
+        for name in files:
+            full_path = os.path.join(root, name)
+            path = os.path.relpath(full_path, worktree).replace(os.sep, "/")
+            is_python = py_modules and name.endswith(PYTHON_EXTENSIONS)
+            is_js = js_modules and name.endswith(JS_EXTENSIONS)
+            if path in changed or not (is_python or is_js):
+                continue
+            try:
+                if os.path.getsize(full_path) > DIFF_SCOPE_MAX_IMPORTER_BYTES:
+                    continue
+                with open(full_path, encoding="utf-8", errors="ignore") as f:
+                    source = f.read()
+            except OSError:
+                continue
+            if (is_python and _imports_python(source, py_modules, py_short_names)) or (
+                is_js and _imports_js(path, source, js_modules)
+            ):
+                affected.add(path)
+    return affected
+
+
+def _base_job_id(db, job: ScanJob, ruleset_version: str):
+    """
+    The latest completed scan of the base commit with this plan and ruleset
+    whose finding set is recorded (the original one, for reused results),
+    or None.
+    """
+    original = aliased(ScanJob)
+    return db.execute(
+        select(func.coalesce(original.id, ScanJob.id))
+        .outerjoin(original, original.id == ScanJob.reused_from_id)
+        .where(
+            ScanJob.repository_id == job.repository_id,
+            ScanJob.commit_sha == job.base_sha,
+            ScanJob.plan_level == job.plan_level,
+            ScanJob.status == "completed",
+            ScanJob.ruleset_version == ruleset_version,
+            func.coalesce(original.findings_count, ScanJob.findings_count).isnot(None),
+        )
+        .order_by(ScanJob.completed_at.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def plan_scope(db, job: ScanJob, worktree: str, ruleset_version: str) -> ScanScope:
+    """
+    Decide what a job has to analyze. Jobs whose base commit (a PR's base,
+    or the commit a push moved the branch from) was already scanned with
+    this ruleset only analyze the changed files plus their
+    direct importers; everything else, or anything we can't diff, gets a
+    full scan. The base scan's finding set stands for the files left out.
+    """
+    if not DIFF_SCOPE_ENABLED or not job.base_sha:
+        return ScanScope("full", reason="no base commit")
+    base_job_id = _base_job_id(db, job, ruleset_version)
+    if base_job_id is None:
+        return ScanScope("full", reason=f"no completed scan of base {job.base_sha[:12]}")
+
+    repo_key = str(job.repository_id)
+    try:
+        clone_cache.ensure_commits(
+            repo_key, remote_url_for(job.repository.repo_name), [job.base_sha], auth_header()
+        )
+        changed, removed = clone_cache.changed_files(repo_key, job.base_sha, job.commit_sha)
+    except GitError as e:
+        # e.g. the base was force-pushed away
+        return ScanScope("full", reason=f"could not diff against base: {e}")
+
+    scope = changed | affected_paths(worktree, changed)
+    if len(scope) > DIFF_SCOPE_MAX_FILES:
+        return ScanScope("full", reason=f"{len(scope)} files in scope")
+    return ScanScope("diff", paths=scope, removed=removed, base_job_id=base_job_id,
+                     reason=f"{len(changed)} changed, {len(scope) - len(changed)} affected")
@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import scanner_logic
+from cpu_pool import cpu_pool
+from leases import expire_leases
+
+# Upper bound on scans running at once in this container. Requests beyond it
+# are refused so the queue retries them later instead of oversubscribing us.
+WORKER_MAX_IN_FLIGHT_JOBS = int(os.environ.get("WORKER_MAX_IN_FLIGHT_JOBS", "2"))
+# How long shutdown waits for in-flight scans before handing them back.
+# Cloud Run sends SIGKILL 10 seconds after SIGTERM.
+WORKER_DRAIN_SECONDS = float(os.environ.get("WORKER_DRAIN_SECONDS", "8"))
+
+
+class ScanExecutor:
+    """
+    Runs scans on a fixed number of job threads, with a separate process pool
+    (cpu_pool) for CPU-bound stages. Admission is explicit: submit() refuses
+    work when every slot is taken or the worker is draining.
+    """
+
+    def __init__(self, max_jobs: int = WORKER_MAX_IN_FLIGHT_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="scan")
+        self._in_flight = {}  # job_id -> plan_level
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Event()
+        self.draining = False
+
+    def free_slots(self) -> int:
+        with self._lock:
+            if self.draining:
+                return 0
+            return self.max_jobs - len(self._in_flight)
+
+    def in_flight(self) -> list:
+        with self._lock:
+            return list(self._in_flight)
+
+    def wait_for_slot(self, timeout: float):
+        self._slot_freed.wait(timeout)
+        self._slot_freed.clear()
+
+    def submit(self, job_id: str, plan_level: str, on_done=None) -> bool:
+        """
+        Start a scan if there is room. Returns False if the worker is full or
+        draining. on_done(job_id, final_status) runs after the scan ends.
+        """
+        with self._lock:
+            if self.draining or len(self._in_flight) >= self.max_jobs or job_id in self._in_flight:
+                return False
+            self._in_flight[job_id] = plan_level
+
+        self._jobs.submit(self._run, job_id, plan_level, on_done)
+        return True
+
+    def _run(self, job_id: str, plan_level: str, on_done):
+        final_status = None
+        try:
+            final_status = scanner_logic.run_scan(job_id, plan_level)
+        finally:
+            if on_done is not None:
+                try:
+                    on_done(job_id, final_status)
+                except Exception as e:
+                    print(f"Post-scan hook failed for job {job_id}: {e}")
+            with self._lock:
+                self._in_flight.pop(job_id, None)
+            self._slot_freed.set()
+
+    def drain(self, timeout: float = WORKER_DRAIN_SECONDS) -> list:
+        """
+        Stop admitting work, ask running scans to stop at their next phase
+        boundary and wait for them. Returns the ids of jobs still running
+        when the timeout expired.
+        """
+        with self._lock:
+            self.draining = True
+        scanner_logic.shutdown_requested.set()
+
+        deadline = time.monotonic() + timeout
+        while self.in_flight() and time.monotonic() < deadline:
+            self.wait_for_slot(min(0.5, max(0.0, deadline - time.monotonic())))
+
+        unfinished = self.in_flight()
+        expire_leases(unfinished)
+
+        self._jobs.shutdown(wait=False, cancel_futures=True)
+        cpu_pool.shutdown()
+        return unfinished
+
+
+scan_executor = ScanExecutor()
@@ -0,0 +1,248 @@
+import os
+import hashlib
+from datetime import datetime
+from typing import Iterable
+from sqlalchemy import func, literal, select, text, update
+from sqlalchemy.dialects.postgresql import UUID, insert
+from database import SessionLocal
+from models import Finding, ScanJob, ScanJobFinding
+from workspace_stats import apply_stats_delta
+
+# Findings written per INSERT statement; also the most held in memory at once
+FINDINGS_BATCH_SIZE = int(os.environ.get("FINDINGS_BATCH_SIZE", "1000"))
+
+SEVERITIES = ("critical", "high", "medium", "low")
+
+# Advisory lock class (with the repository id) held from counting a
+# repository's open findings until the change to them commits; the API's
+# close_pr takes the same lock
+FINDINGS_LOCK_KEY = 0x5CA9_0002
+# Analyzer severities (semgrep uses ERROR / WARNING / INFO) mapped onto ours
+_SEVERITY_ALIASES = {
+    "error": "high",
+    "warning": "medium",
+    "info": "low",
+    "note": "low",
+}
+
+
+def normalize_severity(severity: str) -> str:
+    severity = (severity or "").lower()
+    if severity in SEVERITIES:
+        return severity
+    return _SEVERITY_ALIASES.get(severity, "low")
+
+
+def fingerprint(rule_id: str, file_path: str, snippet: str = None, start_line: int = None) -> str:
+    """
+    Identity of a finding across commits. Built from the rule, the file and
+    the matched code with whitespace collapsed, so unrelated edits that only
+    shift line numbers keep the same fingerprint. Without a snippet the
+    start line is used instead.
+    """
+    anchor = " ".join(snippet.split()) if snippet else f"line:{start_line}"
+    return hashlib.sha256(f"{rule_id}\0{file_path}\0{anchor}".encode()).hexdigest()
+
+
+def job_ref(job: ScanJob) -> str:
+    """The ref whose findings a job updates (jobs from before refs were recorded are PR scans)"""
+    return job.ref or f"pr/{job.pr_number}"
+
+
+def _open_counts(db, repository_id) -> dict:
+    # An issue open on several refs (say a branch and the PRs made from it) counts once
+    rows = db.execute(
+        select(Finding.severity, func.count(Finding.fingerprint.distinct()))
+        .where(Finding.repository_id == repository_id, Finding.status == "open")
+        .group_by(Finding.severity)
+    ).all()
+    return dict(rows)
+
+
+def lock_repository_findings(db, repository_id):
+    """Serialize open-findings accounting for a repository until the transaction ends"""
+    db.execute(
+        text("SELECT pg_advisory_xact_lock(:key, hashtext(:repository_id))"),
+        {"key": FINDINGS_LOCK_KEY, "repository_id": str(repository_id)},
+    )
+
+
+def _committed_open_counts(repository_id) -> dict:
+    # Read on a separate connection, so it excludes this transaction's own writes
+    db = SessionLocal()
+    try:
+        return _open_counts(db, repository_id)
+    finally:
+        db.close()
+
+
+class FindingWriter:
+    """
+    Streams a scan's findings into the findings table in fixed-size batches
+    of multi-row INSERT ... ON CONFLICT (repository_id, ref, fingerprint) DO UPDATE,
+    so memory stays flat however many findings a scan produces. Only the
+    job's own ref is written, so a scan of one PR never reopens or fixes
+    another's findings. Nothing is committed here: the caller commits
+    together with the job's final status.
+
+    Findings are dicts with rule_id, severity, file_path and optionally
+    start_line, end_line, message and snippet.
+    """
+
+    def __init__(self, db, job: ScanJob, batch_size: int = FINDINGS_BATCH_SIZE):
+        self.db = db
+        self.job = job
+        self.ref = job_ref(job)
+        self.batch_size = batch_size
+        self._batch = {}  # fingerprint -> row, so a batch never upserts a row twice
+        self.written = 0
+
+    def add(self, finding: dict):
+        rule_id = finding["rule_id"]
+        file_path = finding["file_path"]
+        key = finding.get("fingerprint") or fingerprint(
+            rule_id, file_path, finding.get("snippet"), finding.get("start_line")
+        )
+        self._batch[key] = {
+            "repository_id": self.job.repository_id,
+            "workspace_id": self.job.workspace_id,
+            "ref": self.ref,
+            "fingerprint": key,
+            "rule_id": rule_id,
+            "severity": normalize_severity(finding.get("severity")),
+            "status": "open",
+            "file_path": file_path,
+            "start_line": finding.get("start_line"),
+            "end_line": finding.get("end_line"),
+            "message": finding.get("message"),
+            "first_seen_job_id": self.job.id,
+            "last_seen_job_id": self.job.id,
+        }
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def add_all(self, findings: Iterable[dict]):
+        for finding in findings:
+            self.add(finding)
+
+    def flush(self):
+        if not self._batch:
+            return
+        now = datetime.utcnow()
+        rows = [{**row, "first_seen_at": now, "last_seen_at": now} for row in self._batch.values()]
+        stmt = insert(Finding).values(rows)
+        self.db.execute(stmt.on_conflict_do_update(
+            constraint="uq_findings_repository_ref_fingerprint",
+            set_={
+                "severity": stmt.excluded.severity,
+                "status": "open",
+                "start_line": stmt.excluded.start_line,
+                "end_line": stmt.excluded.end_line,
+                "message": stmt.excluded.message,
+                "last_seen_job_id": stmt.excluded.last_seen_job_id,
+                "last_seen_at": stmt.excluded.last_seen_at,
+            },
+        ))
+        self.written += len(rows)
+        self._batch = {}
+
+    def carry_over(self, base_job_id, covered_paths: Iterable[str]) -> int:
+        """
+        For a diff scan: copy the base job's finding set onto this job's ref
+        for every file outside covered_paths (which the scan analyzed itself,
+        or which the PR removed), so the ref ends up with the base's findings
+        there rather than whatever it had open before. Returns the number of
+        findings carried over.
+        """
+        self.flush()
+        now = datetime.utcnow()
+        base = (
+            select(
+                # Once per row: a Python-side default would be evaluated once for the statement
+                func.gen_random_uuid(),
+                Finding.repository_id,
+                Finding.workspace_id,
+                literal(self.ref).label("ref"),
+                Finding.fingerprint,
+                Finding.rule_id,
+                Finding.severity,
+                literal("open").label("status"),
+                Finding.file_path,
+                Finding.start_line,
+                Finding.end_line,
+                Finding.message,
+                Finding.first_seen_job_id,
+                literal(self.job.id, UUID(as_uuid=True)).label("last_seen_job_id"),
+                Finding.first_seen_at,
+                literal(now).label("last_seen_at"),
+            )
+            .join(ScanJobFinding, ScanJobFinding.finding_id == Finding.id)
+            .where(ScanJobFinding.job_id == base_job_id, Finding.file_path.notin_(list(covered_paths)))
+        )
+        stmt = insert(Finding).from_select(
+            ["id", "repository_id", "workspace_id", "ref", "fingerprint", "rule_id", "severity", "status",
+             "file_path", "start_line", "end_line", "message", "first_seen_job_id", "last_seen_job_id",
+             "first_seen_at", "last_seen_at"],
+            base,
+        )
+        return self.db.execute(stmt.on_conflict_do_update(
+            constraint="uq_findings_repository_ref_fingerprint",
+            set_={
+                "severity": stmt.excluded.severity,
+                "status": "open",
+                "start_line": stmt.excluded.start_line,
+                "end_line": stmt.excluded.end_line,
+                "message": stmt.excluded.message,
+                "last_seen_job_id": stmt.excluded.last_seen_job_id,
+                "last_seen_at": stmt.excluded.last_seen_at,
+            },
+        )).rowcount
+
+    def finish(self, skipped_paths: Iterable[str] = ()) -> int:
+        """
+        Write what is left, mark the ref's open findings this scan didn't
+        report (or carry over) as fixed, record what is left open as the
+        job's finding set, and move the workspace's open-findings counters
+        by the difference. Findings in skipped_paths (files whose analysis
+        timed out) are kept. Returns the number of findings written.
+
+        The difference is the repository's committed open counts vs. the
+        counts including this transaction, taken under a per-repository lock
+        held until the caller commits, so scans of other refs finishing at
+        the same time don't count each other's changes.
+        """
+        self.flush()
+        lock_repository_findings(self.db, self.job.repository_id)
+        open_before = _committed_open_counts(self.job.repository_id)
+
+        stale = [
+            Finding.repository_id == self.job.repository_id,
+            Finding.ref == self.ref,
+            Finding.status == "open",
+            Finding.last_seen_job_id != self.job.id,
+        ]
+        skipped_paths = list(skipped_paths)
+        if skipped_paths:
+            stale.append(Finding.file_path.notin_(skipped_paths))
+        self.db.execute(
+            update(Finding).where(*stale).values(status="fixed"),
+            execution_options={"synchronize_session": False},
+        )
+
+        self.job.findings_count = self.db.execute(
+            insert(ScanJobFinding).from_select(
+                ["job_id", "finding_id"],
+                select(literal(self.job.id, UUID(as_uuid=True)), Finding.id).where(
+                    Finding.repository_id == self.job.repository_id,
+                    Finding.ref == self.ref,
+                    Finding.status == "open",
+                ),
+            ).on_conflict_do_nothing()
+        ).rowcount
+
+        open_after = _open_counts(self.db, self.job.repository_id)
+        apply_stats_delta(self.db, self.job.workspace_id, {
+            f"{severity}_findings": open_after.get(severity, 0) - open_before.get(severity, 0)
+            for severity in SEVERITIES
+        })
+        return self.written
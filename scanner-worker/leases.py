@@ -0,0 +1,79 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from database import SessionLocal
+from models import ScanJob
+
+# Identifies this worker instance on the jobs and queue rows it holds
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+
+# A running job belongs to this worker until its lease expires. The heartbeat
+# renews leases well before that; if the container dies, the API's reaper
+# re-queues the job once the lease runs out.
+SCAN_LEASE_SECONDS = int(os.environ.get("SCAN_LEASE_SECONDS", "90"))
+SCAN_HEARTBEAT_SECONDS = int(os.environ.get("SCAN_HEARTBEAT_SECONDS", "30"))
+
+
+def lease_expiry() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=SCAN_LEASE_SECONDS)
+
+
+def renew_leases(job_ids: list) -> int:
+    """Extend the leases this worker holds. Returns how many were renewed."""
+    if not job_ids:
+        return 0
+    db = SessionLocal()
+    try:
+        renewed = db.query(ScanJob).filter(
+            ScanJob.id.in_(job_ids),
+            ScanJob.worker_id == WORKER_ID,
+            ScanJob.status == "running"
+        ).update({"lease_expires_at": lease_expiry()}, synchronize_session=False)
+        db.commit()
+        return renewed
+    finally:
+        db.close()
+
+
+def expire_leases(job_ids: list):
+    """Give up jobs this worker can't finish, so the reaper re-queues them right away"""
+    if not job_ids:
+        return
+    db = SessionLocal()
+    try:
+        db.query(ScanJob).filter(
+            ScanJob.id.in_(job_ids),
+            ScanJob.worker_id == WORKER_ID,
+            ScanJob.status == "running"
+        ).update({"lease_expires_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+class LeaseHeartbeat:
+    """Periodically renews the leases of every job the executor is running"""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(SCAN_HEARTBEAT_SECONDS):
+            job_ids = self.executor.in_flight()
+            try:
+                renew_leases(job_ids)
+            except Exception as e:
+                print(f"Failed to renew leases for {job_ids}: {e}")
@@ -1,34 +1,100 @@
 import os
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
+import threading
+from fastapi import FastAPI, Request, HTTPException
 from pydantic import BaseModel
-import scanner_logic  # We will create this next
+from executor import scan_executor
+from leases import LeaseHeartbeat
+from queue_consumer import SCAN_QUEUE_BACKEND, QueueConsumer
+from scheduler import lane_metrics
+from clone_cache import clone_cache
+from analysis_cache import analysis_cache
+from cpu_pool import cpu_pool
+from analysis import warm_up
+from rulesets import rulesets
 
 app = FastAPI()
 
+# With the Postgres queue backend this worker pulls jobs itself;
+# with Cloud Tasks they are pushed to /run-scan instead.
+queue_consumer = QueueConsumer(scan_executor) if SCAN_QUEUE_BACKEND == "postgres" else None
+lease_heartbeat = LeaseHeartbeat(scan_executor)
+
+# Seconds the queue is asked to wait before redelivering a refused job
+RETRY_AFTER_SECONDS = os.environ.get("WORKER_RETRY_AFTER_SECONDS", "30")
+
+
+@app.on_event("startup")
+def on_startup():
+    # Analyzer processes and rulesets get ready in the background; a scan
+    # arriving first just prepares what it needs itself
+    threading.Thread(target=warm_up, name="analyzer-warm-up", daemon=True).start()
+    lease_heartbeat.start()
+    if queue_consumer is not None:
+        queue_consumer.start()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    """
+    Uvicorn runs this on SIGTERM (e.g. Cloud Run scale-down). Stop taking
+    work, give running scans a moment to reach a phase boundary, and hand
+    back whatever is left (by expiring its lease) so the API's reaper
+    re-queues it instead of leaving it orphaned in 'running'.
+    """
+    if queue_consumer is not None:
+        queue_consumer.stop()
+    unfinished = scan_executor.drain()
+    lease_heartbeat.stop()
+    if unfinished:
+        print(f"Handed back {len(unfinished)} unfinished job(s): {unfinished}")
+        if queue_consumer is not None:
+            queue_consumer.release(unfinished)
+
+
 # This Pydantic model validates the incoming payload from Cloud Tasks
 class ScanTaskPayload(BaseModel):
     job_id: str
     plan_level: str
 
 @app.post("/run-scan")
-async def run_scan_endpoint(payload: ScanTaskPayload, background_tasks: BackgroundTasks):
+async def run_scan_endpoint(payload: ScanTaskPayload):
     """
-    This is the only endpoint in our application.
     Google Cloud Tasks will send a POST request here.
+    The scan runs on the bounded executor; when it is full (429) or the
+    worker is shutting down (503) the task is refused and Cloud Tasks
+    retries it later, possibly on another instance.
     """
-    try:
-        print(f"Received scan job: {payload.job_id}")
+    print(f"Received scan job: {payload.job_id}")
+
+    if scan_executor.draining:
+        raise HTTPException(
+            status_code=503,
+            detail="Worker is shutting down",
+            headers={"Retry-After": RETRY_AFTER_SECONDS},
+        )
 
-        # We run the actual scan in the background.
-        # This lets us immediately return a 200 OK to Cloud Tasks.
-        # If we don't return 200 quickly, Cloud Tasks will think the job failed and retry.
-        background_tasks.add_task(scanner_logic.run_scan, payload.job_id, payload.plan_level)
+    # We return as soon as the scan is admitted.
+    # If we don't return 200 quickly, Cloud Tasks will think the job failed and retry.
+    if not scan_executor.submit(payload.job_id, payload.plan_level):
+        raise HTTPException(
+            status_code=429,
+            detail="Worker is at capacity",
+            headers={"Retry-After": RETRY_AFTER_SECONDS},
+        )
 
-        return {"status": "accepted", "job_id": payload.job_id}
+    return {"status": "accepted", "job_id": payload.job_id}
 
-    except Exception as e:
-        print(f"Error accepting job: {e}")
-        raise HTTPException(status_code=500, detail="Failed to accept job")
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "queue_wait_by_lane": lane_metrics.snapshot(),
+        "in_flight_jobs": len(scan_executor.in_flight()),
+        "max_in_flight_jobs": scan_executor.max_jobs,
+        "cpu_pool": cpu_pool.stats(),
+        "rulesets": rulesets.stats(),
+        "clone_cache": clone_cache.stats(),
+        "analysis_cache": analysis_cache.stats(),
+    }
 
 @app.get("/")
 def health_check():
@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, DateTime, ForeignKey, Integer
+from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, Boolean, Index, Text, UniqueConstraint, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from database import Base
@@ -24,6 +24,10 @@ class Workspace(Base):
 
 class Repository(Base):
     __tablename__ = "repositories"
+    __table_args__ = (
+        # One row per GitHub repository per workspace; installation syncs upsert against it
+        UniqueConstraint("workspace_id", "external_id", name="uq_repositories_workspace_external_id"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id"), nullable=False)
     provider = Column(String, nullable=False)
@@ -34,12 +38,158 @@ class Repository(Base):
 
 class ScanJob(Base):
     __tablename__ = "scanjobs"
+    __table_args__ = (
+        # Result reuse looks jobs up by (repository, commit)
+        Index("ix_scanjobs_repository_commit", "repository_id", "commit_sha"),
+        # ...and by (repository, ref) for the ref's latest result
+        Index("ix_scanjobs_repository_ref_completed", "repository_id", "ref", "completed_at"),
+        # The latest ruleset stamp per plan
+        Index("ix_scanjobs_plan_completed", "plan_level", "completed_at"),
+        # Keyset pagination of the job listing on (created_at, id), per
+        # workspace and per repository; scanned backwards for newest-first
+        Index("ix_scanjobs_workspace_created", "workspace_id", "created_at", "id"),
+        Index("ix_scanjobs_workspace_status_created", "workspace_id", "status", "created_at", "id"),
+        Index("ix_scanjobs_repository_created", "repository_id", "created_at", "id"),
+        # Queued jobs the dispatch sweep still has to enqueue
+        Index("ix_scanjobs_undispatched", "queued_at",
+              postgresql_where=text("status = 'queued' AND dispatched_at IS NULL")),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     repository_id = Column(UUID(as_uuid=True), ForeignKey("repositories.id"), nullable=False)
+    # Denormalized from the repository so scheduling and stats don't need a join
+    workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id"), index=True, nullable=False)
     status = Column(String, default="queued", index=True, nullable=False)
     plan_level = Column(String, nullable=False)
     commit_sha = Column(String, nullable=False)
+    # The PR's base commit; lets the worker scan only what the PR touches
+    base_sha = Column(String, nullable=True)
     pr_number = Column(Integer)
+    # What was scanned: "pr/<number>" for a pull request, "branch/<name>" for a
+    # branch. Findings' open/fixed state is kept per ref.
+    ref = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # When the GitHub event behind the job happened (a PR's updated_at), so a
+    # delivery retried late can't supersede a job for a newer commit
+    event_at = Column(DateTime, nullable=True)
     completed_at = Column(DateTime, nullable=True)
+    # Set when a newer commit supersedes a running job; checked by the worker between phases
+    cancel_requested = Column(Boolean, default=False, nullable=False)
+    # Ruleset the results were produced with, "<SCAN_RULESET_VERSION>:<ruleset digest>";
+    # results are only reused, and diff scans only build on them, for the same one
+    ruleset_version = Column(String, nullable=True)
+    # Set when this job was completed by reusing another job's results for the same commit
+    reused_from_id = Column(UUID(as_uuid=True), ForeignKey("scanjobs.id"), nullable=True)
+    # Lease held by the worker running the job, renewed by its heartbeat.
+    # Jobs whose lease runs out are re-queued by the API's reaper.
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, index=True, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    failure_reason = Column(Text, nullable=True)
+    # When the job last entered 'queued', and when that was handed to the
+    # queue backend. Jobs are committed before they are enqueued, so one
+    # queued a while ago with no dispatch is re-enqueued by the API's sweep.
+    queued_at = Column(DateTime, default=datetime.utcnow, nullable=True)
+    dispatched_at = Column(DateTime, nullable=True)
+    # 'full', or 'diff' when only the files a PR changed or affects were scanned
+    scan_scope = Column(String, nullable=True)
+    # Files whose analysis came from the per-blob analysis cache vs. was run
+    analysis_cache_hits = Column(Integer, nullable=True)
+    analysis_cache_misses = Column(Integer, nullable=True)
+    # Size of the job's finding set in scan_job_findings (reused results copy
+    # their source's); NULL for jobs that don't have one recorded (unfinished,
+    # or from before it existed)
+    findings_count = Column(Integer, nullable=True)
     repository = relationship("Repository", back_populates="scan_jobs")
+
+class Finding(Base):
+    """
+    One issue on one ref (PR or branch) of a repository, deduplicated across
+    that ref's commits by a fingerprint that doesn't depend on line numbers
+    (see scanner-worker/findings.py). A ref's scans refresh last_seen_job_id
+    and mark the ref's findings they no longer see as 'fixed'; scans of other
+    refs never touch them. Closing a PR marks its open findings 'closed'.
+    """
+    __tablename__ = "findings"
+    __table_args__ = (
+        UniqueConstraint("repository_id", "ref", "fingerprint", name="uq_findings_repository_ref_fingerprint"),
+        # "Open findings by repository / workspace and severity"
+        Index("ix_findings_open_repository_severity", "repository_id", "severity",
+              postgresql_where=text("status = 'open'")),
+        Index("ix_findings_open_workspace_severity", "workspace_id", "severity",
+              postgresql_where=text("status = 'open'")),
+    )
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    repository_id = Column(UUID(as_uuid=True), ForeignKey("repositories.id"), nullable=False)
+    workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id"), nullable=False)
+    ref = Column(String, nullable=False)  # see ScanJob.ref
+    fingerprint = Column(String, nullable=False)
+    rule_id = Column(String, nullable=False)
+    severity = Column(String, nullable=False)  # critical / high / medium / low
+    status = Column(String, default="open", nullable=False)  # open / fixed / closed
+    file_path = Column(Text, nullable=False)
+    start_line = Column(Integer, nullable=True)
+    end_line = Column(Integer, nullable=True)
+    message = Column(Text, nullable=True)
+    first_seen_job_id = Column(UUID(as_uuid=True), ForeignKey("scanjobs.id"), nullable=False)
+    last_seen_job_id = Column(UUID(as_uuid=True), ForeignKey("scanjobs.id"), index=True, nullable=False)
+    first_seen_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_seen_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class ScanJobFinding(Base):
+    """
+    The findings open on a job's ref when the job completed: what the job
+    reported plus what a diff scan carried over from its base. Lets a later
+    diff scan start from exactly this job's result.
+    """
+    __tablename__ = "scan_job_findings"
+    job_id = Column(UUID(as_uuid=True), ForeignKey("scanjobs.id"), primary_key=True)
+    finding_id = Column(UUID(as_uuid=True), ForeignKey("findings.id"), primary_key=True)
+
+class AnalysisResult(Base):
+    """
+    Shared tier of the worker's per-file analysis cache: one analyzer's
+    output for one file content (git blob SHA) under one ruleset version.
+    """
+    __tablename__ = "analysis_results"
+    blob_sha = Column(String, primary_key=True)
+    analyzer = Column(String, primary_key=True)
+    ruleset_version = Column(String, primary_key=True)
+    results = Column(Text, nullable=False)  # JSON list of findings, without file paths
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class WorkspaceStats(Base):
+    """
+    Dashboard counters per workspace, kept up to date with deltas written in
+    the same transaction as the change they count (api-backend/workspace_stats.py
+    and the worker's run_scan) and periodically reconciled from the source tables.
+    """
+    __tablename__ = "workspace_stats"
+    workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id"), primary_key=True)
+    repo_count = Column(Integer, default=0, nullable=False)
+    queued_scans = Column(Integer, default=0, nullable=False)
+    running_scans = Column(Integer, default=0, nullable=False)
+    completed_scans = Column(Integer, default=0, nullable=False)
+    failed_scans = Column(Integer, default=0, nullable=False)
+    superseded_scans = Column(Integer, default=0, nullable=False)
+    # Open findings by severity
+    critical_findings = Column(Integer, default=0, nullable=False)
+    high_findings = Column(Integer, default=0, nullable=False)
+    medium_findings = Column(Integer, default=0, nullable=False)
+    low_findings = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Null until the counters were first recomputed from scratch
+    reconciled_at = Column(DateTime, nullable=True)
+
+class ScanQueueItem(Base):
+    """
+    Scans for the Postgres queue backend. Workers claim rows through the
+    scheduler (scanner-worker/scheduler.py) and delete them once the scan ends,
+    so claimed rows double as the per-workspace count of in-flight scans.
+    """
+    __tablename__ = "scan_queue"
+    job_id = Column(UUID(as_uuid=True), ForeignKey("scanjobs.id"), primary_key=True)
+    workspace_id = Column(UUID(as_uuid=True), ForeignKey("workspaces.id"), index=True, nullable=False)
+    plan_level = Column(String, nullable=False)
+    enqueued_at = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+    claimed_by = Column(String, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
@@ -0,0 +1,70 @@
+import os
+import threading
+from executor import ScanExecutor
+from leases import WORKER_ID
+from scheduler import claim_jobs, release_job
+
+# Must match the API's SCAN_QUEUE_BACKEND; the pull loop only runs for "postgres"
+SCAN_QUEUE_BACKEND = os.environ.get("SCAN_QUEUE_BACKEND", "cloudtasks")
+# How often the worker polls an empty queue
+SCAN_QUEUE_POLL_SECONDS = float(os.environ.get("SCAN_QUEUE_POLL_SECONDS", "2"))
+
+
+class QueueConsumer:
+    """
+    Pulls jobs from the Postgres queue at this worker's own pace: it only
+    ever claims as many jobs as the executor has free slots.
+    """
+
+    def __init__(self, executor: ScanExecutor):
+        self.executor = executor
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="queue-consumer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def release(self, job_ids):
+        """
+        Drop queue rows for jobs this worker is done with. Jobs it gave up on
+        are re-enqueued by the API's reaper once their lease has expired.
+        """
+        for job_id in job_ids:
+            try:
+                release_job(job_id, WORKER_ID)
+            except Exception as e:
+                print(f"Failed to release job {job_id}: {e}")
+
+    def _job_done(self, job_id: str, final_status):
+        # None means the lease was lost: the reaper already dropped our row
+        # and the job's new row is someone else's
+        if final_status is not None:
+            release_job(job_id, WORKER_ID)
+
+    def _run(self):
+        while not self._stop.is_set():
+            free_slots = self.executor.free_slots()
+
+            claimed = []
+            if free_slots > 0:
+                try:
+                    claimed = claim_jobs(WORKER_ID, free_slots)
+                except Exception as e:
+                    print(f"Failed to claim jobs: {e}")
+
+            for job_id, plan_level in claimed:
+                print(f"Claimed scan job: {job_id}")
+                if not self.executor.submit(str(job_id), plan_level, on_done=self._job_done):
+                    self.release([job_id])
+
+            # Go straight back for more if we filled every free slot;
+            # otherwise wait for a slot to free up or the next poll.
+            if claimed and len(claimed) == free_slots:
+                continue
+            self.executor.wait_for_slot(SCAN_QUEUE_POLL_SECONDS)
@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+from dataclasses import dataclass
+import httpx
+
+# Semgrep configs per plan level: registry names ("p/default") or local
+# paths. Plans not listed get SEMGREP_CONFIG.
+SEMGREP_CONFIG = os.environ.get("SEMGREP_CONFIG", "p/default")
+PLAN_RULESETS = json.loads(os.environ.get(
+    "SEMGREP_PLAN_CONFIGS",
+    '{"free": ["p/default"], "pro": ["p/default", "p/secrets"],'
+    ' "team": ["p/default", "p/secrets", "p/owasp-top-ten"],'
+    ' "enterprise": ["p/default", "p/secrets", "p/owasp-top-ten"]}',
+))
+SEMGREP_REGISTRY_URL = os.environ.get("SEMGREP_REGISTRY_URL", "https://semgrep.dev/c/{config}")
+# Prepared rulesets on local disk, one directory per plan and version
+RULESET_DIR = os.environ.get("RULESET_DIR", "/tmp/arcanext/rulesets")
+# How often a plan's configs are re-fetched to pick up rule changes
+RULESET_REFRESH_SECONDS = float(os.environ.get("RULESET_REFRESH_SECONDS", "3600"))
+# Old versions kept per plan, for scans that started before a swap
+RULESET_KEEP_VERSIONS = int(os.environ.get("RULESET_KEEP_VERSIONS", "3"))
+
+
+# A `paths:` key, the rule option that includes/excludes files by path (YAML
+# or JSON). Matching it anywhere else too only costs cache hits.
+_PATHS_KEY = re.compile(rb"""^[\s-]*["']?paths["']?\s*:|"paths"\s*:""", re.MULTILINE)
+
+
+class RulesetError(Exception):
+    """A plan's ruleset could not be prepared"""
+
+
+@dataclass(frozen=True)
+class Ruleset:
+    plan_level: str
+    path: str  # a versioned directory, never changed once written
+    version: str  # digest of the rules' contents
+    # Some rules include or exclude files by path, so results depend on the path too
+    path_filtered: bool = False
+
+
+class Rulesets:
+    """
+    Semgrep rulesets prepared ahead of scans, per plan level. Registry
+    configs are downloaded once and validated, then stored in a directory
+    named by their digest; a plan's `current` symlink is swapped to a new
+    version atomically (os.replace), so a scan sees either the old rules or
+    the new ones, never a mix. Scans then run against local files and skip
+    the registry round trip. The version goes into analysis cache keys, so
+    cached results never outlive the rules that produced them.
+    """
+
+    def __init__(self, root: str = RULESET_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._plan_locks = {}
+        self._current = {}  # plan_level -> (Ruleset, checked_at)
+        os.makedirs(root, exist_ok=True)
+
+    def configs_for(self, plan_level: str) -> list:
+        configs = PLAN_RULESETS.get(plan_level) or [SEMGREP_CONFIG]
+        return [configs] if isinstance(configs, str) else list(configs)
+
+    def _plan_lock(self, plan_level: str) -> threading.Lock:
+        with self._lock:
+            return self._plan_locks.setdefault(plan_level, threading.Lock())
+
+    def _fetch(self, config: str) -> list:
+        """[(file name, rules yaml)] for one config"""
+        if os.path.isfile(config):
+            with open(config, "rb") as f:
+                return [(os.path.basename(config), f.read())]
+        if os.path.isdir(config):
+            files = []
+            for root, _, names in os.walk(config):
+                for name in sorted(names):
+                    if name.endswith((".yaml", ".yml")):
+                        with open(os.path.join(root, name), "rb") as f:
+                            relative = os.path.relpath(os.path.join(root, name), config)
+                            files.append((relative.replace(os.sep, "_"), f.read()))
+            return files
+        response = httpx.get(SEMGREP_REGISTRY_URL.format(config=config), timeout=60, follow_redirects=True)
+        if response.status_code != 200:
+            raise RulesetError(f"registry returned {response.status_code} for {config}")
+        return [(config.replace("/", "_") + ".yaml", response.content)]
+
+    def _validate(self, path: str):
+        completed = subprocess.run(
+            ["semgrep", "scan", "--validate", "--metrics=off", "--disable-version-check", "--config", path],
+            capture_output=True,
+            text=True,
+            timeout=300,
+        )
+        if completed.returncode != 0:
+            raise RulesetError(f"rules failed validation: {completed.stderr.strip()[-500:]}")
+
+    def _prepare(self, plan_level: str) -> Ruleset:
+        files = []
+        for i, config in enumerate(self.configs_for(plan_level)):
+            files += [(f"{i:02d}-{name}", content) for name, content in self._fetch(config)]
+        digest = hashlib.sha256()
+        for name, content in files:
+            digest.update(name.encode() + b"\0" + hashlib.sha256(content).digest())
+        version = digest.hexdigest()[:16]
+
+        plan_dir = os.path.join(self.root, plan_level)
+        path = os.path.join(plan_dir, version)
+        if not os.path.isdir(path):
+            staging = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            os.makedirs(staging)
+            try:
+                for name, content in files:
+                    with open(os.path.join(staging, name), "wb") as f:
+                        f.write(content)
+                self._validate(staging)
+                try:
+                    os.rename(staging, path)
+                except OSError:
+                    if not os.path.isdir(path):
+                        raise
+                    shutil.rmtree(staging, ignore_errors=True)  # prepared concurrently by another process
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+
+        current = os.path.join(plan_dir, "current")
+        if os.path.realpath(current) != path:
+            link = f"{current}.{os.getpid()}.tmp"
+            os.symlink(version, link)
+            os.replace(link, current)
+            print(f"Ruleset for plan '{plan_level}' is now {version}.")
+        os.utime(path)
+        self._prune(plan_dir, version)
+        return Ruleset(plan_level, path, version, any(_PATHS_KEY.search(content) for _, content in files))
+
+    def _prune(self, plan_dir: str, keep: str):
+        versions = sorted(
+            (entry for entry in os.scandir(plan_dir) if entry.is_dir(follow_symlinks=False) and not entry.name.endswith(".tmp")),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )
+        for entry in versions[RULESET_KEEP_VERSIONS:]:
+            if entry.name != keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def current(self, plan_level: str) -> Ruleset:
+        """
+        The plan's prepared ruleset, refreshed when older than
+        RULESET_REFRESH_SECONDS. If a refresh fails the previous version
+        stays in use.
+        """
+        with self._plan_lock(plan_level):
+            ruleset, checked_at = self._current.get(plan_level, (None, 0.0))
+            if ruleset is not None and time.monotonic() - checked_at < RULESET_REFRESH_SECONDS:
+                return ruleset
+            try:
+                ruleset = self._prepare(plan_level)
+            except (RulesetError, httpx.HTTPError, OSError, subprocess.TimeoutExpired) as e:
+                ruleset = ruleset or self._on_disk(plan_level)
+                if ruleset is None:
+                    raise RulesetError(f"no ruleset for plan '{plan_level}': {e}") from e
+                print(f"Could not refresh the ruleset for plan '{plan_level}', keeping {ruleset.version}: {e}")
+            with self._lock:
+                self._current[plan_level] = (ruleset, time.monotonic())
+            return ruleset
+
+    def _on_disk(self, plan_level: str):
+        """The version a previous run of this worker left current, if any"""
+        path = os.path.realpath(os.path.join(self.root, plan_level, "current"))
+        if not os.path.isdir(path):
+            return None
+        path_filtered = False
+        for entry in os.scandir(path):
+            with open(entry.path, "rb") as f:
+                path_filtered = path_filtered or bool(_PATHS_KEY.search(f.read()))
+        return Ruleset(plan_level, path, os.path.basename(path), path_filtered)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {plan_level: ruleset.version for plan_level, (ruleset, _) in self._current.items()}
+
+
+rulesets = Rulesets()
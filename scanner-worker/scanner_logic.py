@@ -1,10 +1,57 @@
+import os
+import threading
 import time
+from datetime import datetime
 from database import SessionLocal
 from models import ScanJob
+from clone_cache import auth_header, clone_cache, remote_url_for
+from analysis import AnalysisStats, collect_findings, get_analyzers, ruleset_stamp
+from cpg import CPG_ENABLED, cpg_builder
+from diff_scope import plan_scope
+from findings import FindingWriter, job_ref
+from leases import WORKER_ID, lease_expiry
+from workspace_stats import apply_stats_delta, status_transition
+
+
+# Version of the scanning rules; with the digest of the plan's prepared
+# ruleset it is stamped on every completed job (see analysis.ruleset_stamp).
+# Must match the API's setting, which only reuses results of the same version.
+SCAN_RULESET_VERSION = os.environ.get("SCAN_RULESET_VERSION", "1")
+
+
+class ScanCancelled(Exception):
+    """Raised between phases when the job was superseded by a newer commit"""
+
+
+class ScanInterrupted(Exception):
+    """Raised between phases when the worker is shutting down"""
+
+
+class ScanLeaseLost(Exception):
+    """Raised between phases when the job's lease was reaped and handed to someone else"""
+
+
+# Set when the worker starts draining; running scans stop at the next phase
+shutdown_requested = threading.Event()
+
+
+def _check_cancelled(db, job: ScanJob):
+    """Cooperative cancellation: re-read the flag the API sets on supersede"""
+    if shutdown_requested.is_set():
+        raise ScanInterrupted()
+    db.refresh(job, attribute_names=["cancel_requested", "status", "worker_id"])
+    if job.status != "running" or job.worker_id != WORKER_ID:
+        raise ScanLeaseLost()
+    if job.cancel_requested:
+        raise ScanCancelled()
+
 
 def run_scan(job_id: str, plan_level: str):
     """
     This is the placeholder function that does the "work".
+    Returns the job's final status (its current one if another run already
+    finished it), or None if the job isn't ours to finish: it doesn't
+    exist, or its lease was reaped and handed to someone else.
     """
     print(f"--- STARTING SCAN (Job {job_id}, Plan {plan_level}) ---")
     db = SessionLocal()
@@ -13,31 +60,143 @@ def run_scan(job_id: str, plan_level: str):
         job = db.query(ScanJob).filter(ScanJob.id == job_id).first()
         if not job:
             print(f"Job {job_id} not found.")
-            return
+            return None
 
-        # 2. Mark the job as 'running'
-        job.status = "running"
+        # 2. Mark the job as 'running' and take the lease on it. This only
+        # succeeds from 'queued', so superseded (or otherwise finished) jobs
+        # and duplicate deliveries are never run.
+        started = db.query(ScanJob).filter(
+            ScanJob.id == job_id,
+            ScanJob.status == "queued"
+        ).update({
+            "status": "running",
+            "worker_id": WORKER_ID,
+            "lease_expires_at": lease_expiry(),
+            "attempts": ScanJob.attempts + 1,
+        }, synchronize_session=False)
+        if started:
+            apply_stats_delta(db, job.workspace_id, status_transition("queued", "running"))
         db.commit()
+        if not started:
+            print(f"Job {job_id} is '{job.status}', skipping.")
+            return job.status
+        db.refresh(job)
         print(f"Job {job_id} marked as 'running'.")
 
-        # 3. *** THIS IS THE FAKE WORK ***
-        # In the real app, we would clone, scan, and run AI here.
-        # For now, we just sleep for 30 seconds to simulate a scan.
-        print("Scanning... (Simulating 30-second scan)")
-        time.sleep(30)
+        # The rules this scan runs, fixed for the whole job. Fails the job
+        # if there is nothing to run them with.
+        analyzers = get_analyzers(plan_level)
+        stamp = ruleset_stamp(SCAN_RULESET_VERSION, analyzers)
+
+        # 3. Check out the commit from this worker's clone cache
+        _check_cancelled(db, job)
+        with clone_cache.checkout(
+            str(job.repository_id),
+            remote_url_for(job.repository.repo_name),
+            job.commit_sha,
+            job_id,
+            auth_header=auth_header(),
+        ) as worktree:
+            # Jobs whose base was already scanned only analyze what they touch
+            scope = plan_scope(db, job, worktree, stamp)
+            job.scan_scope = scope.mode
+            print(f"Job {job_id}: {scope.mode} scan ({scope.reason}).")
 
-        # 4. Mark the job as 'completed'
-        job.status = "completed"
+            # 4. Analyze (files already analyzed with this ruleset come from
+            # the analysis cache), store the findings in batches and mark the
+            # job as 'completed', all in one transaction. A diff scan takes
+            # the findings outside its files from the base scan.
+            analysis_stats = AnalysisStats()
+            writer = FindingWriter(db, job)
+            writer.add_all(collect_findings(
+                str(job.repository_id),
+                job.commit_sha,
+                worktree,
+                plan_level,
+                SCAN_RULESET_VERSION,
+                paths=scope.paths,
+                stats=analysis_stats,
+                check=lambda: _check_cancelled(db, job),
+                analyzers=analyzers,
+            ))
+            _check_cancelled(db, job)
+            if scope.base_job_id is not None:
+                carried = writer.carry_over(scope.base_job_id, scope.covered_paths)
+                print(f"Carried {carried} finding(s) over from base job {scope.base_job_id}.")
+            written = writer.finish(skipped_paths=analysis_stats.skipped_paths)
+            job.analysis_cache_hits = analysis_stats.cache_hits
+            job.analysis_cache_misses = analysis_stats.cache_misses
+            print(
+                f"Stored {written} finding(s) for job {job_id}; analysis cache hit rate "
+                f"{analysis_stats.hit_rate:.0%} ({analysis_stats.cache_hits} hits, {analysis_stats.cache_misses} misses), "
+                f"{analysis_stats.shards} shard(s), {len(analysis_stats.skipped_paths)} file(s) skipped after timing out."
+            )
+            job.status = "completed"
+            job.completed_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+            job.ruleset_version = stamp
+            apply_stats_delta(db, job.workspace_id, status_transition("running", "completed"))
+            db.commit()
+
+            # 5. Bring the code property graph up to this commit. Only the
+            # default branch has a graph (branch jobs come from pushes to
+            # it); PR heads would overwrite it. The scan already succeeded,
+            # so a graph failure doesn't fail it.
+            if CPG_ENABLED and job_ref(job).startswith("branch/"):
+                try:
+                    cpg = cpg_builder.update(
+                        str(job.repository_id), job.commit_sha, worktree,
+                        remote_url_for(job.repository.repo_name), auth_header(),
+                    )
+                    print(
+                        f"CPG for job {job_id}: {cpg.mode} build, {cpg.files_changed} file(s), "
+                        f"{cpg.incremental_parses} incremental / {cpg.full_parses} full parse(s), "
+                        f"+{cpg.edges_added}/-{cpg.edges_removed} edges in {cpg.seconds:.2f}s."
+                    )
+                except Exception as e:
+                    print(f"CPG update failed for job {job_id}: {e}")
+        print(f"--- SCAN COMPLETED (Job {job_id}) ---")
+        return job.status
+
+    except ScanCancelled:
+        print(f"--- SCAN SUPERSEDED (Job {job_id}) ---")
+        db.rollback()  # drop any findings written before the cancel
+        job.status = "superseded"
         job.completed_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        apply_stats_delta(db, job.workspace_id, status_transition("running", "superseded"))
         db.commit()
-        print(f"--- SCAN COMPLETED (Job {job_id}) ---")
+        return job.status
+
+    except ScanInterrupted:
+        # Drop the findings written so far and expire our lease (if it is
+        # still ours) so the reaper re-queues the job straight away
+        print(f"--- SCAN INTERRUPTED BY SHUTDOWN (Job {job_id}) ---")
+        db.rollback()
+        db.query(ScanJob).filter(
+            ScanJob.id == job_id,
+            ScanJob.worker_id == WORKER_ID,
+            ScanJob.status == "running"
+        ).update({"lease_expires_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        return job.status
+
+    except ScanLeaseLost:
+        # The job was re-queued while we were stalled; leave it to its new owner
+        print(f"--- SCAN LEASE LOST (Job {job_id}) ---")
+        db.rollback()
+        return None
 
     except Exception as e:
         print(f"!!! SCAN FAILED (Job {job_id}) !!!")
         print(f"Error: {e}")
         if 'job' in locals():
+            # Findings written so far must not be stored under a failed job
+            db.rollback()
+            apply_stats_delta(db, job.workspace_id, status_transition(job.status, "failed"))
             job.status = "failed"
+            job.failure_reason = str(e)
             db.commit()
+            return job.status
+        return None
 
     finally:
         db.close()
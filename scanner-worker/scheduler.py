@@ -0,0 +1,181 @@
+"""
+Picks the next scans off the postgres scan_queue. Only used with
+SCAN_QUEUE_BACKEND=postgres: Cloud Tasks pushes jobs straight to the
+worker, so lanes, fairness and the per-workspace cap don't apply there.
+"""
+import os
+import json
+import threading
+from collections import deque
+from datetime import datetime
+from sqlalchemy import bindparam, delete, text
+from sqlalchemy.dialects.postgresql import UUID
+from database import SessionLocal
+from models import ScanQueueItem
+
+# Priority lane per plan level (lower runs first). Every queued job in a
+# better lane is claimed before any job in a worse one.
+PLAN_LANES = json.loads(os.environ.get(
+    "SCHED_PLAN_LANES", '{"enterprise": 0, "team": 1, "pro": 1, "free": 2}'
+))
+# Share of a lane each workspace gets, by plan: inside a lane, a workspace
+# with weight 2 gets twice the slots of a weight-1 workspace that is also busy.
+PLAN_WEIGHTS = json.loads(os.environ.get(
+    "SCHED_PLAN_WEIGHTS", '{"enterprise": 1, "team": 2, "pro": 1, "free": 1}'
+))
+DEFAULT_LANE = max(PLAN_LANES.values(), default=0)
+DEFAULT_WEIGHT = 1
+
+# How many scans one workspace may have in flight across all workers
+WORKSPACE_MAX_IN_FLIGHT = int(os.environ.get("SCHED_WORKSPACE_MAX_IN_FLIGHT", "3"))
+
+# Serializes scheduling decisions across workers so the per-workspace cap holds
+SCHEDULER_LOCK_KEY = 0x5CA9_0001
+
+# Picks the next jobs in lane order, then by each workspace's weighted share:
+# a workspace's k-th queued job ranks at (in_flight + k) / weight, so busy
+# workspaces yield to idle ones and heavy plans advance faster.
+_CANDIDATES_SQL = """
+WITH in_flight AS (
+    SELECT workspace_id, count(*) AS n
+    FROM scan_queue
+    WHERE claimed_at IS NOT NULL
+    GROUP BY workspace_id
+),
+pending AS (
+    SELECT
+        q.job_id,
+        q.enqueued_at,
+        {lane} AS lane,
+        {weight} AS weight,
+        coalesce(f.n, 0) AS in_flight,
+        row_number() OVER (PARTITION BY q.workspace_id ORDER BY q.enqueued_at) AS rank_in_workspace
+    FROM scan_queue q
+    LEFT JOIN in_flight f ON f.workspace_id = q.workspace_id
+    WHERE q.claimed_at IS NULL
+)
+SELECT job_id
+FROM pending
+WHERE in_flight + rank_in_workspace <= :max_in_flight
+ORDER BY lane, (in_flight + rank_in_workspace)::float / weight, enqueued_at
+LIMIT :limit
+"""
+
+_CLAIM_SQL = """
+UPDATE scan_queue
+SET claimed_by = :worker_id, claimed_at = :now
+WHERE job_id IN (
+    SELECT job_id FROM scan_queue
+    WHERE job_id IN :job_ids AND claimed_at IS NULL
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING job_id, plan_level, enqueued_at
+"""
+
+
+def _plan_case(mapping: dict, default, prefix: str):
+    """Render CASE q.plan_level WHEN ... as SQL plus its bind params"""
+    clauses, params = [], {}
+    for i, (plan, value) in enumerate(mapping.items()):
+        clauses.append(f"WHEN :{prefix}_plan_{i} THEN :{prefix}_value_{i}")
+        params[f"{prefix}_plan_{i}"] = plan
+        params[f"{prefix}_value_{i}"] = value
+    params[f"{prefix}_default"] = default
+    sql = f"CASE q.plan_level {' '.join(clauses)} ELSE :{prefix}_default END"
+    return sql, params
+
+
+def lane_for(plan_level: str) -> int:
+    return PLAN_LANES.get(plan_level, DEFAULT_LANE)
+
+
+class LaneMetrics:
+    """Queue-wait time (enqueue -> claim) per priority lane"""
+
+    def __init__(self, sample_size: int = 1000):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+        self._sample_size = sample_size
+
+    def record(self, lane: int, wait_seconds: float):
+        with self._lock:
+            self._samples.setdefault(lane, deque(maxlen=self._sample_size)).append(wait_seconds)
+            self._counts[lane] = self._counts.get(lane, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = {}
+            for lane, samples in self._samples.items():
+                ordered = sorted(samples)
+                result[str(lane)] = {
+                    "claimed": self._counts[lane],
+                    "wait_p50_seconds": ordered[len(ordered) // 2],
+                    "wait_p95_seconds": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "wait_max_seconds": ordered[-1],
+                }
+            return result
+
+
+lane_metrics = LaneMetrics()
+
+
+def claim_jobs(worker_id: str, limit: int) -> list:
+    """
+    Claim up to `limit` jobs for this worker, honouring priority lanes,
+    weighted fair sharing between workspaces and the per-workspace cap.
+    Returns a list of (job_id, plan_level) in scheduling order.
+    """
+    lane_sql, lane_params = _plan_case(PLAN_LANES, DEFAULT_LANE, "lane")
+    weight_sql, weight_params = _plan_case(PLAN_WEIGHTS, DEFAULT_WEIGHT, "weight")
+
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEDULER_LOCK_KEY})
+
+        job_ids = db.execute(
+            text(_CANDIDATES_SQL.format(lane=lane_sql, weight=weight_sql)),
+            {
+                **lane_params,
+                **weight_params,
+                "max_in_flight": WORKSPACE_MAX_IN_FLIGHT,
+                "limit": limit,
+            },
+        ).scalars().all()
+        if not job_ids:
+            db.commit()
+            return []
+
+        now = datetime.utcnow()
+        claim = text(_CLAIM_SQL).bindparams(
+            bindparam("job_ids", expanding=True, type_=UUID(as_uuid=True))
+        )
+        rows = db.execute(claim, {"worker_id": worker_id, "now": now, "job_ids": job_ids}).all()
+        db.commit()
+    finally:
+        db.close()
+
+    order = {job_id: i for i, job_id in enumerate(job_ids)}
+    claimed = []
+    for job_id, plan_level, enqueued_at in sorted(rows, key=lambda row: order[row[0]]):
+        lane_metrics.record(lane_for(plan_level), (now - enqueued_at).total_seconds())
+        claimed.append((job_id, plan_level))
+    return claimed
+
+
+def release_job(job_id, worker_id: str):
+    """
+    Remove a finished job from the queue, freeing its workspace's slot. Only
+    the row this worker claimed is removed: if the job was reaped and
+    re-enqueued meanwhile, the new row belongs to the queue, not to us.
+    """
+    db = SessionLocal()
+    try:
+        db.execute(delete(ScanQueueItem).where(
+            ScanQueueItem.job_id == job_id,
+            ScanQueueItem.claimed_by == worker_id,
+        ))
+        db.commit()
+    finally:
+        db.close()
+
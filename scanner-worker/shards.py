@@ -0,0 +1,111 @@
+import os
+import math
+import heapq
+from concurrent.futures import FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+from analyzers import ANALYZER_BATCH_FILES, Analyzer, AnalyzerTimeout, run_shard
+from cpu_pool import CpuPool, cpu_pool
+
+# Shards planned per pool process, so fast shards even out slow ones
+SHARDS_PER_WORKER = int(os.environ.get("SHARDS_PER_WORKER", "4"))
+# Below this a shard costs more in analyzer start-up than it saves
+SHARD_MIN_BYTES = int(os.environ.get("SHARD_MIN_BYTES", str(256 * 1024)))
+# Longest one shard may run. A shard that times out is split in half and
+# retried, down to the single file that is too slow, which is skipped.
+ANALYSIS_SHARD_TIMEOUT_SECONDS = float(os.environ.get("ANALYSIS_SHARD_TIMEOUT_SECONDS", "300"))
+# How often a scan waiting on shards checks whether it was cancelled
+ANALYSIS_CHECK_INTERVAL_SECONDS = float(os.environ.get("ANALYSIS_CHECK_INTERVAL_SECONDS", "5"))
+
+
+@dataclass
+class Shard:
+    language: str
+    paths: list = field(default_factory=list)
+    size: int = 0
+
+
+def language_of(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    return extension or os.path.basename(path).lower()
+
+
+def plan_shards(worktree: str, paths: list, workers: int) -> list:
+    """
+    Split files into shards of roughly equal bytes, one language per shard
+    (an analyzer loads only that language's rules for it). Shard size aims
+    at SHARDS_PER_WORKER shards per worker, never below SHARD_MIN_BYTES or
+    above ANALYZER_BATCH_FILES files. Largest shards come first so the long
+    ones start early.
+    """
+    sizes = {}
+    by_language = {}
+    for path in paths:
+        try:
+            sizes[path] = os.path.getsize(os.path.join(worktree, path))
+        except OSError:
+            sizes[path] = 0
+        by_language.setdefault(language_of(path), []).append(path)
+
+    target = max(SHARD_MIN_BYTES, sum(sizes.values()) / max(1, workers * SHARDS_PER_WORKER))
+    shards = []
+    for language, files in by_language.items():
+        count = max(
+            math.ceil(sum(sizes[path] for path in files) / target),
+            math.ceil(len(files) / ANALYZER_BATCH_FILES),
+            1,
+        )
+        language_shards = [Shard(language) for _ in range(count)]
+        # Largest file first onto the lightest shard that still has room
+        lightest = [(0, i) for i in range(count)]
+        for path in sorted(files, key=sizes.get, reverse=True):
+            _, i = heapq.heappop(lightest)
+            shard = language_shards[i]
+            shard.paths.append(path)
+            shard.size += sizes[path]
+            if len(shard.paths) < ANALYZER_BATCH_FILES:
+                heapq.heappush(lightest, (shard.size, i))
+        shards.extend(shard for shard in language_shards if shard.paths)
+    return sorted(shards, key=lambda shard: shard.size, reverse=True)
+
+
+def analyze_sharded(
+    analyzer: Analyzer,
+    worktree: str,
+    paths: list,
+    pool: CpuPool = cpu_pool,
+    timeout: float = ANALYSIS_SHARD_TIMEOUT_SECONDS,
+    check: Optional[Callable[[], None]] = None,
+) -> Iterator[tuple]:
+    """
+    Run an analyzer over files in parallel shards on the process pool,
+    yielding (shard paths, {path: findings}) as each shard finishes. Files
+    that time out even on their own are yielded with None for results.
+    Shards not started yet are cancelled if the caller stops early or
+    `check` raises.
+    """
+    pending = {}
+    for shard in plan_shards(worktree, paths, pool.workers):
+        pending[pool.submit(run_shard, analyzer, worktree, shard.paths, timeout)] = shard.paths
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=ANALYSIS_CHECK_INTERVAL_SECONDS, return_when=FIRST_COMPLETED)
+            if check is not None:
+                check()
+            for future in done:
+                shard_paths = pending.pop(future)
+                try:
+                    results = future.result()
+                except AnalyzerTimeout:
+                    if len(shard_paths) == 1:
+                        print(f"{analyzer.name} timed out on {shard_paths[0]}; skipping it.")
+                        yield shard_paths, None
+                        continue
+                    middle = len(shard_paths) // 2
+                    for half in (shard_paths[:middle], shard_paths[middle:]):
+                        pending[pool.submit(run_shard, analyzer, worktree, half, timeout)] = half
+                    continue
+                yield shard_paths, results
+    finally:
+        for future in pending:
+            future.cancel()
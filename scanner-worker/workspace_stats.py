@@ -0,0 +1,48 @@
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import insert
+from models import WorkspaceStats
+
+# Mirrors api-backend/workspace_stats.py, which also owns reconciliation
+
+SCAN_STATUSES = ("queued", "running", "completed", "failed", "superseded")
+COUNTER_COLUMNS = ("repo_count",) + tuple(f"{status}_scans" for status in SCAN_STATUSES) + (
+    "critical_findings",
+    "high_findings",
+    "medium_findings",
+    "low_findings",
+)
+
+
+def status_transition(old_status, new_status, count: int = 1) -> dict:
+    """Counter deltas for `count` jobs moving from old_status to new_status (None for created)"""
+    deltas = {}
+    if old_status is not None:
+        deltas[f"{old_status}_scans"] = -count
+    if new_status is not None:
+        deltas[f"{new_status}_scans"] = deltas.get(f"{new_status}_scans", 0) + count
+    return deltas
+
+
+def stats_delta_statement(workspace_id, deltas: dict):
+    """
+    Upsert adding deltas to a workspace's counters. Run it in the same
+    transaction as the change it accounts for, so the two commit together.
+    """
+    unknown = set(deltas) - set(COUNTER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown workspace stats counters: {sorted(unknown)}")
+
+    stmt = insert(WorkspaceStats).values(workspace_id=workspace_id, updated_at=datetime.utcnow(), **deltas)
+    return stmt.on_conflict_do_update(
+        index_elements=[WorkspaceStats.workspace_id],
+        set_={
+            **{column: getattr(WorkspaceStats, column) + stmt.excluded[column] for column in deltas},
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+
+def apply_stats_delta(db, workspace_id, deltas: dict):
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if deltas:
+        db.execute(stats_delta_statement(workspace_id, deltas))